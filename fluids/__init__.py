@@ -1,6 +1,6 @@
 from fluids.sim import FluidSim
 from fluids.state import State
-from fluids.datasaver import DataSaver
+from fluids.datasaver import DataSaver, ColumnReader, BatchReader
 from fluids.consts import *
 from fluids.actions import *
 from fluids.version import __version__
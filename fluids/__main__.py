@@ -1,6 +1,14 @@
 import fluids
-from fluids.utils import fluids_print
+from fluids.utils import fluids_print, fluids_assert, get_memory_usage, Profiler
 import argparse
+import json
+import sys
+import time
+
+if len(sys.argv) > 1 and sys.argv[1] in ["serve", "loadtest"]:
+    from fluids.server import main
+    main(sys.argv[1:])
+    sys.exit(0)
 
 key_help = """
 Keyboard commands for when visualizer is running:
@@ -29,8 +37,22 @@ parser.add_argument('--no-trafficlights', dest='trafficlights', action='store_fa
                     help='Disables vehicle crossing lights')
 parser.add_argument('--no-pedlights', dest='pedlights', action='store_false', default=True,
                     help='Disables pedestrian crossing lights')
-parser.add_argument('--time', metavar='N', type=int, default=0,
+parser.add_argument('--time', '--steps', metavar='N', dest='time', type=int, default=0,
                     help="Max time to run simulation")
+parser.add_argument('--seed', metavar='N', type=int, default=None,
+                    help='Seed of the state. Default is a random seed')
+parser.add_argument('--headless', action='store_true', default=False,
+                    help='Runs without visualization or keyboard control, for --steps steps')
+parser.add_argument('--actions', metavar='str', type=str, default="supervisor",
+                    choices=["supervisor", "constant"],
+                    help='Actions of the controlled cars in headless mode. Constant actions neither steer nor accelerate')
+parser.add_argument('--report', metavar='str', type=str, default="text",
+                    choices=["text", "json"],
+                    help='Format of the summary printed at the end of headless mode. json prints it as the last line')
+parser.add_argument('--no-profile', dest='profile', action='store_false', default=True,
+                    help='Leaves the time of the stages inside FluidSim out of the headless summary')
+parser.add_argument('--trace', metavar='file', type=str, default="",
+                    help='Appends the stage times of every tick of headless mode to this JSON lines file')
 parser.add_argument('--state', metavar='file', type=str, default=fluids.STATE_CITY,
                     help='Layout file for state generation')
 parser.add_argument('--datasaver', metavar='datasaver', type=str, default="",
@@ -39,6 +61,9 @@ parser.add_argument('--datasaver', metavar='datasaver', type=str, default="",
 parser.add_argument('--fps', metavar='N', dest='fps', type=int, default=0,
                     help='Sets max FPS, default is unlimited FPS')
 args = parser.parse_args()
+if args.headless:
+    fluids_assert(args.time, "Headless mode needs a number of steps")
+    args.v = 0
 fluids_print("Parameters: Num background cars : {}".format(args.b))
 fluids_print("            Num controlled cars : {}".format(args.c))
 fluids_print("            Num controlled peds : {}".format(args.p))
@@ -50,6 +75,9 @@ fluids_print("            Simulation time     : {}".format("unlimited" if not ar
 fluids_print("            Pedestrian lights   : {}".format("enabled" if args.pedlights else "disabled"))
 fluids_print("            Traffic lights      : {}".format("enabled" if args.trafficlights else "disabled"))
 fluids_print("            Max FPS             : {}".format("unbound" if not args.fps else args.fps))
+fluids_print("            Seed                : {}".format("random" if args.seed is None else args.seed))
+if args.headless:
+    fluids_print("            Headless actions    : {}".format(args.actions))
 
 fluids_print("")
 
@@ -64,26 +92,115 @@ simulator = fluids.FluidSim(visualization_level=args.v,
                             obs_space          =obs,
                             screen_dim         =args.screen_dim,
                             background_control =fluids.BACKGROUND_CSP)
+if args.headless and (args.profile or args.trace):
+    simulator.set_profiler(Profiler(trace_path=args.trace or None))
 
 
+build_start = time.perf_counter()
 state = fluids.State(layout=args.state,
                      background_cars    =args.b,
                      controlled_cars    =args.c,
                      background_peds    =args.p,
                      use_traffic_lights =args.trafficlights,
-                     use_ped_lights     =args.pedlights)
+                     use_ped_lights     =args.pedlights,
+                     vis_level          =0 if args.headless else 1,
+                     seed               =args.seed)
 
 simulator.set_state(state)
+build_time = time.perf_counter() - build_start
 
 if args.datasaver != "":
     data_saver = fluids.DataSaver(fluid_sim=simulator, file_path=args.datasaver, batch_size=4)
     simulator.set_data_saver(data_saver)
 
-t = 0
-while not args.time or t < args.time:
-    actions = {k: fluids.KeyboardAction() for k in simulator.get_control_keys()}
-    rew = simulator.step(actions)
-    obs = simulator.get_observations(simulator.get_control_keys())
-    simulator.render()
-    t = t + 1
+def run_headless():
+    """
+    Steps the simulation without rendering, timing every stage of a tick
+
+    Returns
+    -------
+    dict
+        Summary of the run
+    """
+    keys = list(simulator.get_control_keys())
+    stage_times = {"actions": 0.0, "step": 0.0, "observations": 0.0, "collisions": 0.0}
+    collision_steps = 0
+    collisions = 0
+    colliding = set()
+    start = time.perf_counter()
+    for t in range(args.time):
+        t0 = time.perf_counter()
+        if args.actions == "supervisor":
+            actions = simulator.get_supervisor_actions(fluids.SteeringAccAction, keys=keys)
+        else:
+            actions = {k: fluids.SteeringAccAction(0, 0) for k in keys}
+        t1 = time.perf_counter()
+        simulator.step(actions)
+        t2 = time.perf_counter()
+        # Observations are lazy, so build their arrays as a learner would
+        for obs in simulator.get_observations(keys).values():
+            if obs:
+                obs.get_array()
+        t3 = time.perf_counter()
+        now_colliding = {k for k, hit in simulator.detect_collision(keys).items() if hit}
+        t4 = time.perf_counter()
+        # A collision lasts until the car gets clear, and is only counted when it starts
+        collision_steps += len(now_colliding)
+        collisions += len(now_colliding - colliding)
+        colliding = now_colliding
+        for name, t_start, t_end in [("actions", t0, t1), ("step", t1, t2),
+                                     ("observations", t2, t3), ("collisions", t3, t4)]:
+            stage_times[name] += t_end - t_start
+    elapsed = time.perf_counter() - start
+    simulator.profiler.close(simulator.state.time)
+
+    peak_rss = get_memory_usage()["peak_rss"]
+    return {"steps"           : args.time,
+            "seed"            : args.seed,
+            "layout"          : args.state,
+            "controlled_cars" : args.c,
+            "background_cars" : args.b,
+            "background_peds" : args.p,
+            "obs_space"       : args.o,
+            "actions"         : args.actions,
+            "build_time"      : build_time,
+            "elapsed"         : elapsed,
+            "steps_per_second": args.time / elapsed,
+            "stages"          : {name: {"total": total, "mean_ms": 1000 * total / args.time}
+                                 for name, total in stage_times.items()},
+            "peak_rss_mb"     : None if peak_rss is None else peak_rss / 2**20,
+            "collisions"      : collisions,
+            "collision_steps" : collision_steps,
+            "profile"         : simulator.get_profile()}
+
+if args.headless:
+    report = run_headless()
+else:
+    t = 0
+    while not args.time or t < args.time:
+        actions = {k: fluids.KeyboardAction() for k in simulator.get_control_keys()}
+        rew = simulator.step(actions)
+        obs = simulator.get_observations(simulator.get_control_keys())
+        simulator.render()
+        t = t + 1
+
+if args.datasaver != "":
+    data_saver.close()
+
+if args.headless:
+    if args.report == "json":
+        print(json.dumps(report))
+    else:
+        fluids_print("Ran {} steps in {:.2f} s: {:.1f} steps/s".format(report["steps"], report["elapsed"],
+                                                                     report["steps_per_second"]))
+        for name, stage in report["stages"].items():
+            fluids_print("    {:<13}: {:.2f} ms/step".format(name, stage["mean_ms"]))
+        if report["profile"]:
+            fluids_print("Inside FluidSim:")
+        for name, stage in report["profile"].items():
+            fluids_print("    {:<24}: {:.2f} ms/step, {} calls".format(name, stage["per_tick_ms"], stage["calls"]))
+        fluids_print("Peak memory: {} MB".format("unknown" if report["peak_rss_mb"] is None
+                                                 else int(report["peak_rss_mb"])))
+        fluids_print("Controlled car collisions: {} ({} steps in collision)".format(report["collisions"],
+                                                                                  report["collision_steps"]))
 
@@ -90,3 +90,21 @@ class LastValidAction(Action):
     """
     def __init__(self):
         pass
+
+
+def encode_action(action):
+    """
+    Returns a JSON serializable form of action, which can be given to decode_action
+    """
+    if not isinstance(action, Action):
+        return action
+    return {"type": type(action).__name__,
+            "args": {k: float(v) for k, v in action.__dict__.items()}}
+
+def decode_action(data):
+    """
+    Rebuilds an action encoded with encode_action
+    """
+    if not isinstance(data, dict):
+        return data
+    return globals()[data["type"]](**data["args"])
@@ -1,13 +1,12 @@
 import numpy as np
 from scipy.integrate import odeint
 import pygame
-import random
 import shapely
 import shapely.ops
 
 from fluids.assets.shape import Shape
 from fluids.actions import *
-from fluids.utils import PIDController, fluids_assert
+from fluids.utils import PIDController, pid_controls, fluids_assert
 from fluids.obs import *
 from fluids.consts import *
 
@@ -22,6 +21,44 @@ def integrator(state, t, steer, acc, lr, lf):
     dvel = acc
     return dx, dy, dvel, dangle
 
+def velocity_controls(cars, target_vels, update=True):
+    """
+    Computes the steering and acceleration that Car.PIDController gives several cars at once
+
+    Parameters
+    ----------
+    cars: list of Car
+    target_vels: np.array
+        Target velocities in range (0, 1), one per car
+    update: bool
+        Sets whether the integral errors of the controllers are updated
+
+    Returns
+    -------
+    np.array
+        Array of shape (len(cars), 2) with steering and acceleration
+    """
+    x          = np.array([car.x for car in cars], dtype=np.float64)
+    y          = np.array([car.y for car in cars], dtype=np.float64)
+    target_x   = np.array([car.waypoints[0].x if len(car.waypoints) else car.x for car in cars], dtype=np.float64)
+    target_y   = np.array([car.waypoints[0].y if len(car.waypoints) else car.y for car in cars], dtype=np.float64)
+    target_vel = np.asarray(target_vels, dtype=np.float64) * np.array([car.max_vel for car in cars])
+
+    ac2 = np.arctan2(y - target_y, target_x - x)
+    angle = np.array([car.angle for car in cars], dtype=np.float64) % (2 * np.pi)
+    for car, a in zip(cars, angle.tolist()):
+        car.angle = a
+    ang = np.where(angle < np.pi, angle, angle - 2 * np.pi)
+
+    e_angle = ac2 - ang
+    e_angle = np.where(e_angle > np.pi, e_angle - 2 * np.pi,
+                       np.where(e_angle < -np.pi, e_angle + 2 * np.pi, e_angle))
+    e_vel = target_vel - np.array([car.vel for car in cars], dtype=np.float64)
+
+    steer = pid_controls([car.PID_steer for car in cars], e_angle, update=update)
+    acc = pid_controls([car.PID_acc for car in cars], e_vel, update=update)
+    return np.stack([steer, acc], axis=1)
+
 class Car(Shape):
     def __init__(self, vel=0, mass=400, max_vel=5,
                  planning_depth=20, **kwargs):
@@ -50,6 +87,7 @@ class Car(Shape):
         self.PID_acc        = PIDController(1.0, 0, 0)
         self.PID_steer      = PIDController(2.0, 0, 0)
         self.last_action    = SteeringAccAction(0, 0)
+        self.last_control   = (0.0, 0.0)
         self.last_obs       = None
         self.last_distance  = 0
         self.last_to_goal   = 0
@@ -76,6 +114,7 @@ class Car(Shape):
     def raw_step(self, steer, f_acc):
         steer = max(min(1, steer), -1)
         f_acc = max(min(1, f_acc), -1)
+        self.last_control = (steer, f_acc)
         steer = np.radians(30 * steer)
         acc = 100 * f_acc / self.mass
 
@@ -100,36 +139,44 @@ class Car(Shape):
 
 
     def step(self, action):
-
-        distance_to_next = self.dist_to(self.waypoints[0])
-        startx, starty = self.x, self.y
-
+        if type(action) == LastValidAction:
+            self.step(self.last_action)
+            return
         if action == None:
-            self.raw_step(0, 0)
-            self.last_action = action
+            steer, acc = 0, 0
         elif type(action) == SteeringAccAction:
-            self.raw_step(*action.get_action())
-            self.last_action = action
+            steer, acc = action.get_action()
         elif type(action) == SteeringAction:
             fluids_assert(False, "Cars cannot receive a raw steering action")
         elif type(action) == VelocityAction:
             steer, acc = self.PIDController(action).get_action()
             #steer += np.random.randn() * 0.5 * steer
             #acc += np.random.randn() * 0.5 * acc / 5
-            self.raw_step(steer, acc)
-            self.last_action = action
         elif type(action) == SteeringVelAction:
             steer, vel = action.get_action()
             _, acc = self.PIDController(VelocityAction(vel)).get_action()
-            self.raw_step(steer, acc)
-            self.last_action = action
-        elif type(action) == LastValidAction:
-            self.step(self.last_action)
-            return
         else:
             fluids_assert(False, "Car received an illegal action")
+        self.step_control(steer, acc)
+        self.last_action = action
+
+    def step_control(self, steer, acc):
+        """
+        Applies a raw steering and acceleration control for one frame, and advances the waypoints
+        """
+        distance_to_next = self.dist_to(self.waypoints[0])
+        startx, starty = self.x, self.y
+        self.raw_step(steer, acc)
+        self.update_waypoints(distance_to_next, startx, starty)
+
+    def update_waypoints(self, distance_to_next, startx, starty):
+        """
+        Extends the plan up to planning_depth waypoints, updates progress counters,
+        and drops the first waypoint once it is reached
+        """
         while len(self.waypoints) < self.planning_depth and len(self.waypoints) and len(self.waypoints[-1].nxt):
-            next_edge = random.choice(self.waypoints[-1].nxt)
+            nxt = self.waypoints[-1].nxt
+            next_edge = nxt[self.state.car_rng.integers(len(nxt))]
             next_waypoint = next_edge.out_p
             line = next_edge.shapely_obj
             # line = shapely.geometry.LineString([(self.waypoints[-1].x, self.waypoints[-1].y),
@@ -149,7 +196,16 @@ class Car(Shape):
             if len(self.trajectory):
                 self.trajectory.pop(0)
 
-        return
+    def set_waypoints(self, waypoints):
+        """
+        Replaces the planned waypoints, and rebuilds the trajectory along their edges
+        """
+        self.waypoints = list(waypoints)
+        self.trajectory = []
+        for wp0, wp1 in zip(self.waypoints, self.waypoints[1:]):
+            edge = [e for e in wp0.nxt if e.out_p is wp1][0]
+            self.trajectory.append(((wp0.x, wp0.y), (wp1.x, wp1.y), edge.shapely_obj))
+        self.last_blob_time = -1
 
     def get_direction(self):
         """
@@ -212,6 +268,13 @@ class Car(Shape):
             return False
         return super(Car, self).can_collide(other)
 
+    def freeze(self):
+        frozen = super(Car, self).freeze()
+        frozen.trajectory = list(self.trajectory)
+        # Otherwise every observation would keep the previous one, and its surfaces, alive through its frozen car
+        frozen.last_obs   = None
+        return frozen
+
     def get_future_shape(self):
         if self.last_blob_time != self.running_time:
             if len(self.waypoints) and len(self.trajectory):
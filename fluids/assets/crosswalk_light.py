@@ -6,6 +6,8 @@ GREEN = (0, 200, 0)
 
 
 class CrossWalkLight(Shape):
+    phase_colors = [RED, GREEN]
+
     def __init__(self, init_color="red", **kwargs):
         color = {"red":RED,
                  "green":GREEN}[init_color]
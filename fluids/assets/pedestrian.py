@@ -1,4 +1,3 @@
-import random
 import numpy as np
 import shapely
 import pygame
@@ -15,6 +14,11 @@ class Pedestrian(Shape):
         self.trajectory     = []
         self.planning_depth = planning_depth
 
+    def freeze(self):
+        frozen = super(Pedestrian, self).freeze()
+        frozen.trajectory = list(self.trajectory)
+        return frozen
+
     def get_future_shape(self):
         if len(self.waypoints) and len(self.trajectory):
             line = shapely.geometry.LineString([(self.waypoints[0].x, self.waypoints[0].y),
@@ -23,6 +27,17 @@ class Pedestrian(Shape):
                                                  + [self.shapely_obj, line]).buffer(self.ydim*0.2, resolution=2)
         else:
             return self.shapely_obj.buffer(self.ydim*0.3, resolution=2)
+    def set_waypoints(self, waypoints):
+        """
+        Replaces the planned waypoints, and rebuilds the trajectory between them
+        """
+        self.waypoints = list(waypoints)
+        self.trajectory = []
+        for wp0, wp1 in zip(self.waypoints, self.waypoints[1:]):
+            line = shapely.geometry.LineString([(wp0.x, wp0.y),
+                                                (wp1.x, wp1.y)]).buffer(self.ydim*0.5)
+            self.trajectory.append(((wp0.x, wp0.y), (wp1.x, wp1.y), line))
+
     def step(self, action):
         if len(self.waypoints) and action:
             x0, y0 = self.x, self.y
@@ -33,7 +48,8 @@ class Pedestrian(Shape):
             angle = angle
             self.update_points(x, y, angle)
         while len(self.waypoints) < self.planning_depth and len(self.waypoints) and len(self.waypoints[-1].nxt):
-            next_waypoint = random.choice(self.waypoints[-1].nxt).out_p
+            nxt = self.waypoints[-1].nxt
+            next_waypoint = nxt[self.state.ped_rng.integers(len(nxt))].out_p
             line = shapely.geometry.LineString([(self.waypoints[-1].x, self.waypoints[-1].y),
                                                 (next_waypoint.x, next_waypoint.y)]).buffer(self.ydim*0.5)
             self.trajectory.append(((self.waypoints[-1].x, self.waypoints[-1].y),
@@ -1,3 +1,4 @@
+import copy
 import numpy as np
 import pygame
 import shapely.geometry
@@ -54,6 +55,14 @@ class Shape(object):
         self.border_color  = border_color
         self.state         = state
         self.waypoints     = [] if not waypoints else waypoints
+    def freeze(self):
+        """
+        Returns a shallow copy that keeps the current geometry after this object moves
+        """
+        frozen = copy.copy(self)
+        frozen.waypoints = list(self.waypoints)
+        return frozen
+
     def intersects(self, other):
         return self.shapely_obj.intersects(other.shapely_obj)
 
@@ -93,20 +102,34 @@ class Shape(object):
         if not color:
             color = self.color
         if self.xdim != 1 or self.ydim != 1:
+            points = self.points.tolist()
             if color:
-                pygame.draw.polygon(surface, color, self.points)
+                pygame.draw.polygon(surface, color, points)
             if border:
-                pygame.draw.polygon(surface, self.border_color, self.points, border)
+                pygame.draw.polygon(surface, self.border_color, points, border)
         else:
             pygame.draw.circle(surface, color, (int(self.x), int(self.y)), 5)
 
 
     def render_debug(self, surface, color=(255, 0, 0), width=10):
-        pygame.draw.polygon(surface, color, self.points, width)
+        pygame.draw.polygon(surface, color, self.points.tolist(), width)
 
     def step(self, actions):
         pass
 
+    def set_pose(self, x, y, angle, points):
+        """
+        Places the shape at an exact pose, using points as its outline
+        """
+        self.x = x
+        self.y = y
+        self.angle = angle
+        self.points = np.array(points, dtype=np.float64)
+        self.shapely_obj = shapely.geometry.Polygon(self.points)
+        xs, ys = self.points[:,0], self.points[:,1]
+        self.minx, self.maxx = min(xs), max(xs)
+        self.miny, self.maxy = min(ys), max(ys)
+
     def update_points(self, x, y, angle):
         dx = self.x - x
         dy = self.y - y
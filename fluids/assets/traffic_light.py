@@ -5,6 +5,8 @@ from fluids.consts import *
 
 
 class TrafficLight(Shape):
+    phase_colors = [RED, GREEN, YELLOW]
+
     def __init__(self, init_color="red", **kwargs):
         color = {"red":RED,
                  "green":GREEN,
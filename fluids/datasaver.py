@@ -5,46 +5,167 @@ import pickle
 import os
 import time
 import gzip
+import json
+import weakref
+import threading
+from six.moves import queue
+
+class NpyAppender():
+    """
+    Appends rows of a structured array to a single .npy file.
+    The header is rewritten in place after every append, so the file is always
+    a valid .npy file that can be loaded (or memory-mapped) with np.load.
+    """
+    def __init__(self, file_name, dtype, row_shape=(), n_rows=None):
+        """
+        If n_rows is specified, the existing file is reopened and truncated to its first n_rows rows.
+        """
+        self.file_name = file_name
+        self.dtype     = dtype
+        self.row_shape = tuple(row_shape)
+        self.n_rows    = n_rows or 0
+        self.f         = open(file_name, "wb+" if n_rows is None else "rb+")
+        self.write_header()
+        if n_rows is not None:
+            self.f.truncate(self.header_len + self.n_rows * self.dtype.itemsize * int(np.prod(self.row_shape)))
+
+    def write_header(self):
+        self.f.seek(0)
+        # numpy pads the shape field of the header, so its length does not change as rows are added
+        np.lib.format.write_array_header_1_0(self.f,
+                                             {"descr"        : np.lib.format.dtype_to_descr(self.dtype),
+                                              "fortran_order": False,
+                                              "shape"        : (self.n_rows,) + self.row_shape})
+        self.header_len = self.f.tell()
+        self.f.seek(0, os.SEEK_END)
+
+    def append(self, rows):
+        self.f.seek(0, os.SEEK_END)
+        np.ascontiguousarray(rows).tofile(self.f)
+        self.n_rows += len(rows)
+        self.write_header()
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+TICK_DTYPE = np.dtype([('time', np.int32), ('start', np.int64), ('stop', np.int64)])
+
+
+def get_npz_shards(file_path):
+    """
+    Returns the sorted numbers of the [file_path]_[n].npz shards written by DataSaver
+    """
+    prefix = os.path.basename(file_path) + "_"
+    directory = os.path.dirname(file_path) or "."
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(f[len(prefix):-4]) for f in os.listdir(directory)
+                  if f.startswith(prefix) and f.endswith(".npz") and f[len(prefix):-4].isdigit())
+
+
+def write_loop(saver_ref, write_queue):
+    """
+    Main loop of the writer thread of a DataSaver. Only a weak reference to the saver is kept
+    while waiting, so the thread does not keep an unused saver alive.
+    """
+    while True:
+        item = write_queue.get()
+        saver = saver_ref()
+        if item is None or saver is None:
+            write_queue.task_done()
+            return
+        saver.write_item(item)
+        saver = None
+        write_queue.task_done()
+
+
+def close_data_saver(saver_ref, write_queue):
+    """
+    Closes a DataSaver that is still alive at exit, or stops the writer thread of one that was collected
+    """
+    saver = saver_ref()
+    if saver is not None:
+        saver.close()
+    else:
+        write_queue.put(None)
+
 
 class DataSaver():
     """
-    Saves data in numpy files organized by key. After loading from [filename]_[filenum].npy, data is in numpy array with the following data type
+    Saves data in numpy files organized by key. After loading from [filename]_[filenum].npz, data is in numpy array with the following data type
     np.dtype([('time', np.int32), ('obs_name', [OBS_DATA_TYPE], [OBS_SHAPE]), ..., ('act_name', np.uint8, [OBS_SHAPE])])
     Once loading the np.array, data can be accessed (for example) with data[data['key']==128] to get all data for 'key'==128
+
+    With format="npy", all data is appended to a single [filename].npy file instead, which can be memory-mapped with np.load(file, mmap_mode='r').
+
+    With format="columns", [filename] is a directory holding one appendable .npy file per field, along with a
+    (time -> row range) index. Use ColumnReader to read per car or per time window slices without copying.
+    Every tick must then record the same keys in the same order, so that the rows of each car are evenly strided.
+
+    By default, full batches are compressed and written by a background thread while the simulation keeps
+    stepping. Call close() (or flush()) before reading the files to make sure all data has been written.
     """
 
     #def __init__(self, fluid_sim, file, keys=None, obs=[OBS_NONE], act=[SteeringAccAction], batch_size=500, make_dir=True, obs_kwargs={}):
-    def __init__(self, fluid_sim, file_path, keys=None, obs={"obs_grid": (OBS_GRID, {"obs_dim": 300, "shape": (40, 40)})}, act={"steeringacc": SteeringAccAction}, batch_size=500, make_dir=True):   
+    def __init__(self, fluid_sim, file_path, keys=None, obs={"obs_grid": (OBS_GRID, {"obs_dim": 300, "shape": (40, 40)}, {"dtype": np.uint8})}, act={"steeringacc": SteeringAccAction}, batch_size=500, make_dir=True, format="npz", background=True, max_pending=2):
         """
             Save data from FLUIDS simulation.
 
             fluid_sim (required): FluidSim data that is being saved
-            file (required): Filename with path to dump data to. Multiple files 
+            file (required): Filename with path to dump data to. Multiple files
                              with suffixes _1, _2 etc. might be created if data
                              gets too large
-            keys: Keys of cars to gather observations from. Default is controlled car keys.
-            obs: Dict of observations to record. Format is (obs_name: (obs_type, obs_kwargs)) Default is [OBS_NONE]
+            keys: Keys of cars to gather observations from. Default is background car keys.
+            obs: Dict of observations to record. Format is (obs_name: (obs_type, obs_kwargs[, array_kwargs])),
+                 where array_kwargs are passed to FluidsObs.get_array. Default is a uint8 grid observation.
             act: Dict of actions to record. Format is (act_name: act_type) Default is [SteeringAccAction]
-            batch_size: Number of iterations to run before dumping data. Default is 500.
+            batch_size: Number of iterations to buffer before writing data. Default is 500.
             make_dir: Boolean. Flags if directory specified should be created or not.
+            format: "npz" writes a compressed file per batch. "npy" appends every batch to one uncompressed file.
+                    "columns" appends every field to its own uncompressed file, see ColumnReader.
+            background: Boolean. If set, batches are written by a background thread. Default is True.
+            max_pending: Number of full batches that can wait for the background thread before
+                         accumulate blocks. Default is 2.
         """
+        fluids_assert(format in ["npz", "npy", "columns"], "DataSaver format must be npz, npy or columns")
         self.fluid_sim = fluid_sim
         self.file = file_path
+        self.keys = keys
         self.obs = obs
         self.act = act
         self.batch_size = batch_size
+        self.format = format
         if make_dir:
             dir = os.path.dirname(self.file)
             os.makedirs(dir, exist_ok=True)
 
         self.curr_batch = 0
         self.file_num = 0
-        self.curr_data = []
+        self.n_rows = 0
+        self.chunk = None
         self.dtype = None
+        self.appender = None
+        self.columns = None
+        self.column_keys = None
+
+        self.background = background
+        self.max_pending = max_pending
+        self.write_queue = queue.Queue(maxsize=max_pending)
+        self.free_chunks = queue.Queue()
+        self.n_chunks = 0
+        self.writer = None
+        self.write_error = None
+
+    def get_keys(self):
+        if self.keys is not None:
+            return self.keys
+        return self.fluid_sim.state.background_cars.keys()
 
     def generate_dtype(self):
         dtype = [('time', np.int32), ('key', np.int32)]
-        k = list(self.fluid_sim.state.background_cars.keys())[0]
+        k = list(self.get_keys())[0]
 
         obs, acts = self.get_obs_and_act(k)
         for obs_space, observation in obs:
@@ -53,11 +174,35 @@ class DataSaver():
             dtype.append((act_space, action.dtype, action.shape))
         self.dtype = np.dtype(dtype)
 
-    def get_obs_and_act(self, key):
+        # Rows are written straight into this chunk, which is reused after every flush
+        self.chunk = self.get_free_chunk()
+
+    def get_free_chunk(self):
+        """
+        Returns an empty chunk. In background mode, up to max_pending + 1 chunks are allocated,
+        after which this blocks until the writer thread returns one.
+        """
+        if self.free_chunks.empty() and self.n_chunks < self.max_pending + 1:
+            self.n_chunks += 1
+            return np.zeros(self.batch_size * len(self.get_keys()), dtype=self.dtype)
+        return self.free_chunks.get()
+
+    def get_obs_and_act(self, key, row=None):
+        """
+        Returns the observations and actions of key. If row is specified, observations
+        are written directly into its fields instead of into new arrays.
+        """
         observations = [] #(obs_name, observation)
         actions = [] #(act_name, action)
-        for obs_name, (obs_space, obs_kwargs) in self.obs.items():
-            curr_observation = self.fluid_sim.state.objects[key].make_observation(obs_space, **obs_kwargs).get_array() 
+        for obs_name, obs_spec in self.obs.items():
+            obs_space, obs_kwargs = obs_spec[:2]
+            array_kwargs = obs_spec[2] if len(obs_spec) > 2 else {}
+            observation = self.fluid_sim.get_observation(key, obs_space, obs_kwargs)
+            if row is not None:
+                array_kwargs = {k:v for k, v in array_kwargs.items() if k != "dtype"}
+                curr_observation = observation.get_array(out=row[obs_name], **array_kwargs)
+            else:
+                curr_observation = observation.get_array(**array_kwargs)
             observations.append((obs_name, curr_observation))
         for act_name, act_space in self.act.items():
             curr_act = self.fluid_sim.get_supervisor_actions(act_space, [key])[key].get_array()
@@ -65,34 +210,438 @@ class DataSaver():
         return observations, actions
 
     def dump(self):
-        file_name = "{}_{}.npz".format(self.file, self.file_num)
-        fluids_print("Dumping batch in {}".format(file_name))
-        dumped_data = np.array(self.curr_data, dtype=self.dtype)
-        fluids_print("Memory use: {} mb".format(dumped_data.nbytes * 1e-6))
-        start =  time.time()
-        np.savez_compressed(file_name, dumped_data)
-        fluids_print("Saved compressed file in {}s".format(round(time.time() - start)))
+        if not self.n_rows:
+            return
+        if not self.background:
+            self.write_chunk(self.chunk, self.n_rows, self.file_num)
+        else:
+            self.check_writer()
+            if self.writer is None:
+                self.writer = threading.Thread(target=write_loop, args=(weakref.ref(self), self.write_queue),
+                                               name="FLUIDS DataSaver")
+                self.writer.daemon = True
+                self.writer.start()
+                self.finalizer = weakref.finalize(self, close_data_saver, weakref.ref(self), self.write_queue)
+            self.write_queue.put((self.chunk, self.n_rows, self.file_num))
+            self.chunk = self.get_free_chunk()
 
         self.file_num += 1
-        self.curr_data = []
+        self.n_rows = 0
+
+    def write_chunk(self, chunk, n_rows, file_num):
+        dumped_data = chunk[:n_rows]
+        start =  time.time()
+        if self.format == "npz":
+            file_name = "{}_{}.npz".format(self.file, file_num)
+            fluids_print("Dumping batch in {}".format(file_name))
+            fluids_print("Memory use: {} mb".format(dumped_data.nbytes * 1e-6))
+            np.savez_compressed(file_name, dumped_data)
+            fluids_print("Saved compressed file in {}s".format(round(time.time() - start)))
+        elif self.format == "columns":
+            if self.columns is None:
+                self.open_columns()
+            fluids_print("Appending batch to {}".format(self.file))
+            offset = self.columns["time"].n_rows
+            for name, appender in self.columns.items():
+                appender.append(dumped_data[name])
+            # Rows of a tick are contiguous, so each change of time starts a new row range
+            times = dumped_data["time"]
+            starts = np.flatnonzero(np.r_[True, times[1:] != times[:-1]])
+            ticks = np.zeros(len(starts), dtype=TICK_DTYPE)
+            ticks["time"] = times[starts]
+            ticks["start"] = starts + offset
+            ticks["stop"] = np.r_[starts[1:], len(times)] + offset
+            # The index is written last, so readers never see ticks whose rows are missing
+            self.index.append(ticks)
+            fluids_print("Saved {} rows in {}s".format(self.columns["time"].n_rows, round(time.time() - start)))
+        else:
+            if self.appender is None:
+                self.appender = NpyAppender("{}.npy".format(self.file), self.dtype)
+            fluids_print("Appending batch to {}".format(self.appender.file_name))
+            self.appender.append(dumped_data)
+            fluids_print("Saved {} rows in {}s".format(self.appender.n_rows, round(time.time() - start)))
+
+    def open_columns(self, n_rows=None, n_ticks=None):
+        os.makedirs(self.file, exist_ok=True)
+        if self.column_keys is None:
+            self.column_keys = [int(k) for k in self.get_keys()]
+        self.columns = {}
+        fields = {}
+        for name in self.dtype.names:
+            field_dtype = self.dtype.fields[name][0]
+            base, shape = field_dtype.base, field_dtype.shape
+            self.columns[name] = NpyAppender(os.path.join(self.file, "{}.npy".format(name)), base, shape, n_rows)
+            fields[name] = {"dtype": np.lib.format.dtype_to_descr(base), "shape": list(shape)}
+        self.index = NpyAppender(os.path.join(self.file, "index.npy"), TICK_DTYPE, n_rows=n_ticks)
+        with open(os.path.join(self.file, "meta.json"), "w") as f:
+            json.dump({"fields": fields, "keys": self.column_keys}, f)
+
+    def write_item(self, item):
+        """
+        Writes a batch queued by dump, on the writer thread, and hands its chunk back for reuse
+        """
+        chunk, n_rows, file_num = item
+        try:
+            if self.write_error is None:
+                self.write_chunk(chunk, n_rows, file_num)
+        except Exception as e:
+            self.write_error = e
+        self.free_chunks.put(chunk)
+
+    def check_writer(self):
+        if self.write_error is not None:
+            error, self.write_error = self.write_error, None
+            raise error
 
     def accumulate(self):
         if self.dtype == None: self.generate_dtype() # Call here to prevent state access errors if DataSaver is created before state is set.
         self.curr_batch += 1
 
         time = self.fluid_sim.run_time()
-        for k in self.fluid_sim.state.background_cars.keys():
-            obs, acts = self.get_obs_and_act(k)
-            curr_data = np.zeros(1, dtype=self.dtype)
-            curr_data['time'] = time
-            curr_data['key'] = k
-            for obs_space, observation in obs:
-                curr_data[obs_space]= observation
+        keys = [int(k) for k in self.get_keys()]
+        if self.format == "columns":
+            # ColumnReader finds the rows of a car by stride, so the layout of a tick cannot change
+            if self.column_keys is None:
+                self.column_keys = keys
+            fluids_assert(keys == self.column_keys,
+                          "The columns format records the same keys, in the same order, every tick. "
+                          "Recorded {}, got {}".format(self.column_keys, keys))
+        for k in keys:
+            if self.n_rows == len(self.chunk):
+                self.dump()
+            row = self.chunk[self.n_rows]
+            row['time'] = time
+            row['key'] = k
+            obs, acts = self.get_obs_and_act(k, row)
             for act_space, action in acts:
-                curr_data[act_space] = action
-            self.curr_data.append(curr_data)
+                row[act_space] = action
+            self.n_rows += 1
         #print("data accumulated", self.curr_batch, self.batch_size)
         if self.curr_batch % self.batch_size == 0:
             self.dump()
             self.curr_batch = 0
 
+    def flush(self):
+        """
+        Writes out all buffered rows, and waits until every batch is on disk
+        """
+        self.dump()
+        if self.writer is not None:
+            self.write_queue.join()
+        self.check_writer()
+
+    def get_checkpoint(self):
+        """
+        Waits for pending writes, and returns the position in the output and the rows that are
+        still buffered. Used by FluidSim.save_checkpoint.
+
+        Returns
+        -------
+        (dict, np.array)
+            The buffered rows are None if nothing was recorded yet
+        """
+        if self.writer is not None:
+            self.write_queue.join()
+        self.check_writer()
+        position = {"file_num"  : self.file_num,
+                    "curr_batch": self.curr_batch,
+                    "rows"      : self.appender.n_rows if self.appender is not None else
+                                  self.columns["time"].n_rows if self.columns is not None else 0,
+                    "ticks"     : self.index.n_rows if self.columns is not None else 0,
+                    "keys"      : self.column_keys}
+        return position, None if self.dtype is None else self.chunk[:self.n_rows].copy()
+
+    def load_checkpoint(self, position, rows):
+        """
+        Continues the output from a position returned by get_checkpoint. Rows written after
+        that position are discarded, along with any rows buffered since.
+        """
+        # Pending batches must land before their files are closed and truncated
+        if self.writer is not None:
+            self.write_queue.join()
+        self.check_writer()
+        self.close_files()
+        if self.format == "npz":
+            # Shards from file_num on were written after the checkpoint, and would mix timelines
+            for n in get_npz_shards(self.file):
+                if n >= position["file_num"]:
+                    os.remove("{}_{}.npz".format(self.file, n))
+        self.file_num   = position["file_num"]
+        self.curr_batch = position["curr_batch"]
+        self.n_rows     = 0
+        self.column_keys = position.get("keys")
+        if rows is None:
+            return
+        if self.chunk is None or self.dtype != rows.dtype:
+            self.dtype       = rows.dtype
+            self.free_chunks = queue.Queue()
+            self.n_chunks    = 0
+            self.chunk       = self.get_free_chunk()
+        self.chunk[:len(rows)] = rows
+        self.n_rows = len(rows)
+        # Without rows on disk, the files are recreated by the next write
+        if self.format == "npy" and position["rows"]:
+            self.appender = NpyAppender("{}.npy".format(self.file), self.dtype, n_rows=position["rows"])
+        elif self.format == "columns" and position["rows"]:
+            self.open_columns(n_rows=position["rows"], n_ticks=position["ticks"])
+
+    def close_files(self):
+        """
+        Closes the open npy or column files
+        """
+        if self.appender is not None:
+            self.appender.close()
+            self.appender = None
+        if self.columns is not None:
+            for appender in self.columns.values():
+                appender.close()
+            self.index.close()
+            self.columns = None
+
+    def close(self):
+        """
+        Writes out all buffered rows, stops the writer thread and closes open files
+        """
+        if self.dtype is not None:
+            self.flush()
+        if self.writer is not None:
+            self.write_queue.put(None)
+            self.writer.join()
+            self.writer = None
+            self.finalizer.detach()
+        self.close_files()
+
+
+class ColumnReader():
+    """
+    Reads a run written by DataSaver with format="columns". Every field is memory-mapped,
+    and all lookups except get_rows return views into the mapped files, so nothing is
+    loaded until it is accessed.
+
+    Rows are laid out tick by tick, with one row per key in the same order every tick,
+    so the trajectory of a single car is a strided view of each column.
+    """
+    def __init__(self, path, fields=None):
+        """
+        Parameters
+        ----------
+        path: str
+            Directory written by DataSaver
+        fields: list of str
+            If specified, only these fields are mapped
+        """
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.path    = path
+        self.keys    = meta["keys"]
+        self.stride  = len(self.keys)
+        self.fields  = list(meta["fields"]) if fields is None else list(fields)
+        self.ticks   = np.load(os.path.join(path, "index.npy"), mmap_mode="r")
+        self.columns = {name: np.load(os.path.join(path, "{}.npy".format(name)), mmap_mode="r")
+                        for name in self.fields}
+        # Only rows covered by the index are complete in every column
+        self.n_rows  = int(self.ticks["stop"][-1]) if len(self.ticks) else 0
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, field):
+        return self.columns[field][:self.n_rows]
+
+    def project(self, fields):
+        return self.fields if fields is None else fields
+
+    def get_car(self, key, fields=None):
+        """
+        Returns the rows recorded for a single car
+
+        Parameters
+        ----------
+        key: int
+            Key of the car
+        fields: list of str
+            Fields to return. Defaults to all mapped fields
+
+        Returns
+        -------
+        dict of (field, np.array)
+            Strided views, in time order
+        """
+        fluids_assert(key in self.keys, "Key {} was not recorded".format(key))
+        first = self.keys.index(key)
+        return {name: self.columns[name][first:self.n_rows:self.stride] for name in self.project(fields)}
+
+    def get_row_range(self, start_time, stop_time):
+        """
+        Returns the (start, stop) rows covering ticks with start_time <= time < stop_time
+        """
+        times = self.ticks["time"]
+        lo, hi = np.searchsorted(times, [start_time, stop_time])
+        if lo >= hi:
+            return 0, 0
+        return int(self.ticks["start"][lo]), int(self.ticks["stop"][hi - 1])
+
+    def get_window(self, start_time, stop_time, fields=None):
+        """
+        Returns the rows of every car recorded with start_time <= time < stop_time
+
+        Returns
+        -------
+        dict of (field, np.array)
+            Contiguous views
+        """
+        start, stop = self.get_row_range(start_time, stop_time)
+        return {name: self.columns[name][start:stop] for name in self.project(fields)}
+
+    def get_rows(self, rows, fields=None):
+        """
+        Gathers arbitrary rows, for example a random minibatch. Unlike the other lookups, this copies.
+        """
+        rows = np.asarray(rows)
+        return {name: self.columns[name][rows] for name in self.project(fields)}
+
+
+class BatchReader():
+    """
+    Iterates over every row of a run written by DataSaver as fixed size minibatches.
+
+    Works with all DataSaver formats. Shards are loaded one ahead on a background thread,
+    and only the requested fields are kept in memory. With npz runs every shard is a single
+    compressed array, so it has to be decompressed in full before the fields are projected;
+    npy and columns runs only read the requested fields.
+    """
+    def __init__(self, file_path, batch_size=32, fields=None, shuffle_buffer=0, seed=None,
+                 shard_size=4096, drop_last=False, prefetch=True):
+        """
+        Parameters
+        ----------
+        file_path: str
+            The file_path the run was saved with
+        batch_size: int
+            Number of rows in each minibatch
+        fields: list of str
+            Fields to return. Defaults to all fields
+        shuffle_buffer: int
+            If nonzero, minibatches are drawn at random from a buffer holding at least this
+            many rows. Otherwise rows are returned in the order they were saved
+        seed: int or np.random.SeedSequence
+            Seed for shuffling
+        shard_size: int
+            Number of rows read at a time from npy and columns runs
+        drop_last: bool
+            If set, the last minibatch is dropped when it has less than batch_size rows
+        prefetch: bool
+            If set, the next shard is loaded on a background thread
+        """
+        self.file_path      = file_path
+        self.batch_size     = batch_size
+        self.fields         = fields
+        self.shuffle_buffer = shuffle_buffer
+        self.seed           = seed
+        self.shard_size     = shard_size
+        self.drop_last      = drop_last
+        self.prefetch       = prefetch
+
+    def get_shards(self):
+        """
+        Returns a list of functions, each loading one shard as a dict of (field, np.array)
+        """
+        if os.path.exists(os.path.join(self.file_path, "meta.json")):
+            reader = ColumnReader(self.file_path, self.fields)
+            columns = {name: reader[name] for name in reader.fields}
+            n_rows = len(reader)
+        elif os.path.exists(self.file_path + ".npy"):
+            data = np.load(self.file_path + ".npy", mmap_mode="r")
+            columns = {name: data[name] for name in (self.fields or data.dtype.names)}
+            n_rows = len(data)
+        else:
+            nums = get_npz_shards(self.file_path)
+            fluids_assert(len(nums), "No DataSaver output found at {}".format(self.file_path))
+            return [lambda n=n: self.load_npz("{}_{}.npz".format(self.file_path, n)) for n in nums]
+
+        return [lambda start=start: {name: np.array(column[start:start + self.shard_size])
+                                     for name, column in columns.items()}
+                for start in range(0, n_rows, self.shard_size)]
+
+    def load_npz(self, file_name):
+        with np.load(file_name) as f:
+            data = f["arr_0"]
+        return {name: np.ascontiguousarray(data[name]) for name in (self.fields or data.dtype.names)}
+
+    def load(self, shards):
+        """
+        Yields loaded shards. If prefetch is set, the next shard is loaded on a background thread
+        """
+        if not self.prefetch:
+            for load in shards:
+                yield load()
+            return
+
+        loaded = queue.Queue(maxsize=1)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    loaded.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def work():
+            try:
+                for load in shards:
+                    if not put(load()):
+                        return
+            except Exception as e:
+                put(e)
+                return
+            put(None)
+
+        loader = threading.Thread(target=work, name="FLUIDS BatchReader")
+        loader.daemon = True
+        loader.start()
+        try:
+            while True:
+                item = loaded.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed)
+        pool, n = {}, 0
+        for shard in self.load(self.get_shards()):
+            if n:
+                pool = {name: np.concatenate([pool[name][:n], shard[name]]) for name in shard}
+            else:
+                pool = shard
+            n = len(next(iter(pool.values())))
+            while n >= self.shuffle_buffer + self.batch_size:
+                batch, pool, n = self.take(pool, n, rng)
+                yield batch
+        while n >= self.batch_size or (n and not self.drop_last):
+            batch, pool, n = self.take(pool, n, rng)
+            yield batch
+
+    def take(self, pool, n, rng):
+        """
+        Removes a minibatch from the first n rows of pool. Returns the batch, the pool and its new size
+        """
+        b = min(self.batch_size, n)
+        if not self.shuffle_buffer:
+            return {name: v[:b] for name, v in pool.items()}, {name: v[b:] for name, v in pool.items()}, n - b
+
+        idx = rng.choice(n, b, replace=False)
+        batch = {name: v[idx] for name, v in pool.items()}
+        # Move rows from the end of the pool into the holes left by the batch
+        holes = idx[idx < n - b]
+        fillers = np.setdiff1d(np.arange(n - b, n), idx)
+        for v in pool.values():
+            v[holes] = v[fillers]
+        return batch, pool, n - b
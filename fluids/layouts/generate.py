@@ -0,0 +1,207 @@
+import json
+import os
+
+from fluids.utils import *
+
+
+def generate_grid(rows,
+                  cols,
+                  lanes            =1,
+                  block_size       =400,
+                  lane_width       =100,
+                  sidewalk_width   =50,
+                  border           =250,
+                  sidewalks        =True,
+                  crosswalks       =True,
+                  traffic_lights   =True,
+                  ped_lights       =True):
+    """
+    Generates a layout of a rows x cols grid of intersections, joined by two way roads.
+    The shipped fluids_state_city layout has the same dimensions as a 3 x 3 grid with the defaults.
+
+    Parameters
+    ----------
+    rows: int
+        Number of rows of intersections, at least 2
+    cols: int
+        Number of columns of intersections, at least 2
+    lanes: int
+        Number of lanes in each direction of every road
+    block_size: int
+        Length of the roads between intersections
+    lane_width: int
+        Width of every lane
+    sidewalk_width: int
+        Width of sidewalks and crosswalks
+    border: int
+        Width of the terrain around the grid
+    sidewalks: bool
+        Sets whether sidewalks are generated around every block and around the grid
+    crosswalks: bool
+        Sets whether crosswalks are generated across every road next to an intersection.
+        Pedestrians can only leave their block over crosswalks
+    traffic_lights: bool
+        Sets whether traffic lights are generated at intersections of three or four roads
+    ped_lights: bool
+        Sets whether crosswalks at those intersections get pedestrian lights
+
+    Returns
+    -------
+    dict
+        Layout in the format of the json files in fluids/layouts
+    """
+    fluids_assert(rows >= 2 and cols >= 2, "Grid layouts need at least 2 x 2 intersections")
+    fluids_assert(block_size > 2 * sidewalk_width, "block_size must leave room for sidewalks")
+    road = 2 * lanes * lane_width
+    pitch = road + block_size
+    offset = border + sidewalk_width + road / 2
+    xs = [offset + j * pitch for j in range(cols)]
+    ys = [offset + i * pitch for i in range(rows)]
+    dimension_x = int(round(2 * offset + (cols - 1) * pitch))
+    dimension_y = int(round(2 * offset + (rows - 1) * pitch))
+
+    static_objects = []
+    dynamic_objects = []
+    def add(objects, typ, x, y, **kwargs):
+        obj = {"type": typ, "x": x, "y": y}
+        obj.update(kwargs)
+        objects.append(obj)
+
+    # Terrain around the grid and inside every block
+    add(static_objects, "Terrain", dimension_x / 2, border / 2, xdim=dimension_x, ydim=border)
+    add(static_objects, "Terrain", dimension_x / 2, dimension_y - border / 2, xdim=dimension_x, ydim=border)
+    add(static_objects, "Terrain", border / 2, dimension_y / 2, xdim=border, ydim=dimension_y - 2 * border)
+    add(static_objects, "Terrain", dimension_x - border / 2, dimension_y / 2, xdim=border, ydim=dimension_y - 2 * border)
+    inner = block_size - 2 * sidewalk_width
+    for x0, x1 in zip(xs, xs[1:]):
+        for y0, y1 in zip(ys, ys[1:]):
+            add(static_objects, "Terrain", (x0 + x1) / 2, (y0 + y1) / 2, xdim=inner, ydim=inner)
+
+    # Intersections, and lanes that drive on the right
+    for x in xs:
+        for y in ys:
+            add(static_objects, "Street", x, y, xdim=road, ydim=road)
+    for k in range(lanes):
+        shift = lane_width * (k + 0.5)
+        for x0, x1 in zip(xs, xs[1:]):
+            for y in ys:
+                add(static_objects, "Lane", (x0 + x1) / 2, y + shift, xdim=block_size, ydim=lane_width, angle_deg=0)
+                add(static_objects, "Lane", (x0 + x1) / 2, y - shift, xdim=block_size, ydim=lane_width, angle_deg=-180)
+        for y0, y1 in zip(ys, ys[1:]):
+            for x in xs:
+                add(static_objects, "Lane", x - shift, (y0 + y1) / 2, xdim=block_size, ydim=lane_width, angle_deg=-90)
+                add(static_objects, "Lane", x + shift, (y0 + y1) / 2, xdim=block_size, ydim=lane_width, angle_deg=90)
+
+    # Sidewalks run along the roads, and meet at crossings next to the corners of intersections
+    walk = road / 2 + sidewalk_width / 2
+    if sidewalks:
+        corners = set()
+        for i, y in enumerate(ys):
+            for j, x in enumerate(xs):
+                for dx in [-walk, walk]:
+                    for dy in [-walk, walk]:
+                        corners.add((x + dx, y + dy))
+        for x, y in sorted(corners):
+            add(static_objects, "PedCrossing", x, y, xdim=sidewalk_width, ydim=sidewalk_width)
+        # Along every road between intersections, and around the outside of the grid
+        for x0, x1 in zip(xs, xs[1:]):
+            for y in ys:
+                for dy in [-walk, walk]:
+                    add(static_objects, "Sidewalk", (x0 + x1) / 2, y + dy, xdim=inner, ydim=sidewalk_width, angle_deg=0)
+        for y0, y1 in zip(ys, ys[1:]):
+            for x in xs:
+                for dx in [-walk, walk]:
+                    add(static_objects, "Sidewalk", x + dx, (y0 + y1) / 2, xdim=inner, ydim=sidewalk_width, angle_deg=90)
+        for x in xs:
+            for y in [ys[0] - walk, ys[-1] + walk]:
+                add(static_objects, "Sidewalk", x, y, xdim=road, ydim=sidewalk_width, angle_deg=0)
+        for y in ys:
+            for x in [xs[0] - walk, xs[-1] + walk]:
+                add(static_objects, "Sidewalk", x, y, xdim=road, ydim=sidewalk_width, angle_deg=90)
+
+    # Crosswalks over every road next to an intersection. Intersections of three or four roads get
+    # lights, which start with east-west traffic green and north-south traffic red
+    for i, y in enumerate(ys):
+        for j, x in enumerate(xs):
+            arms = {"north": i > 0, "south": i < rows - 1, "west": j > 0, "east": j < cols - 1}
+            lit = sum(arms.values()) >= 3
+            if crosswalks and sidewalks:
+                for arm, sign in [("north", -1), ("south", 1)]:
+                    if arms[arm]:
+                        add(static_objects, "CrossWalk", x, y + sign * walk, xdim=road, ydim=sidewalk_width)
+                        if lit and ped_lights:
+                            add(dynamic_objects, "CrossWalkLight", x - road / 2, y + sign * walk,
+                                init_color="green", angle_deg=0)
+                            add(dynamic_objects, "CrossWalkLight", x + road / 2, y + sign * walk,
+                                init_color="green", angle_deg=-180)
+                for arm, sign in [("west", -1), ("east", 1)]:
+                    if arms[arm]:
+                        add(static_objects, "CrossWalk", x + sign * walk, y, xdim=road, ydim=sidewalk_width, angle_deg=90)
+                        if lit and ped_lights:
+                            add(dynamic_objects, "CrossWalkLight", x + sign * walk, y - road / 2,
+                                init_color="red", angle_deg=-90)
+                            add(dynamic_objects, "CrossWalkLight", x + sign * walk, y + road / 2,
+                                init_color="red", angle_deg=90)
+            if lit and traffic_lights:
+                for k in range(lanes):
+                    shift = lane_width * (k + 0.5)
+                    if arms["east"]:
+                        add(dynamic_objects, "TrafficLight", x + road / 2, y - shift, init_color="green", angle_deg=0)
+                    if arms["west"]:
+                        add(dynamic_objects, "TrafficLight", x - road / 2, y + shift, init_color="green", angle_deg=-180)
+                    if arms["south"]:
+                        add(dynamic_objects, "TrafficLight", x + shift, y + road / 2, init_color="red", angle_deg=-90)
+                    if arms["north"]:
+                        add(dynamic_objects, "TrafficLight", x - shift, y - road / 2, init_color="red", angle_deg=90)
+
+    return {"dimension_x"    : dimension_x,
+            "dimension_y"    : dimension_y,
+            "static_objects" : static_objects,
+            "dynamic_objects": dynamic_objects}
+
+
+def write_layout(layout, file_path):
+    """
+    Writes a layout to a json file, which can be passed to fluids.State as its layout
+    """
+    dir = os.path.dirname(file_path)
+    if dir:
+        os.makedirs(dir, exist_ok=True)
+    with open(file_path, "w") as f:
+        json.dump(layout, f, indent=1)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate a FLUIDS layout of a grid of intersections')
+    parser.add_argument('rows', metavar='rows', type=int,
+                        help='Number of rows of intersections')
+    parser.add_argument('cols', metavar='cols', type=int,
+                        help='Number of columns of intersections')
+    parser.add_argument('out', metavar='file', type=str,
+                        help='Path of the json file to write')
+    parser.add_argument('--lanes', metavar='N', type=int, default=1,
+                        help='Number of lanes in each direction')
+    parser.add_argument('--block-size', metavar='N', dest='block_size', type=int, default=400,
+                        help='Length of the roads between intersections')
+    parser.add_argument('--no-sidewalks', dest='sidewalks', action='store_false', default=True,
+                        help='Disables sidewalks and crosswalks')
+    parser.add_argument('--no-crosswalks', dest='crosswalks', action='store_false', default=True,
+                        help='Disables crosswalks')
+    parser.add_argument('--no-trafficlights', dest='trafficlights', action='store_false', default=True,
+                        help='Disables vehicle crossing lights')
+    parser.add_argument('--no-pedlights', dest='pedlights', action='store_false', default=True,
+                        help='Disables pedestrian crossing lights')
+    args = parser.parse_args()
+
+    layout = generate_grid(args.rows, args.cols,
+                           lanes          =args.lanes,
+                           block_size     =args.block_size,
+                           sidewalks      =args.sidewalks,
+                           crosswalks     =args.crosswalks,
+                           traffic_lights =args.trafficlights,
+                           ped_lights     =args.pedlights)
+    write_layout(layout, args.out)
+    fluids_print("Wrote {} x {} layout of {} x {} to {}".format(args.rows, args.cols, layout["dimension_x"],
+                                                              layout["dimension_y"], args.out))
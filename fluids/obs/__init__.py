@@ -3,3 +3,5 @@ from fluids.obs.qlidar import QLidarObservation
 from fluids.obs.grid import GridObservation
 from fluids.obs.birds_eye import BirdsEyeObservation
 
+from fluids.obs.cache import ObservationCache
+from fluids.obs.frame_stack import FrameStack
@@ -1,11 +1,10 @@
-from six import iteritems
 import numpy as np
 import pygame
 
 from fluids.assets.shape import Shape
 
 from fluids.obs.obs import FluidsObs
-from fluids.utils import rotation_array
+from fluids.utils import pack_points, to_ego, draw_polygons
 
 class BirdsEyeObservation(FluidsObs):
     """
@@ -14,17 +13,20 @@ class BirdsEyeObservation(FluidsObs):
     Array representation is (obs_dim, obs_dim, 3).
     """
     def __init__(self, car, obs_dim=500):
-        from fluids.assets import Car, Lane, Sidewalk, Terrain, TrafficLight, Waypoint, PedCrossing, Pedestrian
-        state = car.state
-        self.car = car
+        FluidsObs.__init__(self, car)
+        car = self.car
         self.grid_dim = obs_dim
         self.grid_square = Shape(x=car.x+obs_dim/3*np.cos(car.angle),
                                  y=car.y-obs_dim/3*np.sin(car.angle),
                                  xdim=obs_dim, ydim=obs_dim, angle=car.angle,
                                  color=None)
+
+    def compute(self):
+        from fluids.assets import Car, Lane, Sidewalk, Terrain, TrafficLight, Waypoint, PedCrossing, Pedestrian
+        car = self.car
         self.all_collideables = []
         collideable_map = {Waypoint:[]}
-        for k, obj in iteritems(state.objects):
+        for k, obj in self.get_objects(bounds=self.get_bounds(self.grid_square)):
             if (car.can_collide(obj) or type(obj) in {TrafficLight}) and self.grid_square.intersects(obj):
                 typ = type(obj)
                 if typ not in collideable_map:
@@ -39,19 +41,23 @@ class BirdsEyeObservation(FluidsObs):
         gd = self.grid_dim
         a0 = self.car.angle + np.pi / 2
         a1 = self.car.angle
+        rel = (self.car.x+gd/2*np.cos(a0)-gd/6*np.cos(a1),
+               self.car.y-gd/2*np.sin(a0)+gd/6*np.sin(a1),
+               self.car.angle)
+        objs = []
         for typ in [Terrain, Sidewalk, Lane, Car, TrafficLight, Waypoint, PedCrossing, Pedestrian]:
             if typ in collideable_map:
-                for obj in collideable_map[typ]:
-                    rel_obj = obj.get_relative((self.car.x+gd/2*np.cos(a0)-gd/6*np.cos(a1),
-                                                self.car.y-gd/2*np.sin(a0)+gd/6*np.sin(a1),
-                                                self.car.angle))
-                    rel_obj.render(debug_window, border=None)
+                objs.extend(collideable_map[typ])
+        points, offsets = pack_points(objs)
+        draw_polygons([debug_window] * len(objs), [obj.color for obj in objs],
+                      to_ego(points, rel), offsets)
         self.pygame_rep = pygame.transform.rotate(debug_window, 90)
 
 
     def render(self, surface):
         self.grid_square.render(surface)
         if self.car.vis_level > 3:
+            self.evaluate()
 
             if self.car.vis_level > 4:
                 for obj in self.all_collideables:
@@ -62,6 +68,17 @@ class BirdsEyeObservation(FluidsObs):
                              pygame.Rect((surface.get_size()[0] - self.grid_dim-5, 0-5),
                                          (self.grid_dim+10, self.grid_dim+10)), 10)
 
-    def get_array(self):
-        arr = pygame.surfarray.array3d(self.pygame_rep)
+    def get_array(self, out=None, dtype=None):
+        self.evaluate()
+        if out is None and dtype is None:
+            return pygame.surfarray.array3d(self.pygame_rep)
+        try:
+            # Reference the surface pixels directly to avoid an intermediate copy
+            pixels = pygame.surfarray.pixels3d(self.pygame_rep)
+        except ValueError:
+            return self.output(pygame.surfarray.array3d(self.pygame_rep), out, dtype)
+        arr = self.output(pixels, out, dtype)
+        if arr is pixels:
+            arr = arr.copy()
+        del pixels
         return arr
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+def freeze(value):
+    """
+    Converts observation arguments into a hashable form
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, np.ndarray):
+        return (value.dtype.str, value.shape, value.tobytes())
+    return value
+
+
+class ObservationCache(object):
+    """
+    Memoizes observations within one tick of a state.
+    Entries are keyed by (car key, observation type, observation arguments), and
+    the whole cache is dropped as soon as the state's time advances or the state is restored.
+
+    Attributes
+    ----------
+    hits: int
+        Number of observations served from the cache
+    misses: int
+        Number of observations that had to be created
+    """
+    def __init__(self):
+        self.state        = None
+        self.time         = None
+        self.revision     = None
+        self.observations = {}
+        self.hits         = 0
+        self.misses       = 0
+
+    def get(self, state, key, obs_space, obs_args={}):
+        """
+        Returns the observation for car key, creating it on a miss
+
+        Parameters
+        ----------
+        state: fluids.State
+            State containing the car
+        key: int
+            Key of the car
+        obs_space: str
+            Observation type, as passed to Car.make_observation
+        obs_args: dict
+            Observation arguments, as passed to Car.make_observation
+
+        Returns
+        -------
+        FluidsObs
+        """
+        if state is not self.state or state.time != self.time or state.revision != self.revision:
+            self.clear()
+            self.state    = state
+            self.time     = state.time
+            self.revision = state.revision
+        try:
+            cache_key = (key, obs_space, freeze(obs_args))
+            hash(cache_key)
+        except TypeError:
+            self.misses += 1
+            return state.objects[key].make_observation(obs_space, **obs_args)
+        if cache_key in self.observations:
+            self.hits += 1
+            return self.observations[cache_key]
+        self.misses += 1
+        obs = state.objects[key].make_observation(obs_space, **obs_args)
+        self.observations[cache_key] = obs
+        return obs
+
+    def clear(self):
+        self.observations = {}
+
+    def stats(self):
+        """
+        Returns dict with hit and miss counts
+        """
+        return {"hits": self.hits, "misses": self.misses}
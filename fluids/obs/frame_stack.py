@@ -0,0 +1,86 @@
+import copy
+import numpy as np
+
+
+class FrameStack(object):
+    """
+    Keeps the last n_frames observation arrays of a car in a preallocated ring buffer.
+    Every frame is stored twice, at i and i + n_frames, so the frames in order are
+    always a contiguous slice of the buffer and can be returned without copying.
+
+    Parameters
+    ----------
+    n_frames: int
+        Number of frames to stack
+    dtype: np.dtype
+        Data type of the stacked frames. Defaults to the observation's own type
+    """
+    def __init__(self, n_frames, dtype=None):
+        self.n_frames = n_frames
+        self.dtype    = dtype
+        self.buffer   = None
+        self.index    = 0
+        self.count    = 0
+        self.owner    = None
+        self.time     = None
+
+    def reset(self, owner=None):
+        """
+        Drops all stored frames. The next pushed frame fills the whole stack.
+
+        Parameters
+        ----------
+        owner: object
+            Object the frames belong to, used to detect when it is replaced
+        """
+        self.index = 0
+        self.count = 0
+        self.owner = owner
+        self.time  = None
+
+    def push(self, obs, time=None):
+        """
+        Writes the array of obs into the buffer in place
+
+        Parameters
+        ----------
+        obs: FluidsObs
+            Observation to append
+        time: int
+            If specified, pushing twice at the same time only keeps the first frame
+        Returns
+        -------
+        np.array of shape (n_frames, ...)
+            Read-only view of the stacked frames, oldest first. The view is only
+            valid until the next push.
+        """
+        if time is not None and time == self.time and self.count:
+            return self.get_frames()
+        self.time = time
+        if self.buffer is None:
+            frame = obs.get_array(dtype=self.dtype)
+            self.buffer = np.empty((2 * self.n_frames,) + frame.shape, dtype=frame.dtype)
+            self.buffer[self.index] = frame
+        else:
+            obs.get_array(out=self.buffer[self.index])
+
+        if not self.count:
+            self.buffer[:] = self.buffer[self.index]
+        else:
+            self.buffer[self.index + self.n_frames] = self.buffer[self.index]
+        self.index = (self.index + 1) % self.n_frames
+        self.count = min(self.count + 1, self.n_frames)
+        return self.get_frames()
+
+    def copy(self):
+        """
+        Returns a stack holding its own copy of the stored frames
+        """
+        stack = copy.copy(self)
+        stack.buffer = None if self.buffer is None else self.buffer.copy()
+        return stack
+
+    def get_frames(self):
+        frames = self.buffer[self.index:self.index + self.n_frames]
+        frames.flags.writeable = False
+        return frames
@@ -1,10 +1,8 @@
-from six import iteritems
 import numpy as np
 import pygame
 from fluids.assets.shape import Shape
 from fluids.obs.obs import FluidsObs
-from fluids.utils import rotation_array
-from scipy.misc import imresize
+from fluids.utils import fluids_assert, pack_points, to_ego, draw_polygons
 from fluids.consts import *
 
 class GridObservation(FluidsObs):
@@ -14,22 +12,38 @@ class GridObservation(FluidsObs):
     Observation has 11 dimensions: terrain, drivable regions, illegal drivable 
     regions, cars, pedestrians, traffic lights x 3, way points, point trajectory and edge trajectory.
     Array representation is (grid_size, grid_size, 11)
+
+    Parameters
+    ----------
+    obs_dim: int
+        Side length of the detection region, in world units
+    shape: tuple of int
+        Resolution of the array representation. If different from (obs_dim, obs_dim),
+        the grid is area-averaged down to this shape.
+    supersample: int
+        When downsampling, the grid is rasterized at supersample times shape
+        (capped at obs_dim) instead of at obs_dim
     """
-    def __init__(self, car, obs_dim=500, shape=(500,500)):
-        from fluids.assets import ALL_OBJS, TrafficLight, Lane, Terrain, Sidewalk, \
-            PedCrossing, Street, Car, Waypoint, Pedestrian
-        state = car.state
-        self.car = car
+    def __init__(self, car, obs_dim=500, shape=(500,500), supersample=4):
+        FluidsObs.__init__(self, car)
+        car = self.car
         self.shape = shape
         self.grid_dim = obs_dim
         self.downsample = self.shape != (obs_dim, obs_dim)
+        self.supersample = supersample
         self.grid_square = Shape(x=car.x+obs_dim/3*np.cos(car.angle),
                                  y=car.y-obs_dim/3*np.sin(car.angle),
                                  xdim=obs_dim, ydim=obs_dim, angle=car.angle,
                                  color=None, border_color=(200,0,0))
+
+    def compute(self):
+        from fluids.assets import ALL_OBJS, TrafficLight, Lane, Terrain, Sidewalk, \
+            PedCrossing, Street, Car, Waypoint, Pedestrian
+        car = self.car
+        obs_dim, shape, supersample = self.grid_dim, self.shape, self.supersample
         self.all_collideables = []
         collideable_map = {typ:[] for typ in ALL_OBJS}
-        for k, obj in iteritems(state.objects):
+        for k, obj in self.get_objects(bounds=self.get_bounds(self.grid_square)):
             if (car.can_collide(obj) or type(obj) in {TrafficLight, Lane, Street}) and self.grid_square.intersects(obj):
                 typ = type(obj)
                 if typ == TrafficLight:
@@ -47,19 +61,29 @@ class GridObservation(FluidsObs):
             collideable_map[Waypoint].append(waypoint)
             self.all_collideables.append(waypoint)
 
-        terrain_window    = pygame.Surface((self.grid_dim, self.grid_dim))
-        drivable_window   = pygame.Surface((self.grid_dim, self.grid_dim))
-        undrivable_window = pygame.Surface((self.grid_dim, self.grid_dim))
-        car_window        = pygame.Surface((self.grid_dim, self.grid_dim))
-        ped_window        = pygame.Surface((self.grid_dim, self.grid_dim))
-        light_window_red  = pygame.Surface((self.grid_dim, self.grid_dim))
-        light_window_green= pygame.Surface((self.grid_dim, self.grid_dim))
-        light_window_yellow=pygame.Surface((self.grid_dim, self.grid_dim))
-        direction_window  = pygame.Surface((self.grid_dim, self.grid_dim))
+        # Rasterize directly at the output resolution, supersampled so that
+        # get_array can area-average back down to shape
+        if self.downsample:
+            factor = max(1, min(supersample, obs_dim // max(shape)))
+            w, h = shape[1] * factor, shape[0] * factor
+        else:
+            factor = 1
+            w, h = obs_dim, obs_dim
+        scale = (w / float(obs_dim), h / float(obs_dim))
+
+        terrain_window    = pygame.Surface((w, h))
+        drivable_window   = pygame.Surface((w, h))
+        undrivable_window = pygame.Surface((w, h))
+        car_window        = pygame.Surface((w, h))
+        ped_window        = pygame.Surface((w, h))
+        light_window_red  = pygame.Surface((w, h))
+        light_window_green= pygame.Surface((w, h))
+        light_window_yellow=pygame.Surface((w, h))
+        direction_window  = pygame.Surface((w, h))
         direction_pixel_window \
-                          = pygame.Surface((self.grid_dim, self.grid_dim))
+                          = pygame.Surface((w, h))
         direction_edge_window \
-                          = pygame.Surface((self.grid_dim, self.grid_dim))
+                          = pygame.Surface((w, h))
 
         gd = self.grid_dim
         a0 = self.car.angle + np.pi / 2
@@ -68,70 +92,60 @@ class GridObservation(FluidsObs):
                self.car.y-gd/2*np.sin(a0)+gd/6*np.sin(a1),
                self.car.angle)
 
+        # Gather every culled object with the window it is drawn on, then move
+        # all of their vertices into the grid frame at once
+        layers = []
         for typ in [Terrain, Sidewalk, PedCrossing]:
-            for obj in collideable_map[typ]:
-                rel_obj = obj.get_relative(rel)
-                rel_obj.render(terrain_window, border=None)
-
+            layers += [(terrain_window, obj) for obj in collideable_map[typ]]
         for obj in collideable_map[Lane]:
-            rel_obj = obj.get_relative(rel)
             if not car.can_collide(obj):
-                rel_obj.render(drivable_window, border=None)
+                layers.append((drivable_window, obj))
             else:
-                rel_obj.render(undrivable_window, border=None)
-        for obj in collideable_map[Street]:
-            rel_obj = obj.get_relative(rel)
-            rel_obj.render(drivable_window, border=None)
-
-        for obj in collideable_map[Car]:
-            rel_obj = obj.get_relative(rel)
-            rel_obj.render(car_window, border=None)
-
-        for obj in collideable_map[Pedestrian]:
-            rel_obj = obj.get_relative(rel)
-            rel_obj.render(ped_window, border=None)
-
-        for obj in collideable_map["TrafficLight-Red"]:
-            rel_obj = obj.get_relative(rel)
-            rel_obj.render(light_window_red, border=None)
-
-        for obj in collideable_map["TrafficLight-Green"]:
-            rel_obj = obj.get_relative(rel)
-            rel_obj.render(light_window_green, border=None)
-        
-        for obj in collideable_map["TrafficLight-Yellow"]:
-            rel_obj = obj.get_relative(rel)
-            rel_obj.render(light_window_green, border=None)
-
-        point = (int(gd/6), int(gd/2))
+                layers.append((undrivable_window, obj))
+        layers += [(drivable_window, obj) for obj in collideable_map[Street]]
+        layers += [(car_window, obj) for obj in collideable_map[Car]]
+        layers += [(ped_window, obj) for obj in collideable_map[Pedestrian]]
+        layers += [(light_window_red, obj) for obj in collideable_map["TrafficLight-Red"]]
+        layers += [(light_window_green, obj) for obj in collideable_map["TrafficLight-Green"]]
+        layers += [(light_window_green, obj) for obj in collideable_map["TrafficLight-Yellow"]]
+
+        points, offsets = pack_points([obj for window, obj in layers])
+        draw_polygons([window for window, obj in layers],
+                      [obj.color for window, obj in layers],
+                      to_ego(points, rel, scale), offsets)
+
+        point = (int(gd/6*scale[0]), int(gd/2*scale[1]))
         edge_point = None
 
-        def is_on_screen(point, gd):
-            return 0 <= point[0] < gd and 0 <= point[1] < gd
+        def is_on_screen(point):
+            return 0 <= point[0] < w and 0 <= point[1] < h
         
-        line_width = 20
-        for p in self.car.waypoints:
-            relp = p.get_relative(rel)
-            new_point = int(relp.x), int(relp.y)
-            if not edge_point and is_on_screen(point, gd) and not is_on_screen(new_point, gd):
+        line_width = max(1, int(round(20 * min(scale))))
+        # Trajectory points are the vertex means of each waypoint's closed ring,
+        # which repeats its first corner, as drawn by the per-shape path before
+        corners   = np.array([p.points for p in self.car.waypoints]).reshape(-1, 4, 2)
+        waypoints = (corners.sum(axis=1) + corners[:, 0]) / 5
+        for relp in to_ego(waypoints, rel, scale):
+            new_point = int(relp[0]), int(relp[1])
+            if not edge_point and is_on_screen(point) and not is_on_screen(new_point):
                 edge_point = new_point
 
             pygame.draw.line(direction_window, (255, 255, 255), point, new_point, line_width)
             point = new_point
         
         if edge_point:
-            edge_point = (min(gd - 1, max(0, edge_point[0])), min(gd - 1, max(0, edge_point[1])))
+            edge_point = (min(w - 1, max(0, edge_point[0])), min(h - 1, max(0, edge_point[1])))
             pygame.draw.circle(direction_pixel_window, (255, 255, 255), edge_point, line_width)
         
         if edge_point:
             if edge_point[0] == 0:
-                pygame.draw.line(direction_edge_window, (255, 255, 255), (0, 0), (0, gd - 1), line_width)
-            if edge_point[0] == gd - 1:
-                pygame.draw.line(direction_edge_window, (255, 255, 255), (gd - 1, 0), (gd - 1, gd - 1), line_width)
+                pygame.draw.line(direction_edge_window, (255, 255, 255), (0, 0), (0, h - 1), line_width)
+            if edge_point[0] == w - 1:
+                pygame.draw.line(direction_edge_window, (255, 255, 255), (w - 1, 0), (w - 1, h - 1), line_width)
             if edge_point[1] == 0:
-                pygame.draw.line(direction_edge_window, (255, 255, 255), (0, 0), (gd - 1, 0), line_width)
-            if edge_point[1] == gd - 1:
-                pygame.draw.line(direction_edge_window, (255, 255, 255), (0, gd - 1), (gd - 1, gd - 1), line_width)
+                pygame.draw.line(direction_edge_window, (255, 255, 255), (0, 0), (w - 1, 0), line_width)
+            if edge_point[1] == h - 1:
+                pygame.draw.line(direction_edge_window, (255, 255, 255), (0, h - 1), (w - 1, h - 1), line_width)
 
 
         self.pygame_rep = [pygame.transform.rotate(window, 90) for window in [terrain_window,
@@ -150,115 +164,122 @@ class GridObservation(FluidsObs):
     def render(self, surface):
         self.grid_square.render(surface, border=10)
         if self.car.vis_level > 3:
+            self.evaluate()
 
             if self.car.vis_level > 4:
                 for obj in self.all_collideables:
                     obj.render_debug(surface)
+            # Panes are rasterized at the supersampled resolution, but laid out grid_dim apart
+            pane_size = (self.grid_dim, self.grid_dim)
             for y in range(4):
                 for x in range(2):
                     i = y + x * 4
                     if i < len(self.pygame_rep):
-                        surface.blit(self.pygame_rep[i], (surface.get_size()[0] - self.grid_dim * (x+1), self.grid_dim * y))
+                        pane = self.pygame_rep[i]
+                        if pane.get_size() != pane_size:
+                            pane = pygame.transform.scale(pane, pane_size)
+                        surface.blit(pane, (surface.get_size()[0] - self.grid_dim * (x+1), self.grid_dim * y))
                         pygame.draw.rect(surface, (200, 0, 0),
                                          pygame.Rect((surface.get_size()[0] - self.grid_dim*(x+1)-5, 0-5+self.grid_dim*y),
                                                      (self.grid_dim+10, self.grid_dim+10)), 10)
 
-    def get_array(self):
-        arr = np.zeros((self.grid_dim, self.grid_dim, len(self.pygame_rep)))
-        for i in range(len(self.pygame_rep)):
-            arr[:,:,i] = pygame.surfarray.array2d(self.pygame_rep[i]) != 0
-            # print(pygame.surfarray.array2d(self.pygame_rep[i]) != 0)
-            
+    def get_array(self, out=None, dtype=np.float64, packed=False):
+        """
+        Returns the occupancy grid as an array of shape (shape[0], shape[1], 11)
+
+        Parameters
+        ----------
+        out: np.array
+            If specified, the grid is written into this preallocated array.
+            Its dtype takes precedence over dtype.
+        dtype: np.dtype
+            Float types give occupancy in [0, 1], integer types scale occupancy
+            to [0, 255], or to [0, 127] for np.int8, and np.bool_ gives a binary occupancy mask.
+        packed: bool
+            If set, returns the binary occupancy mask bit-packed along the
+            channel axis with np.packbits, as uint8 of shape (shape[0], shape[1], 2).
+
+        Returns
+        -------
+        np.array
+        """
+        if packed:
+            return self.output(np.packbits(self.get_array(dtype=np.bool_), axis=-1), out)
+        self.evaluate()
+        raster_shape = self.pygame_rep[0].get_size()
+        n_channels = len(self.pygame_rep)
         if self.downsample:
-            arr = self.sp_imresize(arr, self.shape)
-        return arr
-    
-    def sp_imresize(self, arr, shape):
-        return np.array([imresize(arr[:,:,i],shape) for i in range(arr.shape[2])]).T
-            
-    # def label_distribution_from_block(self, arr, start, end):
-    #     """Returns the distribution of labels in a block from arr.
-
-    #     If start or end are floats, the distribution includes weighted elements
-    #     on the edge of the block.
-
-    #     Args:
-    #         arr (np.ndarray): 3D array from which to obtain the block where the
-    #             3rd dimension is a one-hot encoded vector of labels.
-    #         start (tuple of floats): top left corner of the block.
-    #         end (tuple of floats): bottom right corner of block.
-
-    #     Returns:
-    #         Array containing the distribution of labels.
-    #     """
-    #     assert len(start) == len(end) == 2
-    #     assert len(arr.shape) == 3
-    #     start = np.array(start)
-    #     end = np.array(end)
-
-    #     start_idx = np.ceil(start).astype(np.int)
-    #     end_idx = np.floor(end).astype(np.int)
-
-    #     counts = np.sum(arr[start_idx[0]:end_idx[0], start_idx[1]:end_idx[1]],
-    #                     axis=(0, 1))
-
-    #     NUM_DECIMALS = 7    # Prevents floating point errors
-    #     top_weight, left_weight = np.round(-start % 1, NUM_DECIMALS)
-    #     bottom_weight, right_weight = np.round(end, NUM_DECIMALS) % 1
-
-    #     counts = counts.astype(np.float)
-
-    #     # Edges not including corners
-    #     if top_weight > 1e-4:   # Tolerate floating point errors with small numbers
-    #         counts += top_weight * \
-    #                 np.sum(arr[start_idx[0] - 1, start_idx[1]:end_idx[1]], axis=0)
-    #     if bottom_weight > 1e-4:
-    #         counts += bottom_weight * \
-    #                 np.sum(arr[end_idx[0], start_idx[1]:end_idx[1]], axis=0)
-    #     if left_weight > 1e-4:
-    #         counts += left_weight * \
-    #                 np.sum(arr[start_idx[0]:end_idx[0], start_idx[1] - 1],
-    #                        axis=0)
-    #     if right_weight > 1e-4:
-    #         counts += right_weight * \
-    #                 np.sum(arr[start_idx[0]:end_idx[0], end_idx[1]],
-    #                        axis=0)
-    #     # Corners
-    #     if top_weight and left_weight:
-    #         counts += top_weight * left_weight * arr[start_idx[0], start_idx[1]]
-    #     if top_weight and right_weight:
-    #         counts += top_weight * right_weight * arr[start_idx[0], end_idx[1]]
-    #     if bottom_weight and left_weight:
-    #         counts += bottom_weight * left_weight * arr[end_idx[0], start_idx[1]]
-    #     if bottom_weight and right_weight:
-    #         counts += bottom_weight * right_weight * arr[end_idx[0], end_idx[1]]
-
-    #     return counts / np.sum(counts)
-
-    # def to_low_res_truth(self, labeled_img, shape, nsamples=None):
-    #     """Calculates the distrubution of each region.
+            masks = np.empty(raster_shape + (n_channels,), dtype=np.bool_)
+            self.get_masks(masks)
+            arr = area_resize(masks, self.shape)
+            if out is not None:
+                dtype = out.dtype
+            if np.dtype(dtype) == np.bool_:
+                arr = arr > 0
+            elif np.dtype(dtype).kind in "ui":
+                arr = np.rint(arr * int_scale(dtype))
+            return self.output(arr, out, dtype)
+
+        if out is None:
+            out = np.empty(raster_shape + (n_channels,), dtype=dtype)
+        fluids_assert(out.shape == raster_shape + (n_channels,),
+                      "out has shape {}, observation has shape {}".format(
+                          out.shape, raster_shape + (n_channels,)))
+        self.get_masks(out)
+        if out.dtype.kind in "ui":
+            out *= int_scale(out.dtype)
+        return out
+
+    def get_masks(self, out):
+        """
+        Writes the binary occupancy of every channel into out, at raster resolution.
+        """
+        self.evaluate()
+        for i in range(len(self.pygame_rep)):
+            out[:,:,i] = pygame.surfarray.array2d(self.pygame_rep[i]) != 0
 
-    #     Uses the area of intersection between each pixel and the larger low-res
-    #     region to weight each label in order to construct the distribution.
 
-    #     Args:
-    #         labeled_img (np.ndarray): 3D array from which to obtain the block
-    #             where the 3rd dimension is a one-hot encoded vector of labels.
-    #         shape (tuple of length 2): output resolution.
-    #         nsamples: dummy argument to mantain API consistency.
+def int_scale(dtype):
+    """
+    Returns the value full occupancy is scaled to in integer arrays of dtype,
+    which is 255 unless dtype cannot hold it
+    """
+    return min(255, np.iinfo(dtype).max)
 
-    #     Returns:
-    #         Low resolution array where the 3rd dimension contains the distribution
-    #         of labels present within the high resolution elements corresponding
-    #         to the location in the low resolution array.
-    #     """
-    #     assert len(labeled_img.shape) == 3
 
-    #     row_step, col_step = np.divide(labeled_img.shape[0:2], shape)
+def area_resize(arr, shape):
+    """
+    Resizes the first two axes of arr to shape by area averaging, so every
+    output cell holds the mean of the input cells it covers.
+
+    Parameters
+    ----------
+    arr: np.array
+        Array of shape (H, W, C)
+    shape: tuple of int
+        Output resolution (h, w)
+
+    Returns
+    -------
+    np.array of shape (h, w, C)
+    """
+    H, W = arr.shape[:2]
+    h, w = shape
+    if H % h == 0 and W % w == 0:
+        # Integer ratio: a single block mean over the whole tensor
+        blocks = arr.reshape(h, H // h, w, W // w, *arr.shape[2:])
+        return blocks.mean(axis=(1, 3))
+    return np.einsum("ih,hw...,jw->ij...",
+                     area_weights(H, h), arr, area_weights(W, w), optimize=True)
 
-    #     low_res = np.array([[self.label_distribution_from_block(
-    #                             labeled_img, (i, j), (i + row_step, j + col_step))
-    #                          for j in np.arange(0, labeled_img.shape[1], col_step)]
-    #                         for i in np.arange(0, labeled_img.shape[0], row_step)])
 
-    #     return low_res
+def area_weights(n_in, n_out):
+    """
+    Returns the (n_out, n_in) matrix whose rows give the fraction of every input
+    cell covered by each output cell, normalized to sum to one.
+    """
+    edges = np.linspace(0, n_in, n_out + 1)
+    starts = np.arange(n_in)
+    overlap = np.minimum(edges[1:, None], starts + 1) - np.maximum(edges[:-1, None], starts)
+    overlap = np.maximum(overlap, 0)
+    return overlap / overlap.sum(axis=1, keepdims=True)
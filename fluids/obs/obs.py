@@ -1,15 +1,96 @@
+from itertools import chain
+import numpy as np
+
+from fluids.utils import fluids_assert, NULL_PROFILER
+
+
 class FluidsObs(object):
     """
     The base FLUIDS observation interface
+
+    Observations are lazy. The constructor only captures a snapshot of the
+    scene, and the rendering or ray casting work happens in compute, which
+    runs once on the first call to get_array or render.
     """
-    def __init__(self):
-        pass
-    def get_array(self):
+    # Times compute, when FluidSim has a profiler set
+    profiler = NULL_PROFILER
+
+    def __init__(self, car):
+        self.state          = car.state
+        self.frozen_objects = car.state.get_frozen_objects()
+        self.car            = self.frozen_objects.get(id(car)) or car.freeze()
+        self.evaluated      = False
+
+    def compute(self):
+        """
+        Performs the work of building the observation from the snapshot
+        """
+        raise NotImplementedError
+
+    def evaluate(self):
+        if not self.evaluated:
+            start = self.profiler.start()
+            self.compute()
+            self.evaluated = True
+            self.profiler.stop("observations/compute", start)
+
+    def get_objects(self, types=None, bounds=None):
+        """
+        Iterates over the scene as it was when the observation was made
+
+        Parameters
+        ----------
+        types: list of types
+            If specified, only objects of these types are returned
+        bounds: tuple
+            If specified, static objects whose bounding box does not overlap
+            (minx, miny, maxx, maxy) are skipped
+
+        Returns
+        -------
+        iterator of (key, object)
+            Dynamic objects are returned as their frozen copies
+        """
+        store = self.state.static_geometry
+        if types is None:
+            keys = chain(store.query(bounds), self.state.dynamic_objects)
+        else:
+            keys = chain(*[store.query(bounds, t) if t in store.types
+                           else self.state.type_map[t] for t in types])
+        objects = self.state.objects
+        for k in keys:
+            k = int(k)
+            obj = objects[k]
+            yield k, self.frozen_objects.get(id(obj), obj)
+
+    def get_bounds(self, shape):
+        return (shape.minx, shape.miny, shape.maxx, shape.maxy)
+
+    def get_array(self, out=None, dtype=None):
         """
         Returns a numpy array representation of the observation
 
+        Parameters
+        ----------
+        out: np.array
+            If specified, the observation is written into this preallocated array,
+            which is then returned. Its dtype takes precedence over dtype.
+        dtype: np.dtype
+            Data type of the returned array. Defaults to the observation's natural type.
+
         Returns
         -------
         np.array
         """
         raise NotImplementedError
+
+    def output(self, arr, out=None, dtype=None):
+        """
+        Copies arr into out if given, otherwise casts it to dtype.
+        """
+        if out is None:
+            return arr if dtype is None else arr.astype(dtype, copy=False)
+        fluids_assert(out.shape == arr.shape,
+                      "out has shape {}, observation has shape {}".format(out.shape, arr.shape))
+        np.copyto(out, arr, casting="unsafe")
+        return out
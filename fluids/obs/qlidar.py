@@ -1,4 +1,3 @@
-from six import iteritems
 import numpy as np
 import pygame
 import shapely
@@ -33,24 +32,39 @@ class QLidarObservation(FluidsObs):
                  ped_buffer=0,
                  layers=None,
                  goal_distance=4):
-        from fluids.assets import Shape, Pedestrian, Car
+        from fluids.assets import Shape
 
-        state = car.state
-
-        self.car = car
+        FluidsObs.__init__(self, car)
+        car = self.car
         self.det_range = det_range
+        self.n_beams = n_beams
+        self.beam_distribution = beam_distribution
+        self.ped_buffer = ped_buffer
+        self.layers = layers
+        self.goal_distance = goal_distance
 
         self.grid_square = Shape(x=car.x, y=car.y,
                                  xdim=det_range*2, ydim=det_range*2,
                                  angle=car.angle,
                                  color=None)
 
+    def compute(self):
+        from fluids.assets import Pedestrian
+
+        car = self.car
+        det_range = self.det_range
+        n_beams = self.n_beams
+        beam_distribution = self.beam_distribution
+        ped_buffer = self.ped_buffer
+        layers = self.layers
+        goal_distance = self.goal_distance
+
         self.all_collideables = []
         if layers == None:
             layers = [self.car.collideables]
         layer_collideables = [[] for l in layers]
         for c in self.car.collideables:
-            for k, obj in iteritems(state.type_map[c]):
+            for k, obj in self.get_objects([c], bounds=self.get_bounds(self.grid_square)):
                 if car.can_collide(obj) and self.grid_square.intersects(obj):
                     self.all_collideables.append(obj)
                     for l in range(len(layers)):
@@ -116,12 +130,16 @@ class QLidarObservation(FluidsObs):
         self.detections[:,1] = 0
         self.detections[min_angle_index,1] = 1
 
-    def get_array(self):
-        return np.array(self.detections)
+    def get_array(self, out=None, dtype=None):
+        self.evaluate()
+        if out is None:
+            return np.array(self.detections, dtype=dtype)
+        return self.output(self.detections, out)
 
     def render(self, surface):
         self.grid_square.render(surface, border=10)
         if self.car.vis_level > 4:
+            self.evaluate()
             # for obj in self.all_collideables:
             #     obj.render_debug(surface)
             # xd = np.cos(self.gangle) * 100
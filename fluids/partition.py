@@ -0,0 +1,292 @@
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from six import iteritems
+
+from fluids.sim import FluidSim
+from fluids.state import State, reserve_ids
+from fluids.assets import Car, Pedestrian, TrafficLight, CrossWalkLight
+from fluids.consts import *
+from fluids.utils import *
+
+
+def get_region_bounds(state, n_regions):
+    """
+    Returns the n_regions + 1 x coordinates that split the layout into vertical strips of equal width
+    """
+    xs = [wp.x for wp in state.waypoints]
+    return np.linspace(min(xs), max(xs), n_regions + 1)
+
+def get_regions(bounds, xs):
+    """
+    Returns the index of the strip that contains each x coordinate
+    """
+    return np.clip(np.searchsorted(bounds, xs, side='right') - 1, 0, len(bounds) - 2)
+
+
+class RegionWorker():
+    """
+    Simulates the cars and pedestrians in one strip of the layout. Every worker builds the same
+    State from the same seed and renames its objects to keys, so rows and keys agree between
+    workers. Each worker steps all lights itself. Objects of other regions are only updated
+    while they are within halo of the strip.
+    """
+    def __init__(self, region, bounds, state_args, seed, halo, keys, records):
+        self.region  = region
+        self.bounds  = bounds
+        self.halo    = halo
+        self.records = records
+
+        # Keep the keys of static objects clear of the shared keys
+        reserve_ids(max(keys))
+        self.state = State(vis_level=0, seed=seed, **state_args)
+        self.state.rekey(keys)
+        self.sim = FluidSim(visualization_level=0,
+                            fps=0,
+                            background_control=BACKGROUND_CSP)
+        self.sim.state = self.state
+        self.keys   = records['key'][0].tolist()
+        self.shared = set(self.keys)
+        self.lights = [obj for k, obj in iteritems(self.state.dynamic_objects)
+                       if type(obj) in [TrafficLight, CrossWalkLight]]
+        self.lo, self.hi = bounds[region], bounds[region + 1]
+        self.owned = np.zeros(len(self.keys), np.bool_)
+        self.tick  = 0
+
+    def write(self, out, rows):
+        """
+        Writes the records of rows to out, with the region that owns them after this tick
+        """
+        keys = [self.keys[i] for i in rows]
+        record = np.zeros(len(rows), out.dtype)
+        self.state.get_record(out=record, keys=keys)
+        self.state.get_controllers(record)
+        record['owner'] = get_regions(self.bounds, record['x'])
+        out[rows] = record
+
+    def start(self):
+        """
+        Writes the initial records of the objects in this region
+        """
+        current = self.records[0]
+        self.owned = get_regions(self.bounds, current['x']) == self.region
+        self.write(current, np.flatnonzero(self.owned))
+
+    def is_in_collision(self, obj, current):
+        """
+        Returns if obj collides with an object whose copy in this worker is up to date. Cars and
+        pedestrians of other regions are only up to date while they are ghosts, so the copies of
+        the others, left where this worker last saw them, are skipped.
+
+        Parameters
+        ----------
+        current: set
+            Keys of the cars and pedestrians owned or ghosted this tick
+        """
+        for ctype in obj.collideables:
+            for k, other in iteritems(self.state.type_map.get(ctype, {})):
+                if (k in current or k not in self.shared) and obj.collides(other):
+                    return True
+        return False
+
+    def step(self):
+        """
+        Simulates one tick of the region
+
+        Returns
+        -------
+        dict
+            Counts of owned objects, ghosts, objects that migrated in, and collisions of owned cars
+        """
+        current = self.records[self.tick % 2]
+        nxt = self.records[(self.tick + 1) % 2]
+        owned = current['owner'] == self.region
+        xs = current['x']
+        ghosts = ~owned & (xs >= self.lo - self.halo) & (xs < self.hi + self.halo)
+        arrived = owned & ~self.owned
+        # Objects that this worker stepped last tick are already up to date
+        update = np.flatnonzero(ghosts | arrived)
+        if len(update):
+            rows = current[update]
+            self.state.set_record(rows)
+            self.state.set_controllers(rows)
+        self.owned = owned
+
+        owned_rows = np.flatnonzero(owned)
+        owned_keys = [self.keys[i] for i in owned_rows]
+        self.sim.multiagent_plan(owned_keys + [self.keys[i] for i in np.flatnonzero(ghosts)])
+        for k in owned_keys:
+            self.state.objects[k].step(self.sim.next_actions.get(k))
+        for light in self.lights:
+            light.step(None)
+        self.state.time += 1
+        self.state.frozen_time = None
+        self.write(nxt, owned_rows)
+
+        current = set(owned_keys + [self.keys[i] for i in np.flatnonzero(ghosts)])
+        collisions = sum(self.is_in_collision(self.state.objects[k], current) for k in owned_keys
+                         if k in self.state.type_map[Car])
+        self.tick += 1
+        return {"owned"     : len(owned_rows),
+                "ghosts"    : int(ghosts.sum()),
+                "arrived"   : int(arrived.sum()),
+                "collisions": int(collisions)}
+
+
+def region_worker(pipe, buffers, region, barrier, args):
+    """
+    Main loop of a region worker, see fluids.utils.run_worker. Records are exchanged through shared
+    memory, and the workers meet at barrier after every tick so that no record is read while it is written.
+    """
+    try:
+        buffers.append(shared_memory.SharedMemory(name=args.pop("name")))
+        records = np.ndarray(args.pop("shape"), args.pop("dtype"), buffer=buffers[0].buf)
+        worker = RegionWorker(region, records=records, **args)
+        worker.start()
+        pipe.send(("ok", None))
+        while True:
+            cmd, data = pipe.recv()
+            if cmd == "step":
+                stats = {"owned": 0, "ghosts": 0, "arrived": 0, "collisions": 0}
+                start = time.perf_counter()
+                for i in range(data):
+                    for name, value in iteritems(worker.step()):
+                        stats[name] += value
+                    barrier.wait()
+                stats["step_time"] = time.perf_counter() - start
+                pipe.send(("ok", stats))
+            elif cmd == "close":
+                break
+    except (KeyboardInterrupt, EOFError):
+        raise
+    except BaseException:
+        # Keeps the other workers from waiting for this one forever
+        barrier.abort()
+        raise
+
+
+class PartitionedSim(WorkerPool):
+    """
+    Simulates the background traffic of one layout with several worker processes. The layout is split
+    into vertical strips, one per worker, and each worker plans and steps the cars and pedestrians
+    in its strip. The records of all cars and pedestrians are kept in shared memory, with an owner column
+    naming the strip that steps them. Objects within halo of a strip are copied into its worker as
+    ghosts before every tick, so that the planner sees traffic across the border, and an object that
+    crosses a border is stepped by the worker of its new strip from the next tick on.
+
+    Planning is done per strip, so traffic does not match a FluidSim of the same State exactly.
+    Controlled cars are not supported.
+
+    Parameters
+    ----------
+    n_regions: int
+        Number of strips, and of worker processes
+    state_args: dict
+        Arguments of fluids.State, such as layout, background_cars and background_peds
+    seed: int
+        Seed of the State, which every worker builds in the same way
+    halo: float
+        Distance from a strip within which objects of other strips are copied into its worker
+    start_method: str
+        multiprocessing start method of the workers. Defaults to the platform default
+    """
+    worker_name = "Region worker"
+
+    def __init__(self,
+                 n_regions,
+                 state_args   ={},
+                 seed         =None,
+                 halo         =150,
+                 start_method =None):
+        WorkerPool.__init__(self, start_method)
+        fluids_assert(not state_args.get("controlled_cars"), "PartitionedSim only simulates background traffic")
+        seed = np.random.randint(2**31) if seed is None else seed
+
+        # Build the State once here to lay out the shared records
+        state = State(vis_level=0, seed=seed, **state_args)
+        all_keys = list(state.dynamic_objects)
+        keys = [k for k, obj in iteritems(state.dynamic_objects) if type(obj) in [Car, Pedestrian]]
+        dtype = np.dtype(state.get_snapshot_dtype().descr + [('owner', np.int16)])
+        record = np.zeros(len(keys), dtype)
+        state.get_record(out=record, keys=keys)
+        self.bounds = get_region_bounds(state, n_regions)
+        state = None
+
+        self.n_regions = n_regions
+        self.tick      = 0
+        self.stats     = {}
+        buffer = self.create_buffer(2 * record.nbytes)
+        self.records = np.ndarray((2, len(keys)), dtype, buffer=buffer.buf)
+        self.records[0] = record
+        self.records[1] = record
+
+        barrier = self.ctx.Barrier(n_regions)
+        for i in range(n_regions):
+            args = {"name"      : buffer.name,
+                    "shape"     : self.records.shape,
+                    "dtype"     : dtype,
+                    "bounds"    : self.bounds,
+                    "state_args": state_args,
+                    "seed"      : seed,
+                    "halo"      : halo,
+                    "keys"      : all_keys}
+            self.start_worker(region_worker, i, barrier, args)
+        for i in range(n_regions):
+            self.recv_reply(i)
+
+    def step(self, n_ticks=1):
+        """
+        Simulates n_ticks frames. The workers only meet each other between ticks, not this process.
+
+        Returns
+        -------
+        list of dict
+            Per region totals over the ticks of owned objects, ghosts, objects that migrated in and
+            collisions of owned cars, and the seconds the worker took
+        """
+        stats = self.call_all("step", n_ticks)
+        self.tick += n_ticks
+        return stats
+
+    def get_record(self):
+        """
+        Returns
+        -------
+        np.array
+            Copy of the current records of all cars and pedestrians, in key order. These are
+            get_snapshot_dtype rows of the State, with an added owner column
+        """
+        return self.records[self.tick % 2].copy()
+
+    def release_views(self):
+        self.records = None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Measure how the background traffic of a FLUIDS layout scales with region workers')
+    parser.add_argument('-b', metavar='N', type=int, default=40,
+                        help='Number of background cars')
+    parser.add_argument('-p', metavar='N', type=int, default=10,
+                        help='Number of background pedestrians')
+    parser.add_argument('-j', metavar='N', dest='regions', type=int, nargs='+', default=[1, 2, 4],
+                        help='Numbers of regions to measure')
+    parser.add_argument('--time', metavar='N', type=int, default=200,
+                        help='Number of ticks to simulate')
+    parser.add_argument('--state', metavar='file', type=str, default="fluids_state_big_city",
+                        help='Layout file for state generation')
+    parser.add_argument('--seed', metavar='N', type=int, default=0,
+                        help='Seed of the State')
+    args = parser.parse_args()
+
+    state_args = {"layout": args.state, "background_cars": args.b, "background_peds": args.p}
+    for n_regions in args.regions:
+        sim = PartitionedSim(n_regions, state_args, seed=args.seed)
+        start = time.time()
+        stats = sim.step(args.time)
+        elapsed = time.time() - start
+        sim.close()
+        fluids_print("{} regions: {:.1f} ticks/s, {:.0f} cars/s, {} migrations, {} collisions".format(
+            n_regions, args.time / elapsed, args.time * args.b / elapsed,
+            sum(s["arrived"] for s in stats), sum(s["collisions"] for s in stats)))
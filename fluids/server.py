@@ -0,0 +1,398 @@
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import sys
+import time
+from collections import deque
+from multiprocessing.connection import wait
+import numpy as np
+
+from fluids.consts import *
+from fluids.utils import *
+from fluids.vec import VecFluidSim
+
+
+# Every request is a REQUEST header followed by payload_len bytes of payload,
+# and is answered by a REPLY header followed by its payload.
+REQUEST = struct.Struct("<BHI")   # op, env id, payload_len
+REPLY   = struct.Struct("<BI")    # status, payload_len
+INFO    = struct.Struct("<HHHBB") # n_envs, n_cars, action_width, obs ndim, obs dtype length
+RESULT  = struct.Struct("<d?")    # reward, done
+
+OP_INFO    = 0 # Reply: INFO, obs dtype string, obs shape of a car as uint32s
+OP_RESET   = 1 # Reply: observations of the env's cars
+OP_STEP    = 2 # Payload: float64 actions of the env's cars. Reply: RESULT, observations
+OP_OBSERVE = 3 # Reply: observations of the env's cars
+
+STATUS_OK    = 0
+STATUS_ERROR = 1 # Reply: utf-8 error message
+
+
+def parse_address(address):
+    """
+    Returns the socket family and address of "host:port" or of the path of a Unix-domain socket
+    """
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+def recv_exact(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise EOFError("Connection closed")
+        data += chunk
+    return bytes(data)
+
+
+class ServerConnection():
+    """
+    A client of SimServer, and the requests it has sent that are not parsed yet
+    """
+    def __init__(self, sock):
+        self.sock   = sock
+        self.buffer = bytearray()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read_requests(self):
+        """
+        Returns the complete requests that have arrived, as (op, env id, payload)
+        """
+        data = self.sock.recv(1 << 16)
+        if not data:
+            raise EOFError("Connection closed")
+        self.buffer += data
+        requests = []
+        while len(self.buffer) >= REQUEST.size:
+            op, env_id, n = REQUEST.unpack_from(self.buffer)
+            if len(self.buffer) < REQUEST.size + n:
+                break
+            requests.append((op, env_id, bytes(self.buffer[REQUEST.size:REQUEST.size + n])))
+            del self.buffer[:REQUEST.size + n]
+        return requests
+
+    def reply(self, status, *payload):
+        n = sum(len(p) for p in payload)
+        self.sock.sendall(b"".join((REPLY.pack(status, n),) + payload))
+
+
+class SimServer():
+    """
+    Hosts the simulations of a VecFluidSim behind a socket. Clients address a simulation by its
+    env id, and requests to the same simulation are answered in order. Step requests that arrive
+    for different simulations while the server waits are sent to the workers as one batch, and
+    every step replies with the observations the workers wrote to shared memory for that tick.
+
+    Parameters
+    ----------
+    address: str
+        "host:port" to listen on TCP, or the path of a Unix-domain socket
+    vec_args: dict
+        Arguments of fluids.vec.VecFluidSim
+    """
+    def __init__(self, address, vec_args):
+        self.vec = VecFluidSim(**vec_args)
+        self.action_size = self.vec.n_cars * self.vec.action_width * 8
+
+        family, self.address = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.bind(self.address)
+        self.sock.listen()
+        self.family = family
+
+        self.connections = []
+        self.queues      = [deque() for _ in range(self.vec.n_envs)]
+        self.stepping    = [None] * self.vec.n_envs
+
+    def get_info(self):
+        obs_shape = self.vec.obs_shape[2:]
+        dtype = self.vec.obs.dtype.str.encode()
+        return INFO.pack(self.vec.n_envs, self.vec.n_cars, self.vec.action_width,
+                         len(obs_shape), len(dtype)) + dtype + struct.pack("<{}I".format(len(obs_shape)), *obs_shape)
+
+    def serve(self):
+        """
+        Answers requests until interrupted
+        """
+        fluids_print("Serving {} simulations on {}".format(self.vec.n_envs, self.address))
+        try:
+            while True:
+                pipes = {self.vec.pipes[i]: i for i in np.flatnonzero(self.vec.pending)}
+                ready = wait([self.sock] + self.connections + list(pipes))
+                for obj in ready:
+                    if obj is self.sock:
+                        sock, _ = self.sock.accept()
+                        if self.family == socket.AF_INET:
+                            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                        self.connections.append(ServerConnection(sock))
+                    elif obj in self.connections:
+                        self.read(obj)
+                if any(obj in pipes for obj in ready):
+                    env_ids, obs, rewards, dones = self.vec.recv(timeout=0)
+                    for i, env_id in enumerate(env_ids):
+                        conn, self.stepping[env_id] = self.stepping[env_id], None
+                        self.reply(conn, STATUS_OK, RESULT.pack(rewards[i], dones[i]), obs[i].tobytes())
+                self.dispatch()
+        finally:
+            self.close()
+
+    def read(self, conn):
+        try:
+            requests = conn.read_requests()
+        except (EOFError, OSError):
+            self.drop(conn)
+            return
+        for op, env_id, payload in requests:
+            if op == OP_INFO:
+                self.reply(conn, STATUS_OK, self.get_info())
+            elif env_id >= self.vec.n_envs:
+                self.reply(conn, STATUS_ERROR, "No env {}".format(env_id).encode())
+            elif op == OP_STEP and len(payload) != self.action_size:
+                self.reply(conn, STATUS_ERROR, "Expected {} bytes of actions".format(self.action_size).encode())
+            elif op not in [OP_RESET, OP_STEP, OP_OBSERVE]:
+                self.reply(conn, STATUS_ERROR, "Unknown op {}".format(op).encode())
+            else:
+                self.queues[env_id].append((conn, op, payload))
+
+    def dispatch(self):
+        """
+        Answers the queued requests of idle simulations, and sends their steps to the workers together
+        """
+        step_ids, actions = [], []
+        for env_id, queue in enumerate(self.queues):
+            while queue and self.stepping[env_id] is None:
+                conn, op, payload = queue.popleft()
+                if conn not in self.connections:
+                    continue
+                if op == OP_STEP:
+                    self.stepping[env_id] = conn
+                    step_ids.append(env_id)
+                    actions.append(np.frombuffer(payload, np.float64))
+                else:
+                    if op == OP_RESET:
+                        self.vec.reset([env_id])
+                    self.reply(conn, STATUS_OK, self.vec.obs[env_id].tobytes())
+        if step_ids:
+            self.vec.send(actions, step_ids)
+
+    def reply(self, conn, status, *payload):
+        try:
+            conn.reply(status, *payload)
+        except OSError:
+            self.drop(conn)
+
+    def drop(self, conn):
+        if conn in self.connections:
+            self.connections.remove(conn)
+            conn.sock.close()
+
+    def close(self):
+        for conn in list(self.connections):
+            self.drop(conn)
+        self.sock.close()
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
+        self.vec.close()
+
+
+class SimClient():
+    """
+    Connects to a SimServer
+
+    Parameters
+    ----------
+    address: str
+        Address the server listens on, see SimServer
+    """
+    def __init__(self, address):
+        family, address = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.connect(address)
+
+        info = self.request(OP_INFO)
+        self.n_envs, self.n_cars, self.action_width, ndim, n = INFO.unpack_from(info)
+        self.obs_dtype = np.dtype(info[INFO.size:INFO.size + n].decode())
+        self.obs_shape = (self.n_cars,) + struct.unpack_from("<{}I".format(ndim), info, INFO.size + n)
+
+    def request(self, op, env_id=0, payload=b""):
+        self.sock.sendall(REQUEST.pack(op, env_id, len(payload)) + payload)
+        status, n = REPLY.unpack(recv_exact(self.sock, REPLY.size))
+        data = recv_exact(self.sock, n)
+        if status != STATUS_OK:
+            fluids_assert(False, "Server error: {}".format(data.decode()))
+        return data
+
+    def get_obs(self, data):
+        return np.frombuffer(data, self.obs_dtype).reshape(self.obs_shape)
+
+    def reset(self, env_id):
+        """
+        Starts a new episode of a simulation, unless it has not been stepped since the last one started
+
+        Returns
+        -------
+        np.array
+            Observations of the controlled cars, of shape (n_cars, ...)
+        """
+        return self.get_obs(self.request(OP_RESET, env_id))
+
+    def observe(self, env_id):
+        """
+        Returns
+        -------
+        np.array
+            Current observations of the controlled cars, of shape (n_cars, ...)
+        """
+        return self.get_obs(self.request(OP_OBSERVE, env_id))
+
+    def step(self, env_id, actions):
+        """
+        Simulates one frame of a simulation
+
+        Parameters
+        ----------
+        actions: np.array
+            Actions of the controlled cars, of shape (n_cars, action_width)
+
+        Returns
+        -------
+        tuple of (np.array, float, bool)
+            Observations, reward and if the episode is done, see VecFluidSim.step
+        """
+        payload = np.ascontiguousarray(actions, np.float64).reshape(self.n_cars * self.action_width).tobytes()
+        data = self.request(OP_STEP, env_id, payload)
+        reward, done = RESULT.unpack_from(data)
+        return self.get_obs(data[RESULT.size:]), reward, done
+
+    def close(self):
+        self.sock.close()
+
+
+def run_load_client(job):
+    address, env_id, steps, seed = job
+    client = SimClient(address)
+    rng = np.random.default_rng(seed)
+    client.reset(env_id)
+    latencies = np.zeros(steps)
+    start_time = time.time()
+    for i in range(steps):
+        actions = rng.uniform(-1, 1, (client.n_cars, client.action_width))
+        start = time.perf_counter()
+        client.step(env_id, actions)
+        latencies[i] = time.perf_counter() - start
+    stop_time = time.time()
+    client.close()
+    return latencies, start_time, stop_time
+
+def load_test(address, clients=4, steps=100, seed=None):
+    """
+    Steps the simulations of a server from several client processes, one simulation per client
+    unless there are more clients than simulations
+
+    Returns
+    -------
+    dict
+        Total steps, steps per second, and p50, p99 and max step latencies in milliseconds
+    """
+    client = SimClient(address)
+    n_envs = client.n_envs
+    client.close()
+    seeds = make_seed_sequence(seed).spawn(clients)
+    jobs = [(address, i % n_envs, steps, seeds[i]) for i in range(clients)]
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(run_load_client, jobs)
+    latencies = np.concatenate([r[0] for r in results]) * 1000
+    # Resets are left out, so only the time the clients spent stepping is counted
+    elapsed = max(r[2] for r in results) - min(r[1] for r in results)
+    return {"steps"           : len(latencies),
+            "steps_per_second": len(latencies) / elapsed,
+            "p50_ms"          : float(np.percentile(latencies, 50)),
+            "p99_ms"          : float(np.percentile(latencies, 99)),
+            "max_ms"          : float(latencies.max())}
+
+
+def main(argv):
+    """
+    Entry point of python -m fluids serve and python -m fluids loadtest
+    """
+    parser = argparse.ArgumentParser(prog="python -m fluids",
+                                     description='Serve FLUIDS simulations over a socket')
+    commands = parser.add_subparsers(dest='command')
+    serve = commands.add_parser('serve', help='Host simulations')
+    serve.add_argument('address', metavar='address', type=str,
+                       help='host:port to listen on, or the path of a Unix-domain socket')
+    serve.add_argument('-n', metavar='N', dest='n_envs', type=int, default=4,
+                       help='Number of simulations')
+    serve.add_argument('-b', metavar='N', type=int, default=10,
+                       help='Number of background cars')
+    serve.add_argument('-c', metavar='N', type=int, default=1,
+                       help='Number of controlled cars')
+    serve.add_argument('-p', metavar='N', type=int, default=5,
+                       help='Number of background pedestrians')
+    serve.add_argument('-o', metavar='str', type=str, default="grid",
+                       choices=["birdseye", "grid", "qlidar"],
+                       help='Observation type')
+    serve.add_argument('--obs-args', metavar='json', dest='obs_args', type=json.loads, default={},
+                       help='Observation arguments as a JSON object, e.g. \'{"obs_dim": 300, "shape": [40, 40]}\'')
+    serve.add_argument('--dtype', metavar='str', type=str, default=None,
+                       help='Data type of the observations')
+    serve.add_argument('--horizon', metavar='N', type=int, default=None,
+                       help='Length of episodes')
+    serve.add_argument('--state', metavar='file', type=str, default=STATE_CITY,
+                       help='Layout file for state generation')
+    serve.add_argument('--seed', metavar='N', type=int, default=None,
+                       help='Seed of the simulations')
+    loadtest = commands.add_parser('loadtest', help='Measure the throughput of a server')
+    loadtest.add_argument('address', metavar='address', type=str,
+                          help='Address of the server')
+    loadtest.add_argument('-j', metavar='N', dest='clients', type=int, default=4,
+                          help='Number of client processes')
+    loadtest.add_argument('--steps', metavar='N', type=int, default=100,
+                          help='Steps per client')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        obs_space = {"birdseye" :OBS_BIRDSEYE,
+                     "grid"     :OBS_GRID,
+                     "qlidar"   :OBS_QLIDAR}[args.o]
+        if "shape" in args.obs_args:
+            args.obs_args["shape"] = tuple(args.obs_args["shape"])
+        server = SimServer(args.address, {"n_envs"     : args.n_envs,
+                                          "state_args" : {"layout"          : args.state,
+                                                          "controlled_cars" : args.c,
+                                                          "background_cars" : args.b,
+                                                          "background_peds" : args.p},
+                                          "sim_args"   : {"background_control": BACKGROUND_CSP},
+                                          "obs_space"  : obs_space,
+                                          "obs_args"   : args.obs_args,
+                                          "obs_dtype"  : args.dtype,
+                                          "horizon"    : args.horizon,
+                                          "seed"       : args.seed})
+        # Let the server stop its workers and remove its socket when it is terminated
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve()
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'loadtest':
+        stats = load_test(args.address, args.clients, args.steps)
+        fluids_print("{} steps, {:.1f} steps/s, latency p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(
+            stats["steps"], stats["steps_per_second"], stats["p50_ms"], stats["p99_ms"], stats["max_ms"]))
+    else:
+        parser.print_help()
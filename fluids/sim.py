@@ -1,10 +1,10 @@
 import numpy as np
 import json
+import os
 import pygame
 from pygame.locals import DOUBLEBUF
 from six import iteritems
 from ortools.constraint_solver import pywrapcp
-from copy import deepcopy
 
 from shapely import speedups
 
@@ -14,10 +14,11 @@ if speedups.available:
 
 from fluids.state import State
 from fluids.assets import *
+from fluids.assets.car import velocity_controls
 from fluids.utils import *
 from fluids.actions import *
 from fluids.consts import *
-from fluids.obs import GridObservation
+from fluids.obs import GridObservation, ObservationCache, FrameStack
 from fluids.datasaver import DataSaver
 
 
@@ -48,6 +49,11 @@ class FluidSim(object):
         fluids.BIRDSEYE or fluids.NONE
     screen_dim: int
         Height of the visualization screen. Default is 800
+    obs_stack: int
+        Number of frames returned per car by get_stacked_observations. Default is 4
+    seed: int or np.random.SeedSequence
+        If set, the car and pedestrian routing of every state passed to set_state is
+        reseeded from a child of this seed
     """
     def __init__(self,
                  visualization_level =1,
@@ -57,6 +63,8 @@ class FluidSim(object):
                  background_control  =BACKGROUND_NULL,
                  reward_fn           =REWARD_PATH,
                  screen_dim          =800,
+                 obs_stack           =4,
+                 seed                =None,
                  ):
 
         self.state                 = None
@@ -79,7 +87,13 @@ class FluidSim(object):
         self.last_keys_pressed     = None
         self.last_obs              = {}
         self.next_actions          = {}
+        self.obs_cache             = ObservationCache()
+        self.obs_stack             = obs_stack
+        self.frame_stacks          = {}
+        self.seed_sequence         = None if seed is None else make_seed_sequence(seed)
         self.data_saver = None
+        self.state_logger = None
+        self.profiler = NULL_PROFILER
 
 
     def __del__(self):
@@ -95,6 +109,9 @@ class FluidSim(object):
             State object to simulate
         """
         self.state = state
+        self.frame_stacks = {}
+        if self.seed_sequence is not None:
+            state.seed(self.seed_sequence.spawn(1)[0])
         self.multiagent_plan()
 
         state.update_vis_level(self.vis_level)
@@ -102,6 +119,35 @@ class FluidSim(object):
     def set_data_saver(self, data_saver):
         self.data_saver = data_saver
 
+    def set_state_logger(self, state_logger):
+        """
+        Sets a fluids.statelog.StateLogger that records the state after every step
+        """
+        self.state_logger = state_logger
+
+    def set_profiler(self, profiler):
+        """
+        Sets a fluids.utils.Profiler that times the stages of every tick, see get_profile.
+        Passing None turns profiling off.
+        """
+        self.profiler = NULL_PROFILER if profiler is None else profiler
+
+    def get_profile(self):
+        """
+        Returns the time spent in every stage of the simulation, if a profiler was set with set_profiler.
+        "step" covers step and step_array, with the sub-stages actions, objects, arrays, reward,
+        plan, save_data and state_log. "plan" is the background planner wherever it runs, with
+        the sub-stages futures, pairs (constraints between pairs of objects) and solve.
+        "observations" is get_observation, and "observations/compute" the deferred work of
+        building observation arrays.
+
+        Returns
+        -------
+        dict of (str -> dict)
+            Per stage: total seconds, number of calls, mean milliseconds per call and per tick
+        """
+        return self.profiler.get_profile()
+
     def save_data(self):
         if self.data_saver == None: return
         fluids_assert(type(self.data_saver) == DataSaver,
@@ -170,6 +216,102 @@ class FluidSim(object):
                 fluids_print("FPS: " + str(int(self.clock.get_fps())))
 
 
+    def snapshot(self):
+        """
+        Captures everything needed to branch off the run at the current tick, without touching
+        the disk: a State snapshot, the actions planned for the next step and the observation
+        stacks. Use restore to go back to it, any number of times.
+
+        Returns
+        -------
+        dict
+            "state" is a snapshot made by State.snapshot
+        """
+        fluids_assert(self.state, "snapshot called without setting the state")
+        return {"state"       : self.state.snapshot(),
+                "next_actions": dict(self.next_actions),
+                "frame_stacks": {k: stack.copy() for k, stack in iteritems(self.frame_stacks)}}
+
+    def restore(self, snap):
+        """
+        Returns the simulation to a snapshot made by snapshot, so that the following steps
+        repeat the ones taken after it
+
+        Parameters
+        ----------
+        snap: dict
+            Snapshot made by snapshot
+        """
+        fluids_assert(self.state, "restore called without setting the state")
+        self.state.restore(snap["state"])
+        self.next_actions = dict(snap["next_actions"])
+        self.frame_stacks = {k: stack.copy() for k, stack in iteritems(snap["frame_stacks"])}
+
+    def save_checkpoint(self, path):
+        """
+        Saves everything needed to continue the run at the current tick: the dynamic state,
+        random streams, planned actions, and the position of the DataSaver. The checkpoint is
+        written to a temporary file first, so a crash never leaves a partial checkpoint at path.
+
+        Parameters
+        ----------
+        path: str
+            File to write the checkpoint to
+        """
+        fluids_assert(self.state, "save_checkpoint called without setting the state")
+        snap = self.state.snapshot()
+        meta = {"layout_hash" : self.state.layout_hash,
+                "time"        : snap["time"],
+                "rng"         : snap["rng"],
+                "next_actions": [[k, encode_action(v)] for k, v in iteritems(self.next_actions)],
+                "last_actions": [[k, encode_action(car.last_action)]
+                                 for k, car in iteritems(self.state.type_map[Car])]}
+        arrays = {"objects": snap["objects"]}
+        if self.data_saver:
+            meta["data_saver"], rows = self.data_saver.get_checkpoint()
+            if rows is not None:
+                arrays["data_saver_rows"] = rows
+        arrays["meta"] = np.array(json.dumps(meta))
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    def load_checkpoint(self, path):
+        """
+        Continues a run from a checkpoint made by save_checkpoint. The current state must have been
+        built with the same layout and arguments. If its dynamic objects have different keys, they are
+        renamed to the keys in the checkpoint, matched by position. The DataSaver, if set, continues
+        its output where it was when the checkpoint was made.
+
+        Parameters
+        ----------
+        path: str
+            Checkpoint file
+        """
+        fluids_assert(self.state, "load_checkpoint called without setting the state")
+        with np.load(path) as f:
+            meta = json.loads(str(f["meta"]))
+            objects = f["objects"]
+            rows = f["data_saver_rows"] if "data_saver_rows" in f else None
+        fluids_assert(meta["layout_hash"] == self.state.layout_hash,
+                      "Checkpoint was made with a different layout")
+
+        if list(self.state.dynamic_objects) != objects['key'].tolist():
+            self.state.rekey(objects['key'].tolist())
+        self.state.restore({"time"   : meta["time"],
+                            "objects": objects,
+                            "rng"    : meta["rng"],
+                            "shapes" : None})
+        for k, action in meta["last_actions"]:
+            self.state.objects[k].last_action = decode_action(action)
+        self.next_actions = {k: decode_action(v) for k, v in meta["next_actions"]}
+        self.frame_stacks = {}
+        if self.data_saver:
+            fluids_assert("data_saver" in meta, "Checkpoint was made without a DataSaver")
+            self.data_saver.load_checkpoint(meta["data_saver"], rows)
+
     def get_control_keys(self):
         """
         Returns
@@ -197,6 +339,9 @@ class FluidSim(object):
 
         """
         fluids_assert(self.state, "step called without setting the state")
+        profiler = self.profiler
+        profiler.end_tick(self.state.time)
+        step_start = profiler.start()
 
         car_keys = self.state.controlled_cars.keys()
         for k in list(self.next_actions):
@@ -219,21 +364,115 @@ class FluidSim(object):
                     self.next_actions[k] = None
             elif type(v) == SteeringAction:
                 action = self.next_actions
+        profiler.stop("step/actions", step_start)
 
 
         # Simulate the objects
+        start = profiler.start()
         for k, v in iteritems(self.state.dynamic_objects):
             self.state.objects[k].step(self.next_actions[k] if k in self.next_actions \
                                        else None)
+        profiler.stop("step/objects", start)
+
+        reward_step = self.end_step()
+        profiler.stop("step", step_start)
+        return reward_step
+
+    def step_array(self, keys, actions, action_type=SteeringAccAction):
+        """
+        Simulates one frame, with the actions of controlled cars given as one array.
+        This avoids creating an Action per car, and runs the velocity controller for all cars at once.
+        Cars controlled this way have no last_action, so LastValidAction afterwards acts as no action.
+
+        Parameters
+        ----------
+        keys: list of keys
+            Keys of controlled cars, in the order of the rows of actions
+        actions: np.array
+            Array of shape (len(keys), 2) of (steer, acc) for SteeringAccAction or (steer, vel)
+            for SteeringVelAction, or of shape (len(keys),) of vel for VelocityAction or steer
+            for SteeringAction, where the supervisor sets the acceleration
+        action_type: fluids.Action
+            Type of the actions. SteeringAccAction, SteeringAction, VelocityAction
+            and SteeringVelAction are supported
+
+        Returns
+        -------
+        float
+            Reward of the step
+        """
+        fluids_assert(self.state, "step_array called without setting the state")
+        profiler = self.profiler
+        profiler.end_tick(self.state.time)
+        step_start = profiler.start()
+        keys = list(keys)
+        for k in keys:
+            fluids_assert(k in self.state.controlled_cars, "Key {} is not a controlled car".format(k))
+        cars = [self.state.controlled_cars[k] for k in keys]
+        actions = np.asarray(actions, dtype=np.float64).reshape(len(keys), -1)
+
+        if action_type == SteeringAccAction:
+            controls = actions[:, :2]
+        elif action_type == VelocityAction:
+            controls = velocity_controls(cars, actions[:, 0])
+        elif action_type == SteeringVelAction:
+            controls = velocity_controls(cars, actions[:, 1])
+            controls[:, 0] = actions[:, 0]
+        elif action_type == SteeringAction:
+            for k in keys:
+                fluids_assert(k in self.next_actions,
+                              "SteeringAction needs a planned velocity for car {}, which background_control "
+                              "BACKGROUND_CSP provides".format(k))
+            controls = velocity_controls(cars, [self.next_actions[k].get_action() for k in keys],
+                                         update=False)
+            controls[:, 0] = actions[:, 0]
+        else:
+            fluids_assert(False, "Illegal action type")
+        controls = dict(zip(keys, controls.tolist()))
+        profiler.stop("step/actions", step_start)
+
+        # Simulate the objects, in the same order as step
+        start = profiler.start()
+        for k in self.state.dynamic_objects:
+            obj = self.state.objects[k]
+            if k in controls:
+                obj.step_control(*controls[k])
+                obj.last_action = None
+            else:
+                obj.step(self.next_actions[k] if k in self.next_actions else None)
+        profiler.stop("step/objects", start)
+
+        reward_step = self.end_step()
+        profiler.stop("step", step_start)
+        return reward_step
 
+    def end_step(self):
+        """
+        Advances the time after the objects are simulated, and runs the reward function,
+        the background planner and the recorders
+        """
+        profiler = self.profiler
         self.state.time += 1
+        start = profiler.start()
+        self.state.update_arrays()
+        profiler.stop("step/arrays", start)
 
+        start = profiler.start()
         reward_step = self.reward_fn(self.state)
+        profiler.stop("step/reward", start)
         #print(reward_step)
 
         # Get background vehicle and pedestrian controls
+        start = profiler.start()
         self.multiagent_plan()
+        profiler.stop("step/plan", start)
+        start = profiler.start()
         self.save_data()
+        profiler.stop("step/save_data", start)
+        if self.state_logger:
+            start = profiler.start()
+            self.state_logger.record()
+            profiler.stop("step/state_log", start)
 
         return reward_step
     def get_observations(self, keys={}):
@@ -250,12 +489,81 @@ class FluidSim(object):
             Dictionary mapping keys of controlled cars to FluidsObs object
         """
         fluids_assert(self.state, "get_observations called without setting the state")
-        observations = {k:self.state.objects[k].make_observation(self.obs_space,
-                                                                 **self.obs_args)
-                        for k in keys}
+        observations = {k:self.get_observation(k) for k in keys}
         self.last_obs = observations
         return observations
 
+    def get_stacked_observations(self, keys={}, dtype=None):
+        """
+        Get the last obs_stack observation arrays of controlled cars.
+        Frames are kept in a preallocated ring buffer per car, which is reset
+        when the car at a key is replaced or the state is changed.
+
+        Parameters
+        ----------
+        keys: dict of keys
+            Keys should refer to cars in the scene
+        dtype: np.dtype
+            Data type of the stacked arrays
+        Returns
+        -------
+        dict of (key -> np.array)
+            Dictionary mapping keys to read-only arrays of shape (obs_stack, ...),
+            oldest frame first. The arrays are views that are only valid until
+            the next tick.
+        """
+        fluids_assert(self.state, "get_stacked_observations called without setting the state")
+        stacks = {}
+        for k in keys:
+            car = self.state.objects[k]
+            if k not in self.frame_stacks or self.frame_stacks[k].n_frames != self.obs_stack \
+               or self.frame_stacks[k].dtype != dtype:
+                self.frame_stacks[k] = FrameStack(self.obs_stack, dtype=dtype)
+            frame_stack = self.frame_stacks[k]
+            if frame_stack.owner is not car:
+                frame_stack.reset(owner=car)
+            stacks[k] = frame_stack.push(self.get_observation(k), time=self.state.time)
+        return stacks
+
+    def get_observation(self, key, obs_space=None, obs_args=None):
+        """
+        Get one observation of a car in the scene.
+        Observations are memoized for the current tick, so repeated requests
+        with the same arguments return the same FluidsObs object.
+
+        Parameters
+        ----------
+        key: int
+            Key of a car in the scene
+        obs_space: str
+            Observation type. Defaults to the simulator's obs_space
+        obs_args: dict
+            Observation arguments. Defaults to the simulator's obs_args
+        Returns
+        -------
+        FluidsObs
+        """
+        fluids_assert(self.state, "get_observation called without setting the state")
+        start = self.profiler.start()
+        if obs_space is None:
+            obs_space = self.obs_space
+            obs_args = self.obs_args if obs_args is None else obs_args
+        obs = self.obs_cache.get(self.state, key, obs_space,
+                                 {} if obs_args is None else obs_args)
+        if obs and self.profiler.enabled:
+            obs.profiler = self.profiler
+        self.profiler.stop("observations", start)
+        return obs
+
+    def get_obs_cache_stats(self):
+        """
+        Returns
+        -------
+        dict
+            Hit and miss counts of the per-tick observation cache
+        """
+        return self.obs_cache.stats()
+
     def get_supervisor_actions(self, action_type=SteeringAccAction, keys={}):
         """
         Get the actions assigned to the selected car by the FLUIDS multiagent planer
@@ -290,24 +598,42 @@ class FluidSim(object):
         else:
             fluids_assert(false, "Illegal action type")
 
-    def multiagent_plan(self):
+    def multiagent_plan(self, keys=None):
+        """
+        Plans the next actions of background objects
+
+        Parameters
+        ----------
+        keys: list of keys
+            If specified, only the cars and pedestrians with these keys are planned, and others
+            are left out of the problem
+        """
         if self.background_control == BACKGROUND_NULL:
             return {}
+        profiler = self.profiler
+        plan_start = profiler.start()
+        cars = self.state.type_map[Car]
+        peds = self.state.type_map[Pedestrian]
+        if keys is not None:
+            cars = {k: cars[k] for k in keys if k in cars}
+            peds = {k: peds[k] for k in keys if k in peds}
 
         # "Futures" represents the future zones where the car will occupy if the car
         #     chooses to move
         # "Buffered_objs" represents a buffered region around the car, which is
         #     approximately where the car will occupy if it chooses to stop
         futures            = { k:o.get_future_shape() \
-                               for k, o in iteritems(self.state.type_map[Car])}
+                               for k, o in iteritems(cars)}
         futures_lights     = [(o, o.get_future_color()) \
                               for k, o in iteritems(self.state.type_map[TrafficLight])]
         futures_crosswalks = [(o, o.get_future_color()) \
                               for k, o in iteritems(self.state.type_map[CrossWalkLight])]
         futures_peds       = { k:o.get_future_shape() \
-                               for k, o in iteritems(self.state.type_map[Pedestrian])}
+                               for k, o in iteritems(peds)}
         buffered_objs      = { k: o.shapely_obj.buffer(10) \
-                               for k, o in iteritems(self.state.type_map[Car])}
+                               for k, o in iteritems(cars)}
+        profiler.stop("plan/futures", plan_start)
+        start = profiler.start()
 
 
         keys = list(futures.keys())
@@ -400,8 +726,11 @@ class FluidSim(object):
                     if flc == "red" and ped1.intersects(fl):
                         solver.Add(k1v == 0)
 
+        profiler.stop("plan/pairs", start)
+
         # Solve the CSP, try to assign max allowable velocity to every car/pedestrian
         #  (everything stop is a trivial solution)
+        start = profiler.start()
         db = solver.Phase(sorted([v for k,v in iteritems(var_map)]),
                           solver.CHOOSE_FIRST_UNBOUND,
                           solver.ASSIGN_MAX_VALUE)
@@ -422,6 +751,8 @@ class FluidSim(object):
 
 
         self.next_actions = actions
+        profiler.stop("plan/solve", start)
+        profiler.stop("plan", plan_start)
 
 
     def run_time(self):
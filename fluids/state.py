@@ -2,7 +2,6 @@ import numpy as np
 import json
 import os
 from six import iteritems
-import random
 import pygame
 import hashlib
 
@@ -21,70 +20,80 @@ def get_id():
     id_index = id_index + 1
     return r
 
+def reserve_ids(max_key):
+    """
+    Makes sure keys up to max_key are never handed out to new objects
+    """
+    global id_index
+    id_index = max(id_index, max_key + 1)
 
-class State(object):
+
+# Types of dynamic objects, in the order of their type codes in state records
+DYNAMIC_TYPES = [Car, Pedestrian, TrafficLight, CrossWalkLight]
+# Types of static objects, in the order of their type codes in StaticWorld.static_geometry
+STATIC_TYPES = [Terrain, Lane, Street, CrossWalk, Sidewalk, PedCrossing]
+RECORD_POINTS = 5
+
+
+class StaticWorld(object):
     """
-    This class represents the state of the world
+    The parts of a State that never change: static objects, the waypoint graph, packed geometry,
+    the compiled layout and the static surfaces. One world can be passed to any number of States,
+    which then only create their own lights, cars and pedestrians. Worker processes forked after
+    the world is built share its memory with the parent, as nothing writes to it.
 
     Parameters
     ----------
     layout: str
-        Name of json layout file specifiying environment object positions.
-        Default is "fluids_state_city"
-    controlled_cars: int
-        Number of cars to accept external control for
-    background_cars: int
-        Number of cars to control with the background planner
-    background_peds: int
-        Number of pedestrians to control with the background planner
-    use_traffic_lights: bool
-        Sets whether traffic lights are generated
-    use_ped_lights: bool
-        Sets whether pedestrian lights are generated
+        Name of json layout file specifiying environment object positions, or the path
+        of a layout file, such as one written by fluids.layouts.generate. Default is "fluids_state_city"
     waypoint_width: int
         Sets width of waypoints. Increasing this makes waypoints span the lanes
+    use_traffic_lights: bool
+        Sets whether States using the world generate traffic lights
+    use_ped_lights: bool
+        Sets whether States using the world generate pedestrian lights
+    vis_level: int
+        Static surfaces are only rendered if this is set
     """
     def __init__(self,
                  layout             =STATE_CITY,
-                 controlled_cars    =0,
-                 background_cars    =0,
-                 background_peds    =0,
                  waypoint_width     =5,
                  use_traffic_lights =True,
                  use_ped_lights     =True,
                  vis_level          =1):
 
         fluids_print("Loading layout: " + layout)
-        layout = open(os.path.join(basedir, "layouts", layout + ".json"))
+        self.layout_name        = layout
+        self.waypoint_width     = waypoint_width
+        self.use_traffic_lights = use_traffic_lights
+        self.use_ped_lights     = use_ped_lights
+        if not os.path.isfile(layout):
+            layout = os.path.join(basedir, "layouts", layout + ".json")
+        with open(layout) as f:
+            compiled_layout = f.read()
+        # The cache is keyed by content, so a layout file that is generated again is compiled again
         cfilename = "{}{}.json".format(
-            hashlib.md5(str(layout).encode()).hexdigest()[:10],
+            hashlib.md5(compiled_layout.encode()).hexdigest()[:10],
             __version__)
         cached_layout = lookup_cache(cfilename)
         cache_found = cached_layout is not False
         if cached_layout:
             fluids_print("Cached layout found")
-            layout = cached_layout
+            with cached_layout:
+                compiled_layout = cached_layout.read()
 
-        layout = json.load(layout)
+        layout = json.loads(compiled_layout)
 
 
-        self.time             = 0
-        self.objects          = {}
-        self.type_map         = {k:{} for k in [Terrain, Lane,
-                                                Street, CrossWalk,
-                                                Sidewalk,
-                                                TrafficLight, Car,
-                                                CrossWalkLight, Pedestrian,
-                                                PedCrossing]}
+        self.type_map         = {k:{} for k in STATIC_TYPES}
         self.static_objects   = {}
-        self.dynamic_objects  = {}
         self.dimensions       = (layout['dimension_x'] + 800,
                                  layout['dimension_y'])
         self.vis_level        = vis_level
+        self.lanes            = []
 
 
-        lanes = []
-        sidewalks = []
         fluids_print("Creating objects")
         for obj_info in layout['static_objects']:
             typ = {"Terrain"    : Terrain,
@@ -95,34 +104,18 @@ class State(object):
                    "Sidewalk"   : Sidewalk}[obj_info['type']]
             if typ == Lane:
                 obj_info["wp_width"] = waypoint_width
-            obj = typ(state=self, vis_level=vis_level, **obj_info)
+            obj = typ(vis_level=vis_level, **obj_info)
 
             if typ == Lane:
-                lanes.append(obj)
-            if typ == Sidewalk:
-                sidewalks.append(obj)
+                self.lanes.append(obj)
             key = get_id()
             self.type_map[typ][key] = obj
-            self.objects[key] = obj
             self.static_objects[key] = obj
             obj_info['fluids_obj'] = obj
-        car_ids = []
-        for obj_info in layout['dynamic_objects']:
-            typ = {"Car"           : Car,
-                   "TrafficLight"  : TrafficLight,
-                   "CrossWalkLight": CrossWalkLight,
-                   "Pedestrian"    : Pedestrian}[obj_info['type']]
-            obj = typ(state=self, vis_level=vis_level, **obj_info)
-            if not use_traffic_lights and type(obj) == TrafficLight:
-                continue
-            if not use_ped_lights and type(obj) == CrossWalkLight:
-                continue
-            key = get_id()
-            if type == Car:
-                car_ids.append(key)
-            self.type_map[typ][key] = obj
-            self.objects[key] = obj
-            self.dynamic_objects[key] = obj
+        # Lights hold a phase, so every State creates its own from these
+        self.dynamic_infos = [obj_info for obj_info in layout['dynamic_objects']
+                              if (use_traffic_lights or obj_info['type'] != "TrafficLight")
+                              and (use_ped_lights or obj_info['type'] != "CrossWalkLight")]
 
 
         fluids_print("Generating trajectory map")
@@ -134,6 +127,7 @@ class State(object):
             for wp_info in layout['waypoints']:
                 index = wp_info.pop('index')
                 wp = Waypoint(owner=None, ydim=waypoint_width, **wp_info)
+                wp.index = index
                 wp_map[index] = wp
                 self.waypoints.append(wp)
             for wp in self.waypoints:
@@ -143,13 +137,14 @@ class State(object):
             for wp_info in layout['ped_waypoints']:
                 index = wp_info.pop('index')
                 wp = Waypoint(owner=None, **wp_info)
+                wp.index = index
                 wp_map[index] = wp
                 self.ped_waypoints.append(wp)
             for wp in self.ped_waypoints:
                 wp.nxt = [wp_map[index] for index in wp.nxt]
 
 
-            for k, obj in iteritems(self.objects):
+            for k, obj in iteritems(self.static_objects):
                 obj.waypoints       = [wp_map[i] for i in obj.waypoints]
                 for wp in obj.waypoints:
                     wp.owner = obj
@@ -188,65 +183,28 @@ class State(object):
                 obj_info['waypoints']     = [wp.index for wp in obj.waypoints]
 
 
+        self.waypoint_map = {wp.index: wp for wp in self.waypoints + self.ped_waypoints}
         for waypoint in self.waypoints:
             waypoint.create_edges(buff=20)
         for waypoint in self.ped_waypoints:
             waypoint.create_edges(buff=5)
 
-
-        fluids_print("Generating cars")
-        for i in range(controlled_cars + background_cars):
-            while True:
-                start = lanes[np.random.random_integers(0, len(lanes)-1)]
-                x = np.random.uniform(start.minx + 50, start.maxx - 50)
-                y = np.random.uniform(start.miny + 50, start.maxy - 50)
-                angle = start.angle + np.random.uniform(-0.1, 0.1)
-                car = Car(state=self, x=x, y=y, angle=angle, vis_level=vis_level)
-                min_d = min([car.dist_to(other) for k, other \
-                             in iteritems(self.type_map[Car])] + [np.inf])
-                if min_d > 10 and not self.is_in_collision(car):
-                    key = get_id()
-                    for waypoint in self.waypoints:
-                        if car.intersects(waypoint):
-                            while car.intersects(waypoint):
-                                waypoint = random.choice(waypoint.nxt).out_p
-                            waypoint = random.choice(waypoint.nxt).out_p
-                            car.waypoints = [waypoint]
-                            break
-                    self.type_map[Car][key] = car
-                    self.objects[key] = car
-                    car_ids.append(key)
-                    self.dynamic_objects[key] = car
-                    break
-
-        self.controlled_cars = {k: self.objects[k] for k in car_ids[:controlled_cars]}
-        for k, car in iteritems(self.controlled_cars):
-            car.color = (0x0b,0x04,0xf4)#(0x5B,0x5C,0xF7)
-        self.background_cars = {k: self.objects[k] for k in car_ids[controlled_cars:]}
-
-
-        fluids_print("Generating peds")
-        for i in range(background_peds):
-            while True:
-                wp = random.choice(self.ped_waypoints)
-                ped = Pedestrian(state=self, x=wp.x, y=wp.y,
-                                 angle=wp.angle, vis_level=vis_level)
-                while ped.intersects(wp):
-                    wp = random.choice(wp.nxt).out_p
-                ped.waypoints = [wp]
-                if not self.is_in_collision(ped):
-                    key = get_id()
-                    self.objects[key] = ped
-                    self.type_map[Pedestrian][key] = ped
-                    self.dynamic_objects[key] = obj
-                    break
+        self.static_geometry = PolygonStore(self.static_objects, STATIC_TYPES)
+        # Static objects never move, so writes to their geometry are bugs
+        for arr in [self.static_geometry.points, self.static_geometry.offsets, self.static_geometry.keys,
+                    self.static_geometry.type_codes, self.static_geometry.angles, self.static_geometry.bounds]:
+            arr.flags.writeable = False
 
 
         if not cache_found:
+            compiled_layout = json.dumps(layout, indent=1)
             fluids_print("Caching layout to: " + cfilename)
             with open(get_cache_filename(cfilename), "w") as outfile:
-                json.dump(layout, outfile, indent=1)
-        fluids_print("State creation complete")
+                outfile.write(compiled_layout)
+        # Identifies the compiled layout, so checkpoints are only loaded into matching worlds
+        self.layout_hash = hashlib.md5("{}{}".format(
+            compiled_layout,
+            (waypoint_width, use_traffic_lights, use_ped_lights)).encode()).hexdigest()
         if vis_level:
             self.static_surface       = pygame.Surface(self.dimensions)
             try:
@@ -297,7 +255,7 @@ class State(object):
         self.waypoints.extend(new_waypoints)
 
         self.ped_waypoints = []
-        for k, obj in iteritems(self.objects):
+        for k, obj in iteritems(self.static_objects):
             if type(obj) in {CrossWalk, Sidewalk}:
                 self.ped_waypoints.extend(obj.start_waypoints)
                 self.ped_waypoints.extend(obj.end_waypoints)
@@ -334,11 +292,180 @@ class State(object):
             i += 1
             wp.owner.waypoints.append(wp)
 
+
+class State(object):
+    """
+    This class represents the state of the world
+
+    Parameters
+    ----------
+    layout: str
+        Name of json layout file specifiying environment object positions, or the path
+        of a layout file, such as one written by fluids.layouts.generate. Default is "fluids_state_city"
+    controlled_cars: int
+        Number of cars to accept external control for
+    background_cars: int
+        Number of cars to control with the background planner
+    background_peds: int
+        Number of pedestrians to control with the background planner
+    use_traffic_lights: bool
+        Sets whether traffic lights are generated
+    use_ped_lights: bool
+        Sets whether pedestrian lights are generated
+    waypoint_width: int
+        Sets width of waypoints. Increasing this makes waypoints span the lanes
+    seed: int or np.random.SeedSequence
+        Seeds car spawning and the routing of cars and pedestrians, which use separate
+        random streams. If None, the seed is drawn from np.random
+    world: fluids.state.StaticWorld
+        If specified, the static objects, waypoints and surfaces of this world are used, and layout,
+        waypoint_width, use_traffic_lights and use_ped_lights are ignored. Passing one world to many
+        States saves building the layout for each of them
+    """
+    def __init__(self,
+                 layout             =STATE_CITY,
+                 controlled_cars    =0,
+                 background_cars    =0,
+                 background_peds    =0,
+                 waypoint_width     =5,
+                 use_traffic_lights =True,
+                 use_ped_lights     =True,
+                 vis_level          =1,
+                 seed               =None,
+                 world              =None):
+
+        if world is None:
+            world = StaticWorld(layout, waypoint_width, use_traffic_lights, use_ped_lights, vis_level)
+        fluids_assert(world.vis_level or not vis_level, "States with vis_level need a world built with vis_level")
+        self.world              = world
+        self.layout_name        = world.layout_name
+        self.waypoint_width     = world.waypoint_width
+        self.use_traffic_lights = world.use_traffic_lights
+        self.use_ped_lights     = world.use_ped_lights
+        self.layout_hash        = world.layout_hash
+        self.dimensions         = world.dimensions
+        self.static_objects     = world.static_objects
+        self.waypoints          = world.waypoints
+        self.ped_waypoints      = world.ped_waypoints
+        self.waypoint_map       = world.waypoint_map
+        self.static_geometry    = world.static_geometry
+
+
+        self.time             = 0
+        self.objects          = dict(world.static_objects)
+        self.type_map         = {k:world.type_map.get(k, {}) for k in [Terrain, Lane,
+                                                                       Street, CrossWalk,
+                                                                       Sidewalk,
+                                                                       TrafficLight, Car,
+                                                                       CrossWalkLight, Pedestrian,
+                                                                       PedCrossing]}
+        self.dynamic_objects  = {}
+        self.vis_level        = vis_level
+        self.frozen_objects   = {}
+        self.frozen_time      = None
+        self.revision         = 0
+        self.arrays           = None
+        self.seed(seed)
+
+
+        car_ids = []
+        for obj_info in world.dynamic_infos:
+            typ = {"Car"           : Car,
+                   "TrafficLight"  : TrafficLight,
+                   "CrossWalkLight": CrossWalkLight,
+                   "Pedestrian"    : Pedestrian}[obj_info['type']]
+            obj = typ(state=self, vis_level=vis_level, **obj_info)
+            key = get_id()
+            if type == Car:
+                car_ids.append(key)
+            self.type_map[typ][key] = obj
+            self.objects[key] = obj
+            self.dynamic_objects[key] = obj
+
+
+        fluids_print("Generating cars")
+        lanes = world.lanes
+        for i in range(controlled_cars + background_cars):
+            while True:
+                rng = self.spawn_rng
+                start = lanes[rng.integers(len(lanes))]
+                x = rng.uniform(start.minx + 50, start.maxx - 50)
+                y = rng.uniform(start.miny + 50, start.maxy - 50)
+                angle = start.angle + rng.uniform(-0.1, 0.1)
+                car = Car(state=self, x=x, y=y, angle=angle, vis_level=vis_level)
+                min_d = min([car.dist_to(other) for k, other \
+                             in iteritems(self.type_map[Car])] + [np.inf])
+                if min_d > 10 and not self.is_in_collision(car):
+                    key = get_id()
+                    for waypoint in self.waypoints:
+                        if car.intersects(waypoint):
+                            while car.intersects(waypoint):
+                                waypoint = waypoint.nxt[rng.integers(len(waypoint.nxt))].out_p
+                            waypoint = waypoint.nxt[rng.integers(len(waypoint.nxt))].out_p
+                            car.waypoints = [waypoint]
+                            break
+                    self.type_map[Car][key] = car
+                    self.objects[key] = car
+                    car_ids.append(key)
+                    self.dynamic_objects[key] = car
+                    break
+
+        self.controlled_cars = {k: self.objects[k] for k in car_ids[:controlled_cars]}
+        for k, car in iteritems(self.controlled_cars):
+            car.color = (0x0b,0x04,0xf4)#(0x5B,0x5C,0xF7)
+        self.background_cars = {k: self.objects[k] for k in car_ids[controlled_cars:]}
+
+
+        fluids_print("Generating peds")
+        for i in range(background_peds):
+            while True:
+                rng = self.spawn_rng
+                wp = self.ped_waypoints[rng.integers(len(self.ped_waypoints))]
+                ped = Pedestrian(state=self, x=wp.x, y=wp.y,
+                                 angle=wp.angle, vis_level=vis_level)
+                while ped.intersects(wp):
+                    wp = wp.nxt[rng.integers(len(wp.nxt))].out_p
+                ped.waypoints = [wp]
+                if not self.is_in_collision(ped):
+                    key = get_id()
+                    self.objects[key] = ped
+                    self.type_map[Pedestrian][key] = ped
+                    self.dynamic_objects[key] = ped
+                    break
+
+
+        fluids_print("State creation complete")
+
+    def seed(self, seed=None):
+        """
+        Seeds the spawn, car routing and pedestrian routing random streams
+
+        Parameters
+        ----------
+        seed: int or np.random.SeedSequence
+            If None, the seed is drawn from np.random, so np.random.seed still makes runs reproducible.
+            Pass children of SeedSequence.spawn to give parallel workers independent streams.
+
+        Returns
+        -------
+        np.random.SeedSequence
+            The sequence the streams were derived from
+        """
+        if seed is None:
+            seed = np.random.randint(2**31)
+        seed = make_seed_sequence(seed)
+        self.seed_sequence = seed
+        spawn_seed, car_seed, ped_seed = seed.spawn(3)
+        self.spawn_rng = np.random.default_rng(spawn_seed)
+        self.car_rng   = np.random.default_rng(car_seed)
+        self.ped_rng   = np.random.default_rng(ped_seed)
+        return seed
+
     def get_static_surface(self):
-        return self.static_surface
+        return self.world.static_surface
 
     def get_static_debug_surface(self):
-        return self.static_debug_surface
+        return self.world.static_debug_surface
 
     def get_dynamic_surface(self, background):
         dynamic_surface = background.copy()
@@ -359,6 +486,327 @@ class State(object):
                                            10)
         return dynamic_surface
 
+    def get_frozen_objects(self):
+        """
+        Returns dict of (id(obj) -> frozen copy of obj) for every dynamic object.
+        The copies are taken once per tick and shared by all observations of that tick.
+        """
+        if self.frozen_time != self.time:
+            self.frozen_objects = {id(self.objects[k]): self.objects[k].freeze()
+                                   for k in self.dynamic_objects}
+            self.frozen_time = self.time
+        return self.frozen_objects
+
+    def get_arrays(self):
+        """
+        Returns read-only arrays describing every dynamic object, one row per object.
+        The arrays are updated in place after every FluidSim step, so they can be kept
+        and read again on later ticks. Rows do not move, see get_array_rows.
+
+        Returns
+        -------
+        dict of (name -> np.array)
+            keys: (N,) key of the object in each row
+            type: (N,) index of the object type in fluids.state.DYNAMIC_TYPES
+            controlled, background: (N,) masks of controlled and background cars
+            position: (N, 2) x and y
+            angle: (N,) heading in radians
+            vel: (N,) velocity, 0 for lights
+            next_waypoint: (N, 2) position of the next waypoint, NaN if there is none
+            phase: (N,) index of the light color in phase_colors, 0 for cars and pedestrians
+        """
+        if self.arrays is None or len(self.arrays['keys']) != len(self.dynamic_objects):
+            n = len(self.dynamic_objects)
+            self.arrays = {"keys"         : np.zeros(n, np.int64),
+                           "type"         : np.zeros(n, np.uint8),
+                           "controlled"   : np.zeros(n, np.bool_),
+                           "background"   : np.zeros(n, np.bool_),
+                           "position"     : np.zeros((n, 2), np.float64),
+                           "angle"        : np.zeros(n, np.float64),
+                           "vel"          : np.zeros(n, np.float64),
+                           "next_waypoint": np.zeros((n, 2), np.float64),
+                           "phase"        : np.zeros(n, np.uint8)}
+            self.array_views = {}
+            for name, arr in iteritems(self.arrays):
+                self.array_views[name] = arr.view()
+                self.array_views[name].flags.writeable = False
+        self.update_arrays()
+        return self.array_views
+
+    def get_array_rows(self):
+        """
+        Returns dict of (key -> row) for the arrays returned by get_arrays
+        """
+        return {k: i for i, k in enumerate(self.dynamic_objects)}
+
+    def update_arrays(self):
+        """
+        Refreshes the arrays returned by get_arrays, if they were requested
+        """
+        if self.arrays is None:
+            return
+        if len(self.arrays['keys']) != len(self.dynamic_objects):
+            # Objects were added, so views handed out before cannot hold them
+            self.get_arrays()
+            return
+        keys = list(self.dynamic_objects)
+        objs = [self.objects[k] for k in keys]
+        moving = [type(obj) in [Car, Pedestrian] for obj in objs]
+        arrays = self.arrays
+        arrays['keys'][:]          = keys
+        arrays['type'][:]          = [DYNAMIC_TYPES.index(type(obj)) for obj in objs]
+        arrays['controlled'][:]    = [k in self.controlled_cars for k in keys]
+        arrays['background'][:]    = [k in self.background_cars for k in keys]
+        arrays['position'][:]      = [(obj.x, obj.y) for obj in objs]
+        arrays['angle'][:]         = [obj.angle for obj in objs]
+        arrays['vel'][:]           = [obj.vel if m else 0 for obj, m in zip(objs, moving)]
+        arrays['next_waypoint'][:] = [(obj.waypoints[0].x, obj.waypoints[0].y) if m and len(obj.waypoints)
+                                      else (np.nan, np.nan) for obj, m in zip(objs, moving)]
+        arrays['phase'][:]         = [0 if m else type(obj).phase_colors.index(obj.color)
+                                      for obj, m in zip(objs, moving)]
+
+    def get_record_dtype(self, extra_fields=[]):
+        """
+        Returns the dtype of one row of a state record. Waypoint lists are padded with -1.
+        """
+        depth = max([obj.planning_depth for k, obj in iteritems(self.dynamic_objects)
+                     if type(obj) in [Car, Pedestrian]] + [1])
+        return np.dtype([('key',        np.int64),
+                         ('type',       np.uint8),
+                         ('controlled', np.bool_),
+                         ('x',          np.float64),
+                         ('y',          np.float64),
+                         ('angle',      np.float64),
+                         ('vel',        np.float64),
+                         ('points',     np.float64, (RECORD_POINTS, 2)),
+                         ('waypoints',  np.int32, (depth,)),
+                         ('phase',      np.uint8),
+                         ('timer',      np.int32),
+                         ('control',    np.float64, (2,))] + extra_fields)
+
+    def get_record(self, out=None, keys=None):
+        """
+        Captures the pose, velocity, planned waypoints, light phase and last control of every dynamic object
+
+        Parameters
+        ----------
+        out: np.array
+            If specified, the record is written into this array
+        keys: list of keys
+            If specified, only these objects are recorded, in this order
+
+        Returns
+        -------
+        np.array
+            One row of get_record_dtype() per recorded object, in key order unless keys is given
+        """
+        keys = list(self.dynamic_objects) if keys is None else list(keys)
+        record = np.zeros(len(keys), self.get_record_dtype()) if out is None else out
+        objs = [self.objects[k] for k in keys]
+        depth = record.dtype['waypoints'].shape[0]
+        # Fill whole columns at once, which is much faster than writing field by field
+        record['key']        = keys
+        record['type']       = [DYNAMIC_TYPES.index(type(obj)) for obj in objs]
+        record['controlled'] = [k in self.controlled_cars for k in keys]
+        record['x']          = [obj.x for obj in objs]
+        record['y']          = [obj.y for obj in objs]
+        record['angle']      = [obj.angle for obj in objs]
+        record['points']     = [obj.points[:RECORD_POINTS] if len(obj.points) >= RECORD_POINTS else
+                                np.concatenate([obj.points] + [obj.points[:1]] * (RECORD_POINTS - len(obj.points)))
+                                for obj in objs]
+        moving = [type(obj) in [Car, Pedestrian] for obj in objs]
+        record['vel']        = [obj.vel if m else 0 for obj, m in zip(objs, moving)]
+        record['waypoints']  = [[wp.index for wp in obj.waypoints[:depth]] + [-1] * (depth - len(obj.waypoints[:depth]))
+                                if m else [-1] * depth for obj, m in zip(objs, moving)]
+        record['phase']      = [0 if m else type(obj).phase_colors.index(obj.color) for obj, m in zip(objs, moving)]
+        record['timer']      = [0 if m else obj.timer for obj, m in zip(objs, moving)]
+        record['control']    = [obj.last_control if type(obj) == Car else (0, 0) for obj in objs]
+        return record
+
+    def set_record(self, record):
+        """
+        Applies a record made by get_record. Cars and pedestrians that are not in the state are created
+        with the keys from the record, and lights that are not found by key are matched in layout order.
+
+        Parameters
+        ----------
+        record: np.array
+            Record made by get_record
+        """
+        light_index = {TrafficLight: 0, CrossWalkLight: 0}
+        for row in record:
+            k = int(row['key'])
+            typ = DYNAMIC_TYPES[row['type']]
+            if typ in light_index:
+                obj = self.type_map[typ].get(k)
+                if obj is None:
+                    obj = list(self.type_map[typ].values())[light_index[typ]]
+                light_index[typ] += 1
+                obj.color = typ.phase_colors[row['phase']]
+                obj.timer = int(row['timer'])
+                continue
+
+            obj = self.objects.get(k)
+            if obj is None:
+                obj = typ(state=self, x=row['x'], y=row['y'], angle=row['angle'], vis_level=self.vis_level)
+                self.objects[k] = obj
+                self.type_map[typ][k] = obj
+                self.dynamic_objects[k] = obj
+                if typ == Car:
+                    if row['controlled']:
+                        obj.color = (0x0b,0x04,0xf4)
+                        self.controlled_cars[k] = obj
+                    else:
+                        self.background_cars[k] = obj
+            fluids_assert(type(obj) == typ, "Key {} is not a {} in this state".format(k, typ.__name__))
+            obj.set_pose(float(row['x']), float(row['y']), float(row['angle']), row['points'])
+            obj.vel = float(row['vel'])
+            obj.set_waypoints([self.waypoint_map[i] for i in row['waypoints'] if i >= 0])
+            if typ == Car:
+                obj.last_control = tuple(row['control'])
+        self.frozen_time = None
+        self.revision += 1
+        self.update_arrays()
+
+    def rekey(self, keys):
+        """
+        Renames the dynamic objects, matched by position, to keys. Extra keys are ignored.
+
+        Parameters
+        ----------
+        keys: list of int
+            New keys, in the order of dynamic_objects
+        """
+        old_keys = list(self.dynamic_objects)
+        fluids_assert(len(keys) >= len(old_keys), "Not enough keys to rename dynamic objects")
+        mapping = dict(zip(old_keys, [int(k) for k in keys]))
+        for k in mapping.values():
+            fluids_assert(k not in self.static_objects, "Key {} belongs to a static object".format(k))
+        objs = {mapping[k]: self.objects.pop(k) for k in old_keys}
+        self.objects.update(objs)
+        self.dynamic_objects = {k: objs[k] for k in mapping.values()}
+        for typ in DYNAMIC_TYPES:
+            self.type_map[typ] = {mapping[k]: obj for k, obj in iteritems(self.type_map[typ])}
+        self.controlled_cars = {mapping[k]: obj for k, obj in iteritems(self.controlled_cars)}
+        self.background_cars = {mapping[k]: obj for k, obj in iteritems(self.background_cars)}
+        self.frozen_time = None
+        self.revision += 1
+        self.update_arrays()
+
+    def snapshot(self):
+        """
+        Captures the mutable dynamic state: poses, velocities, planned waypoints, controller errors,
+        light timers, time and the random streams. All static data is shared, so snapshots are small
+        and cheap to take.
+        To branch a simulation, use FluidSim.snapshot, which also captures the planned actions.
+
+        Returns
+        -------
+        dict
+            "objects" is a record of get_snapshot_dtype() rows. "shapes" holds references to the
+            current geometry, which lets restore skip rebuilding it. Only "shapes" ties the snapshot
+            to this State; without it, restore rebuilds geometry from the record.
+        """
+        objects = np.zeros(len(self.dynamic_objects), self.get_snapshot_dtype())
+        self.get_record(out=objects)
+        self.get_controllers(objects)
+
+        shapes = []
+        for k in self.dynamic_objects:
+            obj = self.objects[k]
+            shapes.append((obj, obj.shapely_obj, obj.points, (obj.minx, obj.maxx, obj.miny, obj.maxy),
+                           list(obj.waypoints), list(getattr(obj, "trajectory", [])),
+                           getattr(obj, "last_action", None)))
+        return {"time"   : self.time,
+                "objects": objects,
+                "rng"    : {name: rng.bit_generator.state for name, rng in
+                            [("spawn", self.spawn_rng), ("cars", self.car_rng), ("peds", self.ped_rng)]},
+                "shapes" : shapes}
+
+    def get_controllers(self, objects):
+        """
+        Fills the controller fields of get_snapshot_dtype() rows whose other fields were filled by get_record
+        """
+        cars = objects['type'] == DYNAMIC_TYPES.index(Car)
+        car_objs = [self.objects[k] for k in objects['key'][cars]]
+        if car_objs:
+            objects['pid'][cars] = [[[c.PID_acc.prev_error,   c.PID_acc.integral_error],
+                                     [c.PID_steer.prev_error, c.PID_steer.integral_error]] for c in car_objs]
+            objects['stopped_time'][cars]  = [c.stopped_time  for c in car_objs]
+            objects['running_time'][cars]  = [c.running_time  for c in car_objs]
+            objects['last_distance'][cars] = [c.last_distance for c in car_objs]
+            objects['last_to_goal'][cars]  = [c.last_to_goal  for c in car_objs]
+
+    def set_controllers(self, objects):
+        """
+        Applies the controller fields of get_snapshot_dtype() rows to the cars they describe
+        """
+        cars = objects[objects['type'] == DYNAMIC_TYPES.index(Car)]
+        for k, pid, stopped_time, running_time, last_distance, last_to_goal in \
+            zip(cars['key'].tolist(), cars['pid'].tolist(), cars['stopped_time'].tolist(),
+                cars['running_time'].tolist(), cars['last_distance'].tolist(), cars['last_to_goal'].tolist()):
+            car = self.objects[k]
+            (car.PID_acc.prev_error,   car.PID_acc.integral_error), \
+            (car.PID_steer.prev_error, car.PID_steer.integral_error) = pid
+            car.stopped_time   = stopped_time
+            car.running_time   = running_time
+            car.last_distance  = last_distance
+            car.last_to_goal   = last_to_goal
+            car.last_blob_time = -1
+
+    def get_snapshot_dtype(self):
+        """
+        Returns the dtype of one row of a snapshot, which extends get_record_dtype with
+        the controller state of cars
+        """
+        return self.get_record_dtype([('pid',           np.float64, (2, 2)),
+                                      ('stopped_time',  np.int32),
+                                      ('running_time',  np.int32),
+                                      ('last_distance', np.float64),
+                                      ('last_to_goal',  np.float64)])
+
+    def restore(self, snap):
+        """
+        Returns the state to a snapshot made by snapshot. The dynamic objects are updated in place.
+
+        Parameters
+        ----------
+        snap: dict
+            Snapshot made by snapshot
+        """
+        objects = snap["objects"]
+        shapes = snap.get("shapes")
+        if shapes is None:
+            self.set_record(objects)
+        else:
+            columns = [objects[name].tolist() for name in ['x', 'y', 'angle', 'vel', 'phase', 'timer', 'control']]
+            for (obj, shapely_obj, points, bounds, waypoints, trajectory, last_action), \
+                x, y, angle, vel, phase, timer, control in zip(shapes, *columns):
+                obj.x, obj.y, obj.angle = x, y, angle
+                obj.shapely_obj = shapely_obj
+                obj.points = points
+                obj.minx, obj.maxx, obj.miny, obj.maxy = bounds
+                typ = type(obj)
+                if typ in [Car, Pedestrian]:
+                    obj.vel = vel
+                    obj.waypoints = list(waypoints)
+                    obj.trajectory = list(trajectory)
+                else:
+                    obj.color = typ.phase_colors[phase]
+                    obj.timer = timer
+                if typ == Car:
+                    obj.last_control = tuple(control)
+                    obj.last_action = last_action
+
+        self.set_controllers(objects)
+        self.spawn_rng.bit_generator.state = snap["rng"]["spawn"]
+        self.car_rng.bit_generator.state   = snap["rng"]["cars"]
+        self.ped_rng.bit_generator.state   = snap["rng"]["peds"]
+        self.time = snap["time"]
+        self.frozen_time = None
+        self.revision += 1
+        self.update_arrays()
+
     def is_in_collision(self, obj):
         collideables = obj.collideables
         for ctype in collideables:
@@ -380,7 +828,8 @@ class State(object):
 
     def update_vis_level(self, new_vis_level):
         self.vis_level = new_vis_level
-        for k, obj in iteritems(self.objects):
+        # Static objects do not read their vis_level, and may be shared with other States
+        for k, obj in iteritems(self.dynamic_objects):
             obj.vis_level = new_vis_level
 
 
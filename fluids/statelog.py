@@ -0,0 +1,222 @@
+import json
+import os
+import multiprocessing
+import numpy as np
+
+from fluids.assets import Car
+from fluids.consts import OBS_GRID
+from fluids.datasaver import NpyAppender
+from fluids.state import State, DYNAMIC_TYPES, reserve_ids
+from fluids.utils import *
+
+
+class StateLogger():
+    """
+    Records a compact log of the dynamic state of a FLUIDS simulation. Every tick stores the pose,
+    velocity, planned waypoints, light phase and applied control of each dynamic object, which is
+    a few hundred bytes per object instead of a rendered observation.
+
+    The log is written to [filename].npy, with the parameters needed to rebuild the State in
+    [filename].json. Use StateLog to read it back, and replay to regenerate observations from it.
+    """
+    def __init__(self, fluid_sim, file_path, batch_size=100, make_dir=True):
+        """
+            Log the state of a FLUIDS simulation.
+
+            fluid_sim (required): FluidSim whose state is logged
+            file_path (required): Filename with path to write the log to
+            batch_size: Number of ticks to buffer before writing. Default is 100.
+            make_dir: Boolean. Flags if directory specified should be created or not.
+        """
+        self.fluid_sim  = fluid_sim
+        self.file       = file_path
+        self.batch_size = batch_size
+        if make_dir:
+            dir = os.path.dirname(self.file)
+            os.makedirs(dir, exist_ok=True)
+
+        self.dtype    = None
+        self.chunk    = None
+        self.n_rows   = 0
+        self.appender = None
+
+    def start(self):
+        state = self.fluid_sim.state
+        record_dtype = state.get_record_dtype()
+        self.dtype = np.dtype([('time', np.int32),
+                               ('objects', record_dtype, (len(state.dynamic_objects),))])
+        self.chunk = np.zeros(self.batch_size, dtype=self.dtype)
+        self.appender = NpyAppender("{}.npy".format(self.file), self.dtype)
+        with open("{}.json".format(self.file), "w") as f:
+            json.dump({"layout"            : state.layout_name,
+                       "waypoint_width"    : state.waypoint_width,
+                       "use_traffic_lights": state.use_traffic_lights,
+                       "use_ped_lights"    : state.use_ped_lights}, f)
+
+    def record(self):
+        """
+        Appends the current state to the log
+        """
+        if self.dtype is None: self.start()
+        row = self.chunk[self.n_rows]
+        row['time'] = self.fluid_sim.state.time
+        self.fluid_sim.state.get_record(out=row['objects'])
+        self.n_rows += 1
+        if self.n_rows == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.n_rows:
+            self.appender.append(self.chunk[:self.n_rows])
+            self.n_rows = 0
+
+    def close(self):
+        if self.appender is not None:
+            self.flush()
+            self.appender.close()
+            self.appender = None
+
+
+class StateLog():
+    """
+    Reads a log written by StateLogger
+    """
+    def __init__(self, file_path):
+        with open("{}.json".format(file_path)) as f:
+            self.meta = json.load(f)
+        self.file  = file_path
+        self.ticks = np.load("{}.npy".format(file_path), mmap_mode="r")
+        self.times = self.ticks['time']
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def get_keys(self, controlled=None):
+        """
+        Returns the keys of the logged cars
+
+        Parameters
+        ----------
+        controlled: bool
+            If specified, only controlled (True) or background (False) cars are returned
+        """
+        objects = self.ticks[0]['objects']
+        is_car = objects['type'] == DYNAMIC_TYPES.index(Car)
+        if controlled is not None:
+            is_car &= objects['controlled'] == controlled
+        return [int(k) for k in objects['key'][is_car]]
+
+    def build_state(self, vis_level=0):
+        """
+        Returns a State with the logged layout and no cars or pedestrians. Use apply to
+        populate it with a logged tick.
+        """
+        # Keep the keys of new static objects clear of the logged keys
+        reserve_ids(int(self.ticks[0]['objects']['key'].max()) if len(self) else 0)
+        return State(layout             =self.meta["layout"],
+                     waypoint_width     =self.meta["waypoint_width"],
+                     use_traffic_lights =self.meta["use_traffic_lights"],
+                     use_ped_lights     =self.meta["use_ped_lights"],
+                     vis_level          =vis_level)
+
+    def apply(self, state, tick):
+        """
+        Sets state to the logged tick. tick is an index into the log, not a simulation time.
+        """
+        state.set_record(self.ticks[tick]['objects'])
+        state.time = int(self.times[tick])
+
+
+replay_log   = None
+replay_state = None
+
+def init_replay_worker(file_path):
+    global replay_log, replay_state
+    replay_log = StateLog(file_path)
+    replay_state = replay_log.build_state()
+
+def replay_ticks(job):
+    ticks, keys, obs_space, obs_args, array_kwargs = job
+    arrays = []
+    for tick in ticks:
+        replay_log.apply(replay_state, tick)
+        arrays.append([replay_state.objects[k].make_observation(obs_space, **obs_args)
+                       .get_array(**array_kwargs) for k in keys])
+    return np.array(arrays)
+
+def replay(file_path, obs_space=OBS_GRID, obs_args={}, array_kwargs={}, keys=None, ticks=None, processes=None):
+    """
+    Regenerates observations from a state log
+
+    Parameters
+    ----------
+    file_path: str
+        The file_path the log was written with
+    obs_space: str
+        Observation type to generate
+    obs_args: dict
+        Observation arguments, such as the resolution of grid observations
+    array_kwargs: dict
+        Arguments for FluidsObs.get_array, such as dtype
+    keys: list of int
+        Keys of the cars to generate observations for. Defaults to all logged cars
+    ticks: list of int
+        Indices of the logged ticks to regenerate. Defaults to all ticks
+    processes: int
+        Number of worker processes. Defaults to the number of CPUs. If 1, the work is done in this process
+
+    Returns
+    -------
+    np.array
+        Observations of shape (len(ticks), len(keys), ...)
+    """
+    log = StateLog(file_path)
+    keys = log.get_keys() if keys is None else list(keys)
+    ticks = np.arange(len(log)) if ticks is None else np.asarray(ticks)
+    processes = processes or multiprocessing.cpu_count()
+    # Each worker gets a few contiguous ranges, so it can move through the log in order
+    jobs = [(t, keys, obs_space, obs_args, array_kwargs)
+            for t in np.array_split(ticks, min(len(ticks), processes * 4) or 1) if len(t)]
+
+    if processes == 1:
+        init_replay_worker(file_path)
+        results = [replay_ticks(job) for job in jobs]
+    else:
+        with multiprocessing.Pool(processes, initializer=init_replay_worker,
+                                  initargs=(file_path,)) as pool:
+            results = pool.map(replay_ticks, jobs)
+    return np.concatenate(results)
+
+
+if __name__ == "__main__":
+    import argparse
+    from fluids.consts import OBS_BIRDSEYE, OBS_QLIDAR
+
+    parser = argparse.ArgumentParser(description='Regenerate observations from a FLUIDS state log')
+    parser.add_argument('log', metavar='file', type=str,
+                        help='Path of the state log, without extension')
+    parser.add_argument('out', metavar='file', type=str,
+                        help='Path of the .npy file to write observations to')
+    parser.add_argument('-o', metavar='str', type=str, default="grid",
+                        choices=["birdseye", "grid", "qlidar"],
+                        help='Observation type')
+    parser.add_argument('--obs-args', metavar='json', dest='obs_args', type=json.loads, default={},
+                        help='Observation arguments as a JSON object, e.g. \'{"obs_dim": 300, "shape": [40, 40]}\'')
+    parser.add_argument('--dtype', metavar='str', type=str, default=None,
+                        help='Data type of the written observations')
+    parser.add_argument('-j', metavar='N', dest='processes', type=int, default=None,
+                        help='Number of worker processes, default is one per CPU')
+    args = parser.parse_args()
+
+    obs = {"birdseye" :OBS_BIRDSEYE,
+           "grid"     :OBS_GRID,
+           "qlidar"   :OBS_QLIDAR}[args.o]
+    if "shape" in args.obs_args:
+        args.obs_args["shape"] = tuple(args.obs_args["shape"])
+    log = StateLog(args.log)
+    keys = log.get_keys()
+    fluids_print("Regenerating {} observations for {} cars over {} ticks".format(args.o, len(keys), len(log)))
+    arrays = replay(args.log, obs, args.obs_args, {"dtype": args.dtype} if args.dtype else {},
+                    keys=keys, processes=args.processes)
+    np.save(args.out, arrays)
+    fluids_print("Saved observations of shape {} to {}".format(arrays.shape, args.out))
@@ -1,4 +1,7 @@
 from fluids.utils.utils import *
 from fluids.utils.debug import *
 from fluids.utils.rewards import path_reward
-from fluids.utils.pid import PIDController
+from fluids.utils.pid import PIDController, pid_controls
+from fluids.utils.geometry import pack_points, to_ego, draw_polygons, PolygonStore
+from fluids.utils.profiler import Profiler, NullProfiler, NULL_PROFILER
+from fluids.utils.workers import WorkerPool, run_worker
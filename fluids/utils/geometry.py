@@ -0,0 +1,115 @@
+import numpy as np
+import pygame
+
+from fluids.utils.utils import rotation_array
+
+
+def pack_points(objs):
+    """
+    Concatenates the vertices of objs into one buffer
+
+    Returns
+    -------
+    points: np.array of shape (N, 2)
+    offsets: np.array of shape (len(objs) + 1,)
+        Vertices of objs[i] are points[offsets[i]:offsets[i+1]]
+    """
+    offsets = np.zeros(len(objs) + 1, dtype=np.int64)
+    if not len(objs):
+        return np.empty((0, 2)), offsets
+    np.cumsum([len(obj.points) for obj in objs], out=offsets[1:])
+    return np.concatenate([obj.points for obj in objs]), offsets
+
+
+def to_ego(points, pose, scale=(1, 1), offset=(0, 0)):
+    """
+    Transforms world points into the frame of pose with a single affine multiply
+
+    Parameters
+    ----------
+    points: np.array of shape (N, 2)
+    pose: tuple
+        (x, y, angle) of the frame origin
+    scale: tuple
+        Per axis scale applied after rotation
+    offset: tuple
+        Translation applied after scaling
+    """
+    x, y, angle = pose
+    transform = rotation_array(-angle) * np.array(scale)
+    return (points - np.array([x, y])).dot(transform) + np.array(offset)
+
+
+def draw_polygons(surfaces, colors, points, offsets):
+    """
+    Fills polygon i of a packed buffer on surfaces[i] with colors[i]
+    """
+    for i in range(len(offsets) - 1):
+        pygame.draw.polygon(surfaces[i], colors[i], points[offsets[i]:offsets[i + 1]])
+
+
+class PolygonStore(object):
+    """
+    Packs the polygons of many objects into contiguous arrays.
+    The points of every stored object are replaced by a view into the store,
+    so bulk geometry code can work on the arrays without touching the objects.
+
+    Parameters
+    ----------
+    objects: dict of (key -> Shape)
+        Objects to store
+    types: list of types
+        Object types, indexed by the type codes
+
+    Attributes
+    ----------
+    points: np.array of shape (N, 2), float32
+        Vertices of all objects
+    offsets: np.array of shape (M + 1,)
+        Vertices of object i are points[offsets[i]:offsets[i+1]]
+    keys: np.array of shape (M,)
+        Key of every object
+    type_codes: np.array of shape (M,)
+        Index into types of every object
+    angles: np.array of shape (M,), float32
+        Heading of every object, which is the lane direction for lanes
+    bounds: np.array of shape (M, 4)
+        Bounding box (minx, miny, maxx, maxy) of every object, kept in full
+        precision so that queries match the shapely bounds exactly
+    """
+    def __init__(self, objects, types):
+        objs            = list(objects.values())
+        self.types      = list(types)
+        self.keys       = np.array(list(objects.keys()), dtype=np.int64)
+        self.type_codes = np.array([self.types.index(type(obj)) for obj in objs],
+                                   dtype=np.int16)
+        self.angles     = np.array([obj.angle for obj in objs], dtype=np.float32)
+        self.bounds     = np.array([(obj.minx, obj.miny, obj.maxx, obj.maxy) for obj in objs],
+                                   dtype=np.float64).reshape(-1, 4)
+        points, self.offsets = pack_points(objs)
+        self.points     = points.astype(np.float32)
+        for i, obj in enumerate(objs):
+            obj.points = self.points[self.offsets[i]:self.offsets[i + 1]]
+
+    def query(self, bounds=None, typ=None):
+        """
+        Returns the keys of stored objects, in storage order
+
+        Parameters
+        ----------
+        bounds: tuple
+            If specified, only objects whose bounding box overlaps
+            (minx, miny, maxx, maxy) are returned
+        typ: type
+            If specified, only objects of this type are returned
+        """
+        mask = np.ones(len(self.keys), dtype=np.bool_)
+        if typ is not None:
+            if typ not in self.types:
+                return self.keys[:0]
+            mask &= self.type_codes == self.types.index(typ)
+        if bounds is not None:
+            minx, miny, maxx, maxy = bounds
+            mask &= (self.bounds[:, 0] <= maxx) & (self.bounds[:, 2] >= minx) \
+                & (self.bounds[:, 1] <= maxy) & (self.bounds[:, 3] >= miny)
+        return self.keys[mask]
@@ -1,3 +1,5 @@
+import numpy as np
+
 class PIDController:
     def __init__(self, P=1, I=0.0, D=0.0):
 
@@ -18,3 +20,34 @@ class PIDController:
         self.prev_error = err
 
         return self.Kp*err + self.Ki*self.integral_error + self.Kd*derivative_error
+
+
+def pid_controls(controllers, errors, update=True):
+    """
+    Vectorized PIDController.get_control over several controllers
+
+    Parameters
+    ----------
+    controllers: list of PIDController
+    errors: np.array
+        One error per controller
+    update: bool
+        Sets whether the integral errors are updated
+
+    Returns
+    -------
+    np.array
+        One control per controller
+    """
+    errors     = np.asarray(errors, dtype=np.float64)
+    prev       = np.array([c.prev_error for c in controllers], dtype=np.float64)
+    integral   = np.array([c.integral_error for c in controllers], dtype=np.float64)
+    if update:
+        integral = integral + errors
+    controls = np.array([c.Kp for c in controllers]) * errors \
+               + np.array([c.Ki for c in controllers]) * integral \
+               + np.array([c.Kd for c in controllers]) * (errors - prev)
+    for c, e, i in zip(controllers, errors.tolist(), integral.tolist()):
+        c.prev_error = e
+        c.integral_error = i
+    return controls
@@ -0,0 +1,134 @@
+import json
+import time
+from collections import deque
+
+
+class NullProfiler(object):
+    """
+    Profiler that records nothing. start and stop do no work, so instrumented
+    code only pays for two method calls per stage while profiling is off.
+    """
+    enabled = False
+
+    def start(self):
+        return 0
+
+    def stop(self, name, start):
+        pass
+
+    def end_tick(self, tick):
+        pass
+
+    def get_profile(self):
+        return {}
+
+    def get_trace(self):
+        return []
+
+    def close(self, tick=None):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Profiler(NullProfiler):
+    """
+    Accumulates the wall time and call count of named stages of a simulation.
+    Sub-stages are named after their stage with a "/", as in "plan/solve", and
+    their time is included in the time of the stage.
+
+    Times are also kept per tick. A tick's record holds the work done since the
+    previous tick was ended, which FluidSim does when the next step starts, so
+    the observations of a tick are in its record. The last ticks are kept for
+    get_trace, and every record can be appended to a JSON lines file for plotting.
+
+    Parameters
+    ----------
+    trace_path: str
+        If set, one JSON line of {"tick": t, "stages": {name: seconds}} is appended
+        to this file per tick
+    trace_window: int
+        Number of recent ticks kept for get_trace. Default is 1000
+    """
+    enabled = True
+
+    def __init__(self, trace_path=None, trace_window=1000):
+        self.totals     = {}
+        self.counts     = {}
+        self.tick_times = {}
+        self.ticks      = 0
+        self.trace      = deque(maxlen=trace_window)
+        self.trace_file = open(trace_path, "a") if trace_path else None
+
+    def start(self):
+        """
+        Returns the start time to pass to stop
+        """
+        return time.perf_counter()
+
+    def stop(self, name, start):
+        """
+        Adds the time since start to stage name
+        """
+        elapsed = time.perf_counter() - start
+        self.totals[name]     = self.totals.get(name, 0.0) + elapsed
+        self.counts[name]     = self.counts.get(name, 0) + 1
+        self.tick_times[name] = self.tick_times.get(name, 0.0) + elapsed
+
+    def end_tick(self, tick):
+        """
+        Closes the record of tick, if any work was timed since the previous one
+        """
+        if not self.tick_times:
+            return
+        record = {"tick": tick, "stages": self.tick_times}
+        self.trace.append(record)
+        if self.trace_file:
+            self.trace_file.write(json.dumps(record) + "\n")
+        self.tick_times = {}
+        self.ticks += 1
+
+    def get_profile(self):
+        """
+        Returns
+        -------
+        dict of (str -> dict)
+            Per stage, in name order: total seconds, number of calls, mean milliseconds
+            per call, and mean milliseconds per tick
+        """
+        ticks = max(self.ticks + bool(self.tick_times), 1)
+        return {name: {"total"      : self.totals[name],
+                       "calls"      : self.counts[name],
+                       "mean_ms"    : 1000 * self.totals[name] / self.counts[name],
+                       "per_tick_ms": 1000 * self.totals[name] / ticks}
+                for name in sorted(self.totals)}
+
+    def get_trace(self):
+        """
+        Returns
+        -------
+        list of dict
+            Records of the last trace_window ticks, oldest first
+        """
+        return list(self.trace)
+
+    def reset(self):
+        """
+        Clears the accumulated times. The trace file is kept open
+        """
+        self.totals     = {}
+        self.counts     = {}
+        self.tick_times = {}
+        self.ticks      = 0
+        self.trace.clear()
+
+    def close(self, tick=None):
+        """
+        Ends the pending tick, labelled tick, and closes the trace file
+        """
+        if tick is not None:
+            self.end_tick(tick)
+        if self.trace_file:
+            self.trace_file.close()
+            self.trace_file = None
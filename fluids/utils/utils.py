@@ -24,5 +24,50 @@ def get_cache_filename(fname):
     fname = os.path.join(cache_folder, fname)
     return fname
 
+def make_seed_sequence(seed):
+    """
+    Returns seed as a np.random.SeedSequence
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
 def distance(p0, p1):
     return np.linalg.norm([p0[0] - p1[0], p0[1] - p1[1]])
+
+def get_memory_usage(pid=None):
+    """
+    Returns the memory use of a process in bytes, read from /proc on Linux
+
+    Parameters
+    ----------
+    pid: int
+        Process to measure. Defaults to this process
+
+    Returns
+    -------
+    dict of (str -> int)
+        rss: resident memory, including pages shared with other processes
+        pss: resident memory, with every shared page split between the processes sharing it
+        private: resident memory that is not shared with other processes
+        peak_rss: highest rss of the process
+        Values that cannot be read on this platform are None
+    """
+    proc = "/proc/{}/".format("self" if pid is None else pid)
+    usage = {"rss": None, "pss": None, "private": None, "peak_rss": None}
+    fields = {"Rss:"          : "rss",
+              "Pss:"          : "pss",
+              "Private_Clean:": "private",
+              "Private_Dirty:": "private",
+              "VmHWM:"        : "peak_rss"}
+    for fname in ["smaps_rollup", "status"]:
+        try:
+            with open(proc + fname) as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 3 and parts[0] in fields and parts[2] == "kB":
+                        name = fields[parts[0]]
+                        usage[name] = (usage[name] or 0) + int(parts[1]) * 1024
+        except (IOError, OSError):
+            pass
+    return usage
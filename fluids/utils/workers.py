@@ -0,0 +1,132 @@
+import multiprocessing
+import traceback
+from multiprocessing import shared_memory, resource_tracker
+
+from fluids.utils.debug import fluids_assert
+
+
+def run_worker(target, pipe, parent_pipe, *args):
+    """
+    Main function of a process started by WorkerPool.start_worker. Calls target(pipe, buffers, *args),
+    which receives commands on pipe until it is told to close, and appends the shared memory it
+    attaches to buffers. Errors are sent to the pool as ("error", traceback).
+    """
+    if parent_pipe is not None:
+        parent_pipe.close()
+    buffers = []
+    try:
+        target(pipe, buffers, *args)
+    except (KeyboardInterrupt, EOFError):
+        pass
+    except BaseException:
+        pipe.send(("error", traceback.format_exc()))
+    finally:
+        for b in buffers:
+            try:
+                b.close()
+            except BufferError:
+                # A failed target can leave views alive, the buffer is then released at exit
+                pass
+        pipe.close()
+
+
+class WorkerPool():
+    """
+    Worker processes that take commands on pipes and exchange data through shared memory buffers.
+    Every command is answered with ("ok", data) or ("error", traceback). Closing the pool stops
+    the workers and frees the buffers, and a failed worker closes it before the failure is reported.
+
+    Subclasses drop their arrays into the buffers in release_views, which close calls before freeing them.
+
+    Parameters
+    ----------
+    start_method: str
+        multiprocessing start method of the workers. Defaults to the platform default
+    """
+    worker_name = "Worker"
+
+    def __init__(self, start_method=None):
+        # Nothing needs cleaning up if the pool fails to start
+        self.closed    = True
+        self.ctx       = multiprocessing.get_context(start_method)
+        self.pipes     = []
+        self.processes = []
+        self.buffers   = []
+        self.closed    = False
+        # Workers share the tracker of this process, which is then the only one to clean up the buffers
+        resource_tracker.ensure_running()
+
+    def start_worker(self, target, *args):
+        """
+        Starts a worker process that runs target(pipe, buffers, *args), see run_worker
+        """
+        parent_pipe, child_pipe = self.ctx.Pipe()
+        process = self.ctx.Process(target=run_worker, args=(target, child_pipe, parent_pipe) + args,
+                                   daemon=True)
+        process.start()
+        child_pipe.close()
+        self.pipes.append(parent_pipe)
+        self.processes.append(process)
+
+    def create_buffer(self, size):
+        """
+        Returns a new shared memory buffer of at least one byte, freed when the pool is closed
+        """
+        buffer = shared_memory.SharedMemory(create=True, size=max(1, size))
+        self.buffers.append(buffer)
+        return buffer
+
+    def send_command(self, i, cmd, data=None):
+        self.pipes[i].send((cmd, data))
+
+    def recv_reply(self, i):
+        try:
+            status, data = self.pipes[i].recv()
+        except EOFError:
+            status, data = "error", "Worker exited"
+        if status == "error":
+            self.close()
+            fluids_assert(False, "{} {} failed:\n{}".format(self.worker_name, i, data))
+        return data
+
+    def call_all(self, cmd, data=None):
+        for i in range(len(self.pipes)):
+            self.send_command(i, cmd, data)
+        return [self.recv_reply(i) for i in range(len(self.pipes))]
+
+    def release_views(self):
+        """
+        Drops the arrays that point into the buffers, which must be gone before the buffers can be closed
+        """
+        pass
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for pipe in self.pipes:
+            try:
+                pipe.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for pipe in self.pipes:
+            pipe.close()
+        self.release_views()
+        for b in self.buffers:
+            try:
+                b.close()
+            except BufferError:
+                # Arrays returned to the caller still point into the buffer
+                pass
+            b.unlink()
+        self.buffers = []
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,408 @@
+import gc
+import time
+from multiprocessing.connection import wait
+from multiprocessing import shared_memory
+import numpy as np
+
+from fluids.sim import FluidSim
+from fluids.state import State, StaticWorld
+from fluids.actions import *
+from fluids.consts import *
+from fluids.utils import *
+
+
+ACTION_WIDTHS = {SteeringAccAction : 2,
+                 SteeringVelAction : 2,
+                 VelocityAction    : 1,
+                 SteeringAction    : 1}
+
+# Arguments of fluids.State that describe its StaticWorld
+WORLD_ARGS = ["layout", "waypoint_width", "use_traffic_lights", "use_ped_lights"]
+
+
+class VecEnv():
+    """
+    One simulation run by a vector env worker. Tracks the episode and
+    restarts it with a fresh State when it is done. States are built on
+    world if it is given.
+    """
+    def __init__(self, seed_sequence, state_args, sim_args, obs_space, obs_args, obs_dtype,
+                 horizon, done_on_collision, action_type, world=None):
+        self.seed_sequence     = seed_sequence
+        self.state_args        = state_args
+        self.world             = world
+        self.obs_dtype         = obs_dtype
+        self.horizon           = horizon
+        self.done_on_collision = done_on_collision
+        self.action_type       = action_type
+        self.sim = FluidSim(visualization_level=0,
+                            fps=0,
+                            obs_space=obs_space,
+                            obs_args=obs_args,
+                            **sim_args)
+        self.keys    = []
+        self.stepped = True
+        self.obs     = None
+
+    def reset(self):
+        """
+        Starts a new episode, unless the current one has not been stepped yet
+        """
+        if self.stepped:
+            state = State(vis_level=0, seed=self.seed_sequence.spawn(1)[0], world=self.world,
+                          **self.state_args)
+            self.sim.set_state(state)
+            self.keys = sorted(state.controlled_cars)
+            self.stepped = False
+
+    def step(self, actions):
+        """
+        Returns
+        -------
+        tuple of (float, bool)
+            Reward of the step, and if the episode is done. A done episode is
+            reset before the observations are written.
+        """
+        reward = self.sim.step_array(self.keys, actions, self.action_type)
+        self.stepped = True
+        state = self.sim.state
+        done = self.horizon is not None and state.time >= self.horizon
+        if self.done_on_collision and not done:
+            done = any(state.is_in_collision(state.objects[k]) for k in self.keys)
+        if done:
+            self.reset()
+        return reward, done
+
+    def get_obs_layout(self):
+        """
+        Returns the shape and dtype string of the observation arrays. Without obs_dtype,
+        the dtype is the observation's natural type.
+        """
+        obs = self.sim.get_observation(self.keys[0])
+        arr = np.asarray(obs.get_array() if self.obs_dtype is None else obs.get_array(dtype=self.obs_dtype))
+        return arr.shape, arr.dtype.str
+
+    def write_obs(self, out):
+        for i, k in enumerate(self.keys):
+            self.sim.get_observation(k).get_array(out=out[i])
+
+
+def vec_worker(pipe, buffers, index, args):
+    """
+    Main loop of a vector env worker, see fluids.utils.run_worker. Commands arrive on pipe, while
+    actions, observations, rewards and dones are exchanged through shared memory.
+    """
+    env = VecEnv(**args)
+    env.reset()
+    fluids_assert(len(env.keys), "Vector envs need at least one controlled car")
+    pipe.send(("ok", (len(env.keys),) + env.get_obs_layout()))
+    while True:
+        cmd, data = pipe.recv()
+        reply = None
+        if cmd == "attach":
+            buffers += [shared_memory.SharedMemory(name=name) for name in data["names"]]
+            obs, actions, rewards, dones = [np.ndarray(shape, dtype, buffer=b.buf)
+                                            for b, (shape, dtype)
+                                            in zip(buffers, data["layouts"])]
+            env.write_obs(obs[index])
+        elif cmd == "reset":
+            env.reset()
+            env.write_obs(obs[index])
+        elif cmd == "step":
+            start = time.perf_counter()
+            rewards[index], dones[index] = env.step(actions[index])
+            env.write_obs(obs[index])
+            reply = time.perf_counter() - start
+        elif cmd == "close":
+            break
+        pipe.send(("ok", reply))
+
+
+class VecFluidSim(WorkerPool):
+    """
+    Runs several independent FLUIDS simulations in worker processes. step advances all of them
+    in lockstep, while send and recv step any subset of them and collect whichever finish first.
+    Actions, observations, rewards and dones are exchanged through shared memory, so a step
+    only sends a short command to each worker.
+
+    Every simulation has the same number of controlled cars. An episode is done when it reaches
+    the horizon or, if done_on_collision is set, when a controlled car collides. The worker then
+    starts a new episode with a fresh State, whose keys are not exposed: cars are addressed by
+    their row, in key order.
+
+    With share_world and forked workers, the static world of the layout is built once by this
+    process before the workers start. The workers then share its memory, and their States only
+    create lights, cars and pedestrians, which also makes new episodes faster to start.
+
+    Parameters
+    ----------
+    n_envs: int
+        Number of simulations to run, one per worker process
+    state_args: dict
+        Arguments of fluids.State for every episode, such as controlled_cars and background_cars.
+        controlled_cars defaults to 1
+    sim_args: dict
+        Other arguments of fluids.FluidSim, such as background_control
+    obs_space: str
+        Observation type of the controlled cars. OBS_NONE is not supported
+    obs_args: dict
+        Observation arguments
+    obs_dtype: np.dtype
+        Data type of the observation arrays. Defaults to the observation's natural type
+    action_type: fluids.Action
+        Type of the actions, see FluidSim.step_array
+    horizon: int
+        If set, episodes are done after this many steps
+    done_on_collision: bool
+        Sets whether episodes are done when a controlled car collides. Default is True
+    seed: int or np.random.SeedSequence
+        Each worker seeds its episodes from a child of this seed
+    start_method: str
+        multiprocessing start method of the workers. Defaults to the platform default
+    share_world: bool
+        Sets whether the workers share one static world. Only used when the workers are forked,
+        otherwise every worker builds its own. Default is True
+    """
+    worker_name = "Vector env worker"
+
+    def __init__(self,
+                 n_envs,
+                 state_args        ={},
+                 sim_args          ={},
+                 obs_space         =OBS_GRID,
+                 obs_args          ={},
+                 obs_dtype         =None,
+                 action_type       =SteeringAccAction,
+                 horizon           =None,
+                 done_on_collision =True,
+                 seed              =None,
+                 start_method      =None,
+                 share_world       =True):
+        WorkerPool.__init__(self, start_method)
+        fluids_assert(obs_space != OBS_NONE, "VecFluidSim needs an observation type")
+        fluids_assert(action_type in ACTION_WIDTHS, "Illegal action type")
+        state_args = dict({"controlled_cars": 1}, **state_args)
+
+        self.n_envs         = n_envs
+        self.action_width   = ACTION_WIDTHS[action_type]
+        self.pending        = np.zeros(n_envs, np.bool_)
+        self.sent_times     = np.zeros(n_envs)
+        self.step_counts    = np.zeros(n_envs, np.int64)
+        self.step_times     = np.zeros(n_envs)
+        self.max_step_times = np.zeros(n_envs)
+        self.latencies      = np.zeros(n_envs)
+        self.max_latencies  = np.zeros(n_envs)
+
+        self.world = None
+        if share_world and self.ctx.get_start_method() == "fork":
+            self.world = StaticWorld(vis_level=0, **{k: state_args[k] for k in WORLD_ARGS if k in state_args})
+            # Keeps the collectors of the workers from writing to the pages the world lives on
+            gc.freeze()
+        seeds = make_seed_sequence(seed).spawn(n_envs)
+        for i in range(n_envs):
+            args = {"seed_sequence"    : seeds[i],
+                    "state_args"       : state_args,
+                    "sim_args"         : sim_args,
+                    "obs_space"        : obs_space,
+                    "obs_args"         : obs_args,
+                    "obs_dtype"        : obs_dtype,
+                    "horizon"          : horizon,
+                    "done_on_collision": done_on_collision,
+                    "action_type"      : action_type,
+                    "world"            : self.world}
+            self.start_worker(vec_worker, i, args)
+        if self.world is not None:
+            gc.unfreeze()
+
+        # The observation layout is only known once the workers have built their simulations
+        infos = [self.recv_reply(i) for i in range(n_envs)]
+        fluids_assert(len(set(infos)) == 1, "Vector envs disagree on observation layouts: {}".format(infos))
+        self.n_cars, obs_shape, obs_dtype = infos[0]
+        self.obs_shape = (n_envs, self.n_cars) + obs_shape
+        obs_dtype = np.dtype(obs_dtype)
+
+        layouts = [(self.obs_shape, obs_dtype),
+                   ((n_envs, self.n_cars, self.action_width), np.float64),
+                   ((n_envs,), np.float64),
+                   ((n_envs,), np.bool_)]
+        for shape, dtype in layouts:
+            self.create_buffer(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        self.obs, self.actions, self.rewards, self.dones = [np.ndarray(shape, dtype, buffer=b.buf)
+                                                            for b, (shape, dtype) in zip(self.buffers, layouts)]
+        self.call_all("attach", {"names": [b.name for b in self.buffers], "layouts": layouts})
+
+    def reset(self, env_ids=None):
+        """
+        Starts new episodes in every simulation that has been stepped
+
+        Parameters
+        ----------
+        env_ids: list of int
+            Simulations to reset. Defaults to all. None of them may be stepping
+
+        Returns
+        -------
+        np.array
+            Observations of shape (n_envs, n_cars, ...). This is a view of shared memory
+            that is overwritten by the next step or reset.
+        """
+        env_ids = np.arange(self.n_envs) if env_ids is None else np.asarray(env_ids, np.int64).reshape(-1)
+        fluids_assert(not self.pending[env_ids].any(), "reset called while envs are stepping")
+        for i in env_ids:
+            self.send_command(i, "reset")
+        for i in env_ids:
+            self.recv_reply(i)
+        return self.obs
+
+    def step(self, actions):
+        """
+        Simulates one frame of every simulation
+
+        Parameters
+        ----------
+        actions: np.array
+            Array of shape (n_envs, n_cars, width) or (n_envs, n_cars), see FluidSim.step_array
+
+        Returns
+        -------
+        tuple of (np.array, np.array, np.array)
+            Observations of shape (n_envs, n_cars, ...), which is a view of shared memory that is
+            overwritten by the next step, and copies of the rewards and dones of shape (n_envs,).
+            The observations of done simulations are the first of their next episode.
+        """
+        self.send(actions)
+        self.wait_ready(self.n_envs)
+        return self.obs, self.rewards.copy(), self.dones.copy()
+
+    def send(self, actions, env_ids=None):
+        """
+        Starts simulating one frame of some simulations, without waiting for them
+
+        Parameters
+        ----------
+        actions: np.array
+            Array of shape (len(env_ids), n_cars, width) or (len(env_ids), n_cars)
+        env_ids: list of int
+            Simulations to step. Defaults to all. None of them may still be stepping
+        """
+        env_ids = np.arange(self.n_envs) if env_ids is None else np.asarray(env_ids, np.int64).reshape(-1)
+        fluids_assert(not self.pending[env_ids].any(),
+                      "Vector envs {} are still stepping".format(env_ids[self.pending[env_ids]].tolist()))
+        self.actions[env_ids] = np.reshape(actions, (len(env_ids),) + self.actions.shape[1:])
+        for i in env_ids:
+            self.send_command(i, "step")
+        self.sent_times[env_ids] = time.perf_counter()
+        self.pending[env_ids] = True
+
+    def recv(self, min_envs=1, timeout=None):
+        """
+        Collects the simulations that have finished the frames started by send
+
+        Parameters
+        ----------
+        min_envs: int
+            Waits until at least this many simulations are done, or all pending ones if fewer
+        timeout: float
+            If set, returns after this many seconds even if fewer than min_envs are done
+
+        Returns
+        -------
+        tuple of (np.array, np.array, np.array, np.array)
+            Ids of the collected simulations, in the order they were collected, and copies
+            of their observations, rewards and dones
+        """
+        fluids_assert(self.pending.any(), "recv called without envs stepping")
+        env_ids = np.array(self.wait_ready(min_envs, timeout), dtype=np.int64)
+        return env_ids, self.obs[env_ids], self.rewards[env_ids], self.dones[env_ids]
+
+    def wait_ready(self, min_envs, timeout=None):
+        """
+        Returns the ids of pending simulations that finished their step, and updates their latency stats
+        """
+        pipes = {self.pipes[i]: i for i in np.flatnonzero(self.pending)}
+        min_envs = min(min_envs, len(pipes))
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        ready = []
+        while len(ready) < min_envs:
+            remaining = None if deadline is None else max(0, deadline - time.perf_counter())
+            conns = wait(list(pipes), remaining)
+            if not conns:
+                break
+            now = time.perf_counter()
+            for conn in conns:
+                i = pipes.pop(conn)
+                step_time = self.recv_reply(i)
+                latency = now - self.sent_times[i]
+                self.pending[i] = False
+                self.step_counts[i]    += 1
+                self.step_times[i]     += step_time
+                self.max_step_times[i]  = max(self.max_step_times[i], step_time)
+                self.latencies[i]      += latency
+                self.max_latencies[i]   = max(self.max_latencies[i], latency)
+                ready.append(i)
+        return ready
+
+    def get_latency_stats(self):
+        """
+        Returns
+        -------
+        dict of (str -> np.array)
+            Per simulation statistics, indexed by env id. steps is the number of collected steps.
+            mean_step_time and max_step_time are the seconds a worker spent simulating a frame and
+            writing its observations. mean_latency and max_latency are the seconds from send until
+            the step was collected, which includes waiting for recv to be called.
+        """
+        steps = np.maximum(self.step_counts, 1)
+        return {"steps"         : self.step_counts.copy(),
+                "mean_step_time": self.step_times / steps,
+                "max_step_time" : self.max_step_times.copy(),
+                "mean_latency"  : self.latencies / steps,
+                "max_latency"   : self.max_latencies.copy()}
+
+    def get_memory_stats(self):
+        """
+        Returns
+        -------
+        dict of (str -> np.array)
+            Per simulation memory use of the worker process in bytes, indexed by env id, see
+            fluids.utils.get_memory_usage. Statistics that cannot be read on this platform are NaN.
+        """
+        usage = [get_memory_usage(process.pid) for process in self.processes]
+        return {name: np.array([np.nan if u[name] is None else u[name] for u in usage])
+                for name in ["rss", "pss", "private", "peak_rss"]}
+
+    def release_views(self):
+        self.obs = self.actions = self.rewards = self.dones = None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Measure the memory of FLUIDS vector env workers, with and without a shared static world')
+    parser.add_argument('-j', metavar='N', dest='n_envs', type=int, default=4,
+                        help='Number of worker processes')
+    parser.add_argument('-b', metavar='N', type=int, default=10,
+                        help='Number of background cars')
+    parser.add_argument('-p', metavar='N', type=int, default=5,
+                        help='Number of background pedestrians')
+    parser.add_argument('--time', metavar='N', type=int, default=50,
+                        help='Number of steps to simulate before measuring')
+    parser.add_argument('--state', metavar='file', type=str, default="fluids_state_big_city",
+                        help='Layout file for state generation')
+    parser.add_argument('--seed', metavar='N', type=int, default=0,
+                        help='Seed of the simulations')
+    args = parser.parse_args()
+
+    state_args = {"layout": args.state, "background_cars": args.b, "background_peds": args.p}
+    for share_world in [False, True]:
+        start = time.time()
+        vec = VecFluidSim(args.n_envs, state_args, obs_space=OBS_GRID,
+                          horizon=args.time // 2, seed=args.seed, start_method="fork", share_world=share_world)
+        build_time = time.time() - start
+        actions = np.zeros(vec.actions.shape)
+        for i in range(args.time):
+            vec.step(actions)
+        stats = {name: np.mean(value) / 2**20 for name, value in vec.get_memory_stats().items()}
+        vec.close()
+        fluids_print("share_world={}: {:.1f} s to start, per worker {:.0f} MB rss, {:.0f} MB pss, {:.0f} MB private".format(
+            share_world, build_time, stats["rss"], stats["pss"], stats["private"]))
@@ -0,0 +1,21 @@
+import fluids
+
+
+def make_sim(obs_space=fluids.OBS_GRID, obs_args={}, state_args={}, background_control=fluids.BACKGROUND_CSP, **sim_args):
+    """
+    Returns a FluidSim without visualization on a new city State, and the keys of its controlled cars.
+    The State has one controlled car and five background cars and pedestrians unless state_args says otherwise.
+    """
+    simulator = fluids.FluidSim(visualization_level=0,
+                                fps=0,
+                                obs_space=obs_space,
+                                obs_args=obs_args,
+                                background_control=background_control,
+                                **sim_args)
+    state = fluids.State(**dict({"layout"         : fluids.STATE_CITY,
+                                 "background_cars": 5,
+                                 "background_peds": 5,
+                                 "controlled_cars": 1,
+                                 "vis_level"      : 0}, **state_args))
+    simulator.set_state(state)
+    return simulator, list(simulator.get_control_keys())
@@ -0,0 +1,78 @@
+import fluids
+from fluids.datasaver import get_npz_shards
+import numpy as np
+import os
+import shutil
+import tempfile
+
+data_dir = tempfile.mkdtemp()
+checkpoint = os.path.join(data_dir, "checkpoint.npz")
+
+def make_sim(seed, format):
+    simulator = fluids.FluidSim(visualization_level=0,
+                                fps=0,
+                                background_control=fluids.BACKGROUND_CSP)
+    state = fluids.State(
+        layout=fluids.STATE_CITY,
+        background_cars=4,
+        background_peds=2,
+        controlled_cars=1,
+        seed=seed,
+        )
+    simulator.set_state(state)
+    data_saver = fluids.DataSaver(fluid_sim=simulator, file_path=os.path.join(data_dir, format, "run"),
+                                  batch_size=4, format=format)
+    simulator.set_data_saver(data_saver)
+    return simulator, state, data_saver
+
+def read(format):
+    file_path = os.path.join(data_dir, format, "run")
+    if format == "npy":
+        return np.load(file_path + ".npy")
+    if format == "npz":
+        shards = get_npz_shards(file_path)
+        assert(shards == list(range(len(shards))))
+        return np.concatenate([np.load("{}_{}.npz".format(file_path, n))["arr_0"] for n in shards])
+    reader = fluids.ColumnReader(file_path)
+    return {name: np.array(reader[name]) for name in reader.fields}
+
+for format in ["npz", "npy", "columns"]:
+    simulator, state, data_saver = make_sim(1, format)
+    for i in range(6):
+        simulator.step({})
+    simulator.save_checkpoint(checkpoint)
+    for i in range(7):
+        simulator.step({})
+    data_saver.close()
+    expected_data = read(format)
+    expected_record = state.get_record()
+
+    # A fresh state, spawned differently and with different keys, picks up where the checkpoint was made
+    simulator, state, data_saver = make_sim(2, format)
+    simulator.load_checkpoint(checkpoint)
+    for i in range(7):
+        simulator.step({})
+    data_saver.close()
+    data = read(format)
+    for name in expected_data.dtype.names if format != "columns" else expected_data:
+        assert((data[name] == expected_data[name]).all())
+    assert((state.get_record() == expected_record).all())
+
+    # Loading into the saver that recorded past the checkpoint drops everything recorded since,
+    # whether the checkpoint was made before any recording, before the first write, or after it
+    for n_steps in [0, 2, 6]:
+        simulator, state, data_saver = make_sim(1, format)
+        for i in range(n_steps):
+            simulator.step({})
+        simulator.save_checkpoint(checkpoint)
+        for i in range(5):
+            simulator.step({})
+        simulator.load_checkpoint(checkpoint)
+        for i in range(7):
+            simulator.step({})
+        data_saver.close()
+        times = read(format)["time"]
+        assert(len(times) == len(data_saver.get_keys()) * (n_steps + 7))
+        assert(len(np.unique(times)) == n_steps + 7 and (np.diff(times) >= 0).all())
+
+shutil.rmtree(data_dir)
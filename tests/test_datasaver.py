@@ -0,0 +1,102 @@
+import fluids
+import gc
+import numpy as np
+import os
+import shutil
+import tempfile
+import weakref
+
+data_dir = tempfile.mkdtemp()
+
+simulator = fluids.FluidSim(visualization_level=0,
+                            fps=0,
+                            background_control=fluids.BACKGROUND_CSP)
+
+state = fluids.State(
+    layout=fluids.STATE_CITY,
+    background_cars=4,
+    background_peds=2,
+    controlled_cars=1,
+    )
+
+simulator.set_state(state)
+n_cars = len(state.background_cars)
+
+for format, background in [("npz", True), ("npy", True), ("columns", True), ("npz", False), ("npy", False)]:
+    file_path = os.path.join(data_dir, format + str(background), "run")
+    data_saver = fluids.DataSaver(fluid_sim=simulator, file_path=file_path, batch_size=3, format=format,
+                                  background=background, max_pending=1)
+    simulator.set_data_saver(data_saver)
+    start = simulator.run_time()
+    for i in range(7):
+        simulator.step({})
+    data_saver.close()
+    assert(data_saver.writer is None)
+
+    if format == "npz":
+        data = np.concatenate([np.load("{}_{}.npz".format(file_path, i))["arr_0"] for i in range(3)])
+    elif format == "npy":
+        data = np.load(file_path + ".npy", mmap_mode="r")
+    else:
+        data = reader = fluids.ColumnReader(file_path)
+        for k in state.background_cars:
+            car = reader.get_car(k, ["key", "time", "obs_grid"])
+            assert((car["key"] == k).all())
+            assert((car["time"] == np.arange(start + 1, start + 8)).all())
+            assert(np.shares_memory(car["obs_grid"], reader["obs_grid"]))
+        window = reader.get_window(start + 2, start + 4)
+        assert((window["time"] == np.repeat([start + 2, start + 3], n_cars)).all())
+        assert(np.shares_memory(window["obs_grid"], reader["obs_grid"]))
+        assert(len(reader.get_window(start + 10, start + 20)["time"]) == 0)
+        rows = reader.get_rows([0, 5, 2], ["steeringacc"])
+        assert((rows["steeringacc"] == reader["steeringacc"][[0, 5, 2]]).all())
+    assert(len(data) == 7 * n_cars)
+    assert((data["time"] == np.repeat(np.arange(start + 1, start + 8), n_cars)).all())
+    assert(data["obs_grid"].shape[1:] == (40, 40, 11))
+    assert(data["obs_grid"].dtype == np.uint8)
+    for k in state.background_cars:
+        assert((data["key"] == k).sum() == 7)
+
+    batches = list(fluids.BatchReader(file_path, batch_size=4, fields=["time", "key"], shard_size=5))
+    assert([len(b["time"]) for b in batches] == [4] * (7 * n_cars // 4) + [7 * n_cars % 4] * bool(7 * n_cars % 4))
+    assert(set(batches[0]) == {"time", "key"})
+    assert((np.concatenate([b["time"] for b in batches]) == data["time"]).all())
+    shuffled = list(fluids.BatchReader(file_path, batch_size=4, fields=["time", "key"], shuffle_buffer=8, seed=0))
+    rows = sorted(zip(np.concatenate([b["time"] for b in shuffled]), np.concatenate([b["key"] for b in shuffled])))
+    assert(rows == sorted(zip(data["time"], data["key"])))
+    # Seeds work as everywhere else in fluids, as ints or SeedSequences
+    reseeded = list(fluids.BatchReader(file_path, batch_size=4, fields=["time", "key"], shuffle_buffer=8,
+                                       seed=np.random.SeedSequence(0)))
+    assert(len(reseeded) == len(shuffled))
+    assert(all((a["key"] == b["key"]).all() for a, b in zip(shuffled, reseeded)))
+
+# The columns format rejects runs whose keys change, since cars are found by stride
+file_path = os.path.join(data_dir, "changing", "run")
+data_saver = fluids.DataSaver(fluid_sim=simulator, file_path=file_path, keys=list(state.background_cars),
+                              batch_size=3, format="columns")
+simulator.set_data_saver(data_saver)
+simulator.step({})
+data_saver.keys = data_saver.keys[::-1]
+try:
+    simulator.step({})
+    assert(False)
+except SystemExit:
+    pass
+data_saver.keys = data_saver.keys[::-1]
+data_saver.close()
+assert(len(fluids.ColumnReader(file_path)) == n_cars)
+
+# A saver that is dropped without close is collected, and its writer thread stops
+data_saver = fluids.DataSaver(fluid_sim=simulator, file_path=os.path.join(data_dir, "dropped", "run"), batch_size=1)
+simulator.set_data_saver(data_saver)
+simulator.step({})
+data_saver.flush()
+writer, saver_ref = data_saver.writer, weakref.ref(data_saver)
+simulator.set_data_saver(None)
+data_saver = None
+gc.collect()
+assert(saver_ref() is None)
+writer.join(timeout=10)
+assert(not writer.is_alive())
+
+shutil.rmtree(data_dir)
@@ -0,0 +1,58 @@
+import fluids
+import numpy as np
+import os
+import tempfile
+from helpers import make_sim
+
+simulator, car_keys = make_sim(obs_args={"obs_dim":200, "shape":(50, 50)}, obs_stack=3)
+
+# Stacked observations hold the last obs_stack frames, oldest first
+frames = []
+for i in range(5):
+    simulator.step({})
+    frames.append({k:o.get_array() for k, o in simulator.get_observations(car_keys).items()})
+    stacks = simulator.get_stacked_observations(car_keys)
+    for k in car_keys:
+        assert(stacks[k].shape == (3, 50, 50, 11))
+        expected = [frames[max(0, j)][k] for j in range(i - 2, i + 1)]
+        assert((stacks[k] == np.array(expected)).all())
+
+# Stacks restart, filled with their first frame, whenever the frames before would not belong to them
+def assert_restarted(stacks, keys):
+    current = {k: o.get_array() for k, o in simulator.get_observations(keys).items()}
+    for k in keys:
+        assert((stacks[k] == np.array([current[k]] * 3)).all())
+
+# At the start of an episode
+state = fluids.State(layout=fluids.STATE_CITY, background_cars=5, background_peds=5, controlled_cars=1, vis_level=0)
+simulator.set_state(state)
+car_keys = list(simulator.get_control_keys())
+assert_restarted(simulator.get_stacked_observations(car_keys), car_keys)
+simulator.step({})
+stacks = simulator.get_stacked_observations(car_keys)
+assert(not (stacks[car_keys[0]][0] == stacks[car_keys[0]][2]).all())
+
+# When a car is respawned at the same key
+for k in car_keys:
+    respawned = state.objects[k].freeze()
+    for objects in [state.objects, state.dynamic_objects, state.type_map[fluids.assets.Car], state.controlled_cars]:
+        objects[k] = respawned
+simulator.step({})
+assert_restarted(simulator.get_stacked_observations(car_keys), car_keys)
+
+# When cars are renamed
+simulator.step({})
+simulator.get_stacked_observations(car_keys)
+state.rekey([k + 1000 for k in state.dynamic_objects])
+car_keys = list(simulator.get_control_keys())
+assert_restarted(simulator.get_stacked_observations(car_keys), car_keys)
+
+# When a checkpoint is loaded
+path = os.path.join(tempfile.mkdtemp(), "checkpoint")
+simulator.save_checkpoint(path)
+for i in range(2):
+    simulator.step({})
+    simulator.get_stacked_observations(car_keys)
+simulator.load_checkpoint(path)
+assert(simulator.frame_stacks == {})
+assert_restarted(simulator.get_stacked_observations(car_keys), car_keys)
@@ -0,0 +1,93 @@
+import fluids
+from fluids.assets import Car, Lane, Terrain
+from fluids.utils import pack_points, to_ego, rotation_array
+import numpy as np
+import pygame
+
+simulator = fluids.FluidSim(visualization_level=0, fps=0, obs_space=fluids.OBS_GRID,
+                            obs_args={"obs_dim": 200, "shape": (50, 50)},
+                            background_control=fluids.BACKGROUND_CSP)
+state = fluids.State(layout=fluids.STATE_CITY, background_cars=5, background_peds=5,
+                     controlled_cars=1, vis_level=0)
+simulator.set_state(state)
+car_keys = list(simulator.get_control_keys())
+
+# Packed vertices are the vertices of every object, in order
+objs = list(state.type_map[Terrain].values())[:5] + list(state.type_map[Lane].values())[:5] \
+    + list(state.type_map[Car].values())
+points, offsets = pack_points(objs)
+assert(offsets[0] == 0 and offsets[-1] == len(points))
+for i, obj in enumerate(objs):
+    assert((points[offsets[i]:offsets[i + 1]] == obj.points).all())
+empty_points, empty_offsets = pack_points([])
+assert(empty_points.shape == (0, 2) and (empty_offsets == [0]).all())
+
+# to_ego moves packed vertices as get_relative moves each shape
+car = state.objects[car_keys[0]]
+for pose, offset in [((0, 0, 0), (0, 0)),
+                     ((car.x, car.y, car.angle), (0, 0)),
+                     ((car.x, car.y, car.angle), (100, 50)),
+                     ((250.5, -30, 2.5), (0, 0)),
+                     ((-10, 400, -np.pi / 3), (-20, 7))]:
+    ego = to_ego(points, pose, offset=offset)
+    for i, obj in enumerate(objs):
+        # The ring repeats its first vertex, and static vertices are stored as float32
+        relative = obj.get_relative(pose, offset=offset).points[:-1]
+        assert(np.allclose(ego[offsets[i]:offsets[i + 1]], relative, atol=1e-2))
+
+# The grid trajectory channel matches drawing each waypoint through get_relative
+def per_shape_trajectory(obs):
+    w, h = obs.pygame_rep[8].get_size()
+    gd = obs.grid_dim
+    scale = (w / float(gd), h / float(gd))
+    a0 = obs.car.angle + np.pi / 2
+    a1 = obs.car.angle
+    x, y, angle = (obs.car.x+gd/2*np.cos(a0)-gd/6*np.cos(a1),
+                   obs.car.y-gd/2*np.sin(a0)+gd/6*np.sin(a1),
+                   obs.car.angle)
+    window = pygame.Surface((w, h))
+    point = (int(gd/6*scale[0]), int(gd/2*scale[1]))
+    line_width = max(1, int(round(20 * min(scale))))
+    for p in obs.car.waypoints:
+        relp = (np.array(p.shapely_obj.exterior.coords) - np.array([x, y])).dot(rotation_array(-angle)) \
+            * np.array(scale)
+        xs, ys = zip(*relp)
+        new_point = int(sum(xs) / len(xs)), int(sum(ys) / len(ys))
+        pygame.draw.line(window, (255, 255, 255), point, new_point, line_width)
+        point = new_point
+    return pygame.surfarray.array2d(pygame.transform.rotate(window, 90))
+
+for obs_args in [{"obs_dim": 200, "shape": (50, 50)}, {"obs_dim": 200, "shape": (200, 200)}]:
+    simulator.obs_args = obs_args
+    for i in range(10):
+        simulator.step({})
+        for obs in simulator.get_observations(car_keys).values():
+            obs.evaluate()
+            assert(len(obs.car.waypoints))
+            assert((pygame.surfarray.array2d(obs.pygame_rep[8]) == per_shape_trajectory(obs)).all())
+
+# Stored objects are culled on exactly their shapely bounding boxes
+store = state.static_geometry
+def overlaps(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+# Boxes of stored objects themselves are touched exactly by their neighbours
+rng = np.random.RandomState(0)
+boxes = [obj.shapely_obj.bounds for obj in list(state.static_objects.values())[:20]] \
+    + [(x, y, x + w, y + h) for x, y, w, h in rng.uniform(-100, 1000, (30, 4)) * [1, 1, 0.3, 0.3]]
+for box in boxes:
+    expected = {k for k, obj in state.static_objects.items() if overlaps(obj.shapely_obj.bounds, box)}
+    assert(set(store.query(box).tolist()) == expected)
+    for typ in [Terrain, Lane]:
+        assert(set(store.query(box, typ).tolist()) == {k for k in expected if type(state.objects[k]) == typ})
+assert(set(store.query().tolist()) == set(state.static_objects))
+
+# Culling does not change grid observations
+for obs_args in [{"obs_dim": 200, "shape": (50, 50)}, {"obs_dim": 500, "shape": (500, 500)}]:
+    for i in range(3):
+        simulator.step({})
+        for k in car_keys:
+            culled   = fluids.obs.GridObservation(state.objects[k], **obs_args)
+            unculled = fluids.obs.GridObservation(state.objects[k], **obs_args)
+            unculled.get_bounds = lambda shape: None
+            assert((culled.get_array() == unculled.get_array()).all())
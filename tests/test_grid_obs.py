@@ -39,3 +39,36 @@ actions = {}
 rew = simulator.step(actions)
 obs = simulator.get_observations(car_keys)
 simulator.render()
+
+# Integer ratios are a block mean
+from fluids.obs.grid import area_resize, area_weights
+rng = np.random.RandomState(0)
+grid = rng.uniform(size=(8, 6, 3))
+blocks = grid.reshape(4, 2, 3, 2, 3).mean(axis=(1, 3))
+assert(np.allclose(area_resize(grid, (4, 3)), blocks))
+mask = rng.uniform(size=(20, 20, 2)) > 0.5
+assert(np.allclose(area_resize(mask, (5, 5)), mask.reshape(5, 4, 5, 4, 2).mean(axis=(1, 3))))
+
+# Other ratios weight every input cell by the area each output cell covers
+for n_in, n_out in [(7, 3), (5, 2), (10, 4)]:
+    weights = area_weights(n_in, n_out)
+    assert(weights.shape == (n_out, n_in) and (weights >= 0).all())
+    assert(np.allclose(weights.sum(axis=1), 1))
+grid = rng.uniform(size=(7, 5, 2))
+small = area_resize(grid, (3, 2))
+assert(small.shape == (3, 2, 2))
+assert(np.allclose(small.mean(axis=(0, 1)), grid.mean(axis=(0, 1))))
+assert(np.allclose(area_resize(np.ones((7, 5, 1)), (3, 2)), 1))
+
+# Supersampled panes are scaled to grid_dim, so they fill their borders (only 8 panes are drawn)
+grid_obs = list(obs.values())[0]
+grid_obs.car.vis_level = 4
+size = grid_obs.grid_dim
+screen = pygame.Surface((2 * size, 4 * size))
+grid_obs.render(screen)
+for i, pane in enumerate(grid_obs.pygame_rep[:8]):
+    assert(pane.get_size() != (size, size))
+    x, y = size * (1 - i // 4), size * (i % 4)
+    drawn = pygame.surfarray.array3d(screen.subsurface(pygame.Rect(x, y, size, size)))
+    expected = pygame.surfarray.array3d(pygame.transform.scale(pane, (size, size)))
+    assert((drawn[5:-5, 5:-5] == expected[5:-5, 5:-5]).all())
@@ -0,0 +1,34 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+def run_headless(*extra):
+    out = subprocess.check_output([sys.executable, "-m", "fluids", "--headless", "--steps", "40",
+                                   "-b", "4", "-c", "2", "-p", "2", "-o", "none", "--report", "json"]
+                                  + list(extra))
+    # The report is the last line, after the log of building the state
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+report = run_headless("--seed", "1")
+assert(report["steps"] == 40 and report["seed"] == 1 and report["actions"] == "supervisor")
+assert(report["steps_per_second"] > 0 and report["elapsed"] > 0)
+assert(set(report["stages"]) == {"actions", "step", "observations", "collisions"})
+assert(sum(stage["total"] for stage in report["stages"].values()) <= report["elapsed"])
+assert(report["peak_rss_mb"] is None or report["peak_rss_mb"] > 0)
+assert(0 <= report["collisions"] <= report["collision_steps"])
+
+# The same seed runs the same simulation
+again = run_headless("--seed", "1")
+assert((again["collisions"], again["collision_steps"]) == (report["collisions"], report["collision_steps"]))
+
+report = run_headless("--seed", "1", "--actions", "constant")
+assert(report["actions"] == "constant")
+
+# The time of the stages inside FluidSim is reported, and traced per tick
+path = os.path.join(tempfile.mkdtemp(), "trace.jsonl")
+report = run_headless("--seed", "1", "--trace", path)
+assert(report["profile"]["step"]["calls"] == 40 and "plan/solve" in report["profile"])
+assert(len(open(path).readlines()) == 41)
+assert(run_headless("--seed", "1", "--no-profile")["profile"] == {})
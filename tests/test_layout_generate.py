@@ -0,0 +1,37 @@
+import fluids
+from fluids.assets import Car, Pedestrian, TrafficLight, CrossWalkLight
+from fluids.layouts.generate import generate_grid, write_layout
+import numpy as np
+import os
+import tempfile
+
+layout = generate_grid(3, 3)
+assert(layout["dimension_x"] == layout["dimension_y"] == 2000)
+
+path = os.path.join(tempfile.mkdtemp(), "grid.json")
+write_layout(generate_grid(2, 3), path)
+state = fluids.State(layout=path, background_cars=10, background_peds=5, vis_level=0, seed=0)
+assert(state.layout_name == path)
+# Every car and pedestrian waypoint leads somewhere
+assert(all(len(wp.nxt) for wp in state.waypoints + state.ped_waypoints))
+# The two middle intersections have three roads, so they get lights
+assert(len(state.type_map[TrafficLight]) == 6)
+assert(len(state.type_map[CrossWalkLight]) == 12)
+
+simulator = fluids.FluidSim(visualization_level=0,
+                            fps=0,
+                            background_control=fluids.BACKGROUND_CSP)
+simulator.set_state(state)
+start = state.get_record()
+for i in range(100):
+    simulator.step({})
+record = state.get_record()
+moved = np.hypot(record['x'] - start['x'], record['y'] - start['y'])
+assert((moved[record['type'] == 0] > 0).all())
+assert((moved[record['type'] == 1] > 0).all())
+
+# A layout written again to the same path is compiled again, not read from the cache
+write_layout(generate_grid(2, 2, lanes=2, traffic_lights=False), path)
+state = fluids.State(layout=path, vis_level=0)
+assert(len(state.type_map[TrafficLight]) == 0)
+assert(len(state.waypoints) != len(simulator.state.waypoints))
@@ -0,0 +1,39 @@
+import fluids
+import numpy as np
+from helpers import make_sim
+
+simulator, car_keys = make_sim(obs_args={"obs_dim":200, "shape":(200, 200)})
+state = simulator.state
+
+out = np.empty((200, 200, 11), dtype=np.uint8)
+for i in range(5):
+    simulator.step({})
+    obs = simulator.get_observations(car_keys)
+    for k, o in obs.items():
+        arr = o.get_array()
+        assert(arr.shape == (200, 200, 11))
+        assert(arr.dtype == np.float64)
+
+        assert(o.get_array(out=out) is out)
+        assert((out == arr * 255).all())
+
+        # Signed types are scaled to their own range instead of wrapping
+        signed = o.get_array(dtype=np.int8)
+        assert(signed.dtype == np.int8 and signed.min() >= 0)
+        assert((signed == arr * 127).all())
+        down = state.objects[k].make_observation(fluids.OBS_GRID, obs_dim=200, shape=(50, 50))
+        down_signed = down.get_array(dtype=np.int8)
+        assert(down_signed.min() >= 0 and (down_signed == np.rint(down.get_array() * 127)).all())
+
+        mask = o.get_array(dtype=np.bool_)
+        assert((mask == (arr > 0)).all())
+
+        packed = o.get_array(packed=True)
+        assert(packed.shape == (200, 200, 2))
+        assert((np.unpackbits(packed, axis=-1)[:,:,:11] == mask).all())
+
+        birdseye = state.objects[k].make_observation(fluids.OBS_BIRDSEYE, obs_dim=100)
+        rgb = birdseye.get_array()
+        rgb_out = np.zeros(rgb.shape, dtype=np.float32)
+        assert(birdseye.get_array(out=rgb_out) is rgb_out)
+        assert((rgb_out == rgb).all())
@@ -0,0 +1,19 @@
+import fluids
+from helpers import make_sim
+
+simulator, car_keys = make_sim(obs_args={"obs_dim":200, "shape":(50, 50)})
+simulator.step({})
+
+# Observations are memoized within a tick and recomputed once time advances
+misses = simulator.get_obs_cache_stats()["misses"]
+first = simulator.get_observations(car_keys)
+second = simulator.get_observations(car_keys)
+for k in car_keys:
+    assert(first[k] is second[k])
+    assert(simulator.get_observation(k, fluids.OBS_GRID, {"shape":(50, 50), "obs_dim":200}) is first[k])
+stats = simulator.get_obs_cache_stats()
+assert(stats["misses"] == misses + len(car_keys))
+simulator.step({})
+third = simulator.get_observations(car_keys)
+for k in car_keys:
+    assert(third[k] is not first[k])
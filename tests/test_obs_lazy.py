@@ -0,0 +1,24 @@
+import fluids
+from helpers import make_sim
+
+simulator, car_keys = make_sim()
+
+# Observations are rendered lazily from a snapshot of the tick they were made in
+for obs_space in [fluids.OBS_GRID, fluids.OBS_BIRDSEYE, fluids.OBS_QLIDAR]:
+    simulator.obs_space = obs_space
+    simulator.obs_args = {}
+    eager = {k:o.get_array() for k, o in simulator.get_observations(car_keys).items()}
+    lazy = simulator.get_observations(car_keys)
+    for i in range(3):
+        simulator.step({})
+    for k, o in lazy.items():
+        assert((o.get_array() == eager[k]).all())
+
+# Frozen cars do not keep earlier observations alive, which would chain every observation of an episode
+simulator.obs_space = fluids.OBS_GRID
+simulator.obs_args = {"obs_dim":200, "shape":(50, 50)}
+for i in range(2):
+    simulator.step({})
+    simulator.get_observations(car_keys)
+for k in car_keys:
+    assert(simulator.state.objects[k].last_obs.car.last_obs is None)
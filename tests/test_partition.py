@@ -0,0 +1,65 @@
+import fluids
+from fluids.assets import Car, Pedestrian
+from fluids.partition import PartitionedSim, RegionWorker, get_regions, get_region_bounds
+import numpy as np
+
+state_args = {"layout": fluids.STATE_CITY, "background_cars": 20, "background_peds": 5}
+
+# With one region, the traffic matches a FluidSim of the same State exactly
+partitioned = PartitionedSim(1, state_args, seed=4)
+stats = partitioned.step(20)
+record = partitioned.get_record()
+partitioned.close()
+
+simulator = fluids.FluidSim(visualization_level=0,
+                            fps=0,
+                            background_control=fluids.BACKGROUND_CSP)
+state = fluids.State(vis_level=0, seed=4, **state_args)
+simulator.set_state(state)
+collisions = 0
+for i in range(20):
+    simulator.step({})
+    collisions += sum(state.is_in_collision(car) for car in state.type_map[Car].values())
+assert(stats[0]["collisions"] == collisions)
+keys = [k for k, obj in state.dynamic_objects.items() if type(obj) in [Car, Pedestrian]]
+expected = state.get_record(keys=keys)
+for name in ['x', 'y', 'angle', 'vel', 'waypoints']:
+    assert((record[name] == expected[name]).all())
+
+# With several regions, every object is owned by the region it is in, and cars cross borders
+partitioned = PartitionedSim(2, state_args, seed=4)
+start = partitioned.get_record()
+stats = [partitioned.step(100) for i in range(3)]
+record = partitioned.get_record()
+partitioned.close()
+assert((record['key'] == start['key']).all())
+assert((record['owner'] == get_regions(partitioned.bounds, record['x'])).all())
+assert(set(record['owner']) == {0, 1})
+assert(sum(s["arrived"] for tick in stats for s in tick) > 0)
+assert(all(s["owned"] > 0 and s["ghosts"] > 0 for tick in stats for s in tick))
+assert(np.hypot(record['x'] - start['x'], record['y'] - start['y']).max() > 100)
+
+# A worker only counts collisions with copies it keeps up to date, not with the copies of
+# other regions' cars left where it last saw them
+def make_worker():
+    state = fluids.State(vis_level=0, seed=4, **state_args)
+    keys = [k for k, obj in state.dynamic_objects.items() if type(obj) in [Car, Pedestrian]]
+    records = np.zeros((2, len(keys)), state.get_snapshot_dtype().descr + [('owner', np.int16)])
+    state.get_record(out=records[0], keys=keys)
+    bounds = get_region_bounds(state, 2)
+    records[0]['owner'] = get_regions(bounds, records[0]['x'])
+    records[1] = records[0]
+    worker = RegionWorker(0, bounds, state_args, 4, 0, list(state.dynamic_objects), records)
+    worker.start()
+    return worker
+
+worker, stale = make_worker(), make_worker()
+cars = [i for i, k in enumerate(stale.keys) if k in stale.state.type_map[Car]]
+owned = [i for i in cars if stale.owned[i]]
+other = [i for i in cars if not stale.owned[i]][0]
+row = stale.records[0][[other]].copy()
+for name in ['x', 'y', 'angle', 'points']:
+    row[name] = stale.records[0][owned[0]][name]
+stale.state.set_record(row)
+assert(stale.state.is_in_collision(stale.state.objects[stale.keys[owned[0]]]))
+assert(stale.step() == worker.step())
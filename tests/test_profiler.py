@@ -0,0 +1,57 @@
+import fluids
+from fluids.utils import Profiler
+import json
+import numpy as np
+import os
+import tempfile
+
+def run(profiler, steps=6):
+    sim = fluids.FluidSim(visualization_level=0, fps=0, obs_space=fluids.OBS_GRID,
+                          obs_args={"obs_dim": 300, "shape": (40, 40)},
+                          background_control=fluids.BACKGROUND_CSP)
+    sim.set_profiler(profiler)
+    state = fluids.State(vis_level=0, controlled_cars=1, background_cars=3, background_peds=2, seed=6)
+    sim.set_state(state)
+    keys = list(sim.get_control_keys())
+    for i in range(steps):
+        sim.step(sim.get_supervisor_actions(fluids.SteeringAccAction, keys=keys))
+        sim.get_observations(keys)[keys[0]].get_array()
+    sim.step_array(keys, np.zeros((1, 2)))
+    return sim
+
+# Without a profiler nothing is recorded
+sim = run(None)
+assert(sim.get_profile() == {})
+record = sim.state.get_record()
+
+path = os.path.join(tempfile.mkdtemp(), "trace.jsonl")
+profiler = Profiler(trace_path=path, trace_window=3)
+sim = run(profiler)
+# Profiling does not change the simulation
+for name in ['x', 'y', 'angle', 'vel', 'phase']:
+    assert((sim.state.get_record()[name] == record[name]).all())
+
+profile = sim.get_profile()
+for name in ["step", "step/actions", "step/objects", "step/reward", "step/plan", "step/save_data",
+             "plan", "plan/futures", "plan/pairs", "plan/solve", "observations", "observations/compute"]:
+    assert(name in profile)
+assert(profile["step"]["calls"] == 7 and profile["observations/compute"]["calls"] == 6)
+# The initial plan of set_state is counted as well
+assert(profile["plan"]["calls"] == 8)
+# Sub-stages are included in their stage
+for parent in ["step", "plan"]:
+    children = sum(stage["total"] for name, stage in profile.items() if name.startswith(parent + "/"))
+    assert(children <= profile[parent]["total"])
+    assert(profile[parent]["mean_ms"] > 0 and profile[parent]["per_tick_ms"] > 0)
+
+# One trace record per tick. Observations belong to the tick they were made on
+profiler.close(sim.state.time)
+trace = [json.loads(line) for line in open(path)]
+assert([record["tick"] for record in trace] == list(range(8)))
+assert("step" not in trace[0]["stages"] and "plan" in trace[0]["stages"])
+assert(all("observations/compute" in record["stages"] for record in trace[1:7]))
+assert(abs(sum(record["stages"]["step"] for record in trace[1:]) - profile["step"]["total"]) < 1e-9)
+assert(profiler.get_trace() == trace[-3:])
+
+profiler.reset()
+assert(sim.get_profile() == {} and profiler.get_trace() == [])
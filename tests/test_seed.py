@@ -0,0 +1,51 @@
+import fluids
+from fluids.assets import Pedestrian
+import numpy as np
+
+def run(state_seed, sim_seed=None, steps=15):
+    simulator = fluids.FluidSim(visualization_level=0,
+                                fps=0,
+                                background_control=fluids.BACKGROUND_CSP,
+                                seed=sim_seed)
+    state = fluids.State(
+        layout=fluids.STATE_CITY,
+        background_cars=5,
+        background_peds=3,
+        controlled_cars=1,
+        seed=state_seed,
+        )
+    simulator.set_state(state)
+    for i in range(steps):
+        # Global random state must not leak into the simulation
+        np.random.random()
+        simulator.step({})
+    record = state.get_record()
+    # Keys are global counters, so they differ between runs
+    return {name: record[name] for name in record.dtype.names if name != "key"}
+
+def same(a, b):
+    return all((a[name] == b[name]).all() for name in a)
+
+a = run(3)
+assert(same(a, run(3)))
+assert(not same(a, run(4)))
+
+# The simulator's seed takes over routing, but spawning still follows the state's seed
+b = run(3, sim_seed=7)
+assert(same(b, run(3, sim_seed=7)))
+assert(same(b, run(np.random.SeedSequence(3), sim_seed=np.random.SeedSequence(7))))
+
+# Children of one SeedSequence give independent streams
+children = np.random.SeedSequence(11).spawn(2)
+assert(not same(run(children[0]), run(children[1])))
+
+np.random.seed(5)
+c = run(None)
+np.random.seed(5)
+assert(same(c, run(None)))
+
+# Spawned pedestrians are stored under their own keys
+state = fluids.State(layout=fluids.STATE_CITY, background_cars=2, background_peds=3, seed=0)
+assert(len(state.type_map[Pedestrian]) == 3)
+for k, ped in state.type_map[Pedestrian].items():
+    assert(state.dynamic_objects[k] is ped)
@@ -0,0 +1,54 @@
+import fluids
+from fluids.server import SimClient, load_test
+from fluids.vec import VecEnv
+import json
+import numpy as np
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+obs_args = {"obs_dim": 300, "shape": [40, 40]}
+address = os.path.join(tempfile.mkdtemp(), "fluids.sock")
+server = subprocess.Popen([sys.executable, "-m", "fluids", "serve", address,
+                           "-n", "2", "-b", "2", "-c", "1", "-p", "1",
+                           "--obs-args", json.dumps(obs_args), "--dtype", "uint8",
+                           "--horizon", "3", "--seed", "3"])
+try:
+    start = time.time()
+    while not os.path.exists(address):
+        assert(server.poll() is None and time.time() - start < 300)
+        time.sleep(0.1)
+
+    client = SimClient(address)
+    assert(client.n_envs == 2 and client.n_cars == 1 and client.action_width == 2)
+    assert(client.obs_shape == (1, 40, 40, 11) and client.obs_dtype == np.uint8)
+
+    # The server runs the same episodes as a simulation in this process with the same seed
+    env = VecEnv(np.random.SeedSequence(3).spawn(2)[1],
+                 {"layout": fluids.STATE_CITY, "controlled_cars": 1, "background_cars": 2, "background_peds": 1},
+                 {"background_control": fluids.BACKGROUND_CSP},
+                 fluids.OBS_GRID, {"obs_dim": 300, "shape": (40, 40)}, np.uint8, 3, True, fluids.SteeringAccAction)
+    env.reset()
+    expected = np.zeros((1, 40, 40, 11), dtype=np.uint8)
+    env.write_obs(expected)
+    assert((client.reset(1) == expected).all())
+    assert((client.observe(1) == expected).all())
+    rng = np.random.RandomState(0)
+    for i in range(4):
+        actions = rng.uniform(-1, 1, (1, 2))
+        obs, reward, done = client.step(1, actions)
+        expected_reward, expected_done = env.step(actions)
+        env.write_obs(expected)
+        assert((obs == expected).all())
+        assert(reward == expected_reward and done == expected_done)
+    client.close()
+
+    stats = load_test(address, clients=2, steps=5, seed=0)
+    assert(stats["steps"] == 10)
+    assert(stats["steps_per_second"] > 0 and stats["p50_ms"] <= stats["p99_ms"] <= stats["max_ms"])
+finally:
+    server.terminate()
+    server.wait(timeout=60)
+assert(not os.path.exists(address))
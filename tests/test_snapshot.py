@@ -0,0 +1,51 @@
+import fluids
+import numpy as np
+
+simulator = fluids.FluidSim(visualization_level=0,
+                            fps=0,
+                            obs_space=fluids.OBS_GRID,
+                            obs_args={"obs_dim": 300, "shape": (40, 40)},
+                            obs_stack=3,
+                            background_control=fluids.BACKGROUND_CSP)
+
+state = fluids.State(
+    layout=fluids.STATE_CITY,
+    background_cars=5,
+    background_peds=3,
+    controlled_cars=1,
+    seed=0,
+    )
+
+simulator.set_state(state)
+key = list(state.background_cars)[0]
+car_keys = list(simulator.get_control_keys())
+obs_args = simulator.obs_args
+
+def rollout(steps):
+    records, observations, stacks = [], [], []
+    for i in range(steps):
+        simulator.step({})
+        records.append(state.get_record())
+        observations.append(simulator.get_observation(key, fluids.OBS_GRID, obs_args).get_array())
+        stacks.append(simulator.get_stacked_observations(car_keys)[car_keys[0]].copy())
+    return records, observations, stacks
+
+for i in range(5):
+    simulator.step({})
+    simulator.get_stacked_observations(car_keys)
+
+snap = simulator.snapshot()
+expected = rollout(10)
+
+# Restoring in place, and rebuilding the State from the record alone, both branch off identically,
+# with the planned actions and the observation stacks of the snapshot
+for shapes in [True, False]:
+    if not shapes:
+        snap = dict(snap, state=dict(snap["state"], shapes=None))
+    # The abandoned timeline planned differently
+    simulator.next_actions = {k: fluids.VelocityAction(0) for k in simulator.next_actions}
+    simulator.restore(snap)
+    assert(state.time == snap["state"]["time"])
+    for a, b in zip(expected, rollout(10)):
+        for x, y in zip(a, b):
+            assert((x == y).all())
@@ -0,0 +1,52 @@
+import fluids
+from fluids.assets import Car, Pedestrian
+import numpy as np
+
+simulator = fluids.FluidSim(visualization_level=0,
+                            fps=0,
+                            background_control=fluids.BACKGROUND_CSP)
+
+state = fluids.State(
+    layout=fluids.STATE_CITY,
+    background_cars=4,
+    background_peds=3,
+    controlled_cars=1,
+    seed=0,
+    )
+
+simulator.set_state(state)
+arrays = state.get_arrays()
+rows = state.get_array_rows()
+assert(len(arrays["keys"]) == len(state.dynamic_objects))
+assert(len(state.type_map[Pedestrian]) == 3)
+for k, obj in state.dynamic_objects.items():
+    # Pedestrians used to be stored under the wrong object
+    assert(obj is state.objects[k])
+try:
+    arrays["position"][0] = 0
+    assert(False)
+except ValueError:
+    pass
+
+for i in range(5):
+    simulator.step({})
+    # The same arrays are updated in place every tick
+    for k, obj in state.dynamic_objects.items():
+        row = rows[k]
+        assert(arrays["keys"][row] == k)
+        assert((arrays["position"][row] == (obj.x, obj.y)).all())
+        assert(arrays["angle"][row] == obj.angle)
+        if type(obj) in [Car, Pedestrian]:
+            assert(arrays["vel"][row] == obj.vel)
+            assert((arrays["next_waypoint"][row] == (obj.waypoints[0].x, obj.waypoints[0].y)).all())
+        else:
+            assert(type(obj).phase_colors[arrays["phase"][row]] == obj.color)
+assert(set(arrays["keys"][arrays["controlled"]]) == set(state.controlled_cars))
+assert(set(arrays["keys"][arrays["background"]]) == set(state.background_cars))
+assert(state.get_arrays()["position"] is arrays["position"])
+
+snap = state.snapshot()
+position = arrays["position"].copy()
+simulator.step({})
+state.restore(snap)
+assert((arrays["position"] == position).all())
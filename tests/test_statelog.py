@@ -0,0 +1,64 @@
+import fluids
+from fluids.statelog import StateLogger, StateLog, replay
+import numpy as np
+import os
+import shutil
+import tempfile
+
+data_dir = tempfile.mkdtemp()
+
+simulator = fluids.FluidSim(visualization_level=0,
+                            fps=0,
+                            background_control=fluids.BACKGROUND_CSP)
+
+state = fluids.State(
+    layout=fluids.STATE_CITY,
+    background_cars=4,
+    background_peds=2,
+    controlled_cars=1,
+    )
+
+simulator.set_state(state)
+
+obs_args = {"obs_dim": 300, "shape": (40, 40)}
+data_path = os.path.join(data_dir, "data")
+log_path = os.path.join(data_dir, "log")
+data_saver = fluids.DataSaver(fluid_sim=simulator, file_path=data_path, batch_size=50, format="npy",
+                              obs={"obs_grid": (fluids.OBS_GRID, obs_args, {"dtype": np.uint8})})
+simulator.set_data_saver(data_saver)
+logger = StateLogger(simulator, log_path, batch_size=4)
+simulator.set_state_logger(logger)
+
+for i in range(10):
+    simulator.step({})
+data_saver.close()
+logger.close()
+
+log = StateLog(log_path)
+assert(len(log) == 10)
+assert((log.times == np.arange(1, 11) + log.times[0] - 1).all())
+assert(set(log.get_keys(controlled=False)) == set(state.background_cars))
+assert(set(log.get_keys(controlled=True)) == set(state.controlled_cars))
+assert((log.ticks[-1]['objects'] == state.get_record()).all())
+
+# A rebuilt state reproduces the record it was set to. Its lights have their own keys.
+replay_state = log.build_state()
+log.apply(replay_state, 5)
+record, logged = replay_state.get_record(), log.ticks[5]['objects']
+for name in record.dtype.names:
+    if name != "key":
+        assert((record[name] == logged[name]).all())
+assert(set(record['key'][record['type'] < 2]) == set(logged['key'][logged['type'] < 2]))
+assert(len(replay_state.background_cars) == len(state.background_cars))
+
+# Regenerated observations match the ones saved during the run
+keys = list(state.background_cars)
+saved = np.load(data_path + ".npy")["obs_grid"].reshape(10, len(keys), 40, 40, 11)
+for processes in [1, 2]:
+    regenerated = replay(log_path, fluids.OBS_GRID, obs_args, {"dtype": np.uint8}, keys=keys, processes=processes)
+    assert(regenerated.shape == saved.shape)
+    assert((regenerated == saved).all())
+
+simulator.set_data_saver(None)
+simulator.set_state_logger(None)
+shutil.rmtree(data_dir)
@@ -0,0 +1,51 @@
+import fluids
+from fluids.state import StaticWorld
+from fluids.vec import VecFluidSim
+import numpy as np
+
+state_args = {"controlled_cars": 1,
+              "background_cars": 3,
+              "background_peds": 2}
+
+# States built on a shared world match States that build their own
+world = StaticWorld(fluids.STATE_CITY, vis_level=0)
+a = fluids.State(vis_level=0, seed=4, world=world, **state_args)
+b = fluids.State(vis_level=0, seed=4, world=world, **state_args)
+c = fluids.State(vis_level=0, seed=4, **state_args)
+assert(a.static_objects is b.static_objects and a.static_geometry is world.static_geometry)
+assert(a.layout_hash == c.layout_hash)
+assert(not set(a.dynamic_objects) & set(b.dynamic_objects))
+for other in [b, c]:
+    for name in ['type', 'x', 'y', 'angle', 'waypoints']:
+        assert((a.get_record()[name] == other.get_record()[name]).all())
+assert(not world.static_geometry.points.flags.writeable)
+
+# Simulating one State leaves the world and the other States untouched
+record = b.get_record()
+sim = fluids.FluidSim(visualization_level=0, fps=0, obs_space=fluids.OBS_GRID,
+                      obs_args={"obs_dim": 300, "shape": (40, 40)},
+                      background_control=fluids.BACKGROUND_CSP)
+sim.set_state(a)
+for i in range(5):
+    sim.step({})
+    sim.get_observation(list(a.controlled_cars)[0]).get_array()
+assert(a.time == 5 and b.time == 0)
+assert((b.get_record() == record).all())
+
+# Workers that share a world step like workers that build their own
+outputs = []
+for share_world in [True, False]:
+    vec = VecFluidSim(2, state_args, obs_args={"obs_dim": 300, "shape": (40, 40)}, obs_dtype=np.uint8,
+                      horizon=3, seed=2, start_method="fork", share_world=share_world)
+    assert((vec.world is not None) == share_world)
+    steps = [vec.reset().copy()]
+    for i in range(4):
+        obs, rewards, dones = vec.step(np.zeros(vec.actions.shape))
+        steps.append((obs.copy(), rewards, dones))
+    memory = vec.get_memory_stats()
+    assert(memory["rss"].shape == (2,) and (memory["private"] <= memory["rss"]).all())
+    vec.close()
+    outputs.append(steps)
+assert((outputs[0][0] == outputs[1][0]).all())
+for (obs0, rewards0, dones0), (obs1, rewards1, dones1) in zip(outputs[0][1:], outputs[1][1:]):
+    assert((obs0 == obs1).all() and (rewards0 == rewards1).all() and (dones0 == dones1).all())
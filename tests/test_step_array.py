@@ -0,0 +1,52 @@
+import fluids
+import numpy as np
+
+def make_sim(background_control=fluids.BACKGROUND_CSP):
+    simulator = fluids.FluidSim(visualization_level=0,
+                                fps=0,
+                                background_control=background_control)
+    state = fluids.State(
+        layout=fluids.STATE_CITY,
+        background_cars=3,
+        background_peds=2,
+        controlled_cars=2,
+        seed=0,
+        )
+    simulator.set_state(state)
+    return simulator, state
+
+def make_action(action_type, row):
+    if action_type in [fluids.VelocityAction, fluids.SteeringAction]:
+        return action_type(row[0])
+    return action_type(*row)
+
+# step_array matches step with Action objects exactly, for every action type
+rng = np.random.RandomState(0)
+for action_type, width in [(fluids.SteeringAccAction, 2), (fluids.VelocityAction, 1),
+                           (fluids.SteeringVelAction, 2), (fluids.SteeringAction, 1)]:
+    sim_a, state_a = make_sim()
+    sim_b, state_b = make_sim()
+    keys_a, keys_b = list(state_a.controlled_cars), list(state_b.controlled_cars)
+    for i in range(8):
+        actions = rng.uniform(-1, 1, (len(keys_a), width))
+        if action_type in [fluids.VelocityAction, fluids.SteeringVelAction]:
+            actions[:, -1] = np.abs(actions[:, -1])
+        reward_a = sim_a.step({k: make_action(action_type, row) for k, row in zip(keys_a, actions)})
+        reward_b = sim_b.step_array(keys_b, actions, action_type)
+        assert(reward_a == reward_b)
+        record_a, record_b = state_a.get_record(), state_b.get_record()
+        for name in record_a.dtype.names:
+            if name != "key":
+                assert((record_a[name] == record_b[name]).all())
+    for k_a, k_b in zip(keys_a, keys_b):
+        car_a, car_b = state_a.objects[k_a], state_b.objects[k_b]
+        assert(car_a.PID_acc.integral_error == car_b.PID_acc.integral_error)
+        assert(car_a.PID_steer.integral_error == car_b.PID_steer.integral_error)
+
+# SteeringAction takes its acceleration from the planner, so it needs one
+sim, state = make_sim(fluids.BACKGROUND_NULL)
+try:
+    sim.step_array(list(state.controlled_cars), np.zeros(2), fluids.SteeringAction)
+    assert(False)
+except SystemExit:
+    pass
@@ -0,0 +1,107 @@
+import fluids
+from fluids.vec import VecFluidSim, VecEnv
+import numpy as np
+import gc
+import sys
+import multiprocessing
+
+state_args = {"layout": fluids.STATE_CITY,
+              "controlled_cars": 2,
+              "background_cars": 2,
+              "background_peds": 1}
+sim_args = {"background_control": fluids.BACKGROUND_CSP}
+obs_args = {"obs_dim": 300, "shape": (40, 40)}
+horizon = 4
+
+def make_vec(seed):
+    return VecFluidSim(2,
+                       state_args=state_args,
+                       sim_args=sim_args,
+                       obs_space=fluids.OBS_GRID,
+                       obs_args=obs_args,
+                       obs_dtype=np.uint8,
+                       horizon=horizon,
+                       done_on_collision=False,
+                       seed=seed)
+
+rng = np.random.RandomState(0)
+actions = rng.uniform(-1, 1, size=(horizon + 2, 2, 2, 2))
+
+vec = make_vec(5)
+assert(vec.obs_shape == (2, 2, 40, 40, 11))
+observations = [vec.reset().copy()]
+all_dones = []
+for a in actions:
+    obs, rewards, dones = vec.step(a)
+    assert(obs.dtype == np.uint8 and rewards.shape == (2,))
+    observations.append(obs.copy())
+    all_dones.append(dones)
+vec.close()
+assert([d.tolist() for d in all_dones] == [[i + 1 == horizon] * 2 for i in range(len(actions))])
+# Workers are seeded differently
+assert(not (observations[0][0] == observations[0][1]).all())
+
+# The workers match a simulation run in this process with the same seed
+env = VecEnv(np.random.SeedSequence(5).spawn(2)[1], dict(state_args, controlled_cars=2), sim_args,
+             fluids.OBS_GRID, obs_args, np.uint8, horizon, False, fluids.SteeringAccAction)
+env.reset()
+out = np.zeros((2, 40, 40, 11), dtype=np.uint8)
+env.write_obs(out)
+assert((out == observations[0][1]).all())
+for i, a in enumerate(actions):
+    env.step(a[1])
+    env.write_obs(out)
+    assert((out == observations[i + 1][1]).all())
+
+# The same seed gives the same episodes
+vec = make_vec(5)
+assert((vec.reset() == observations[0]).all())
+assert((vec.step(actions[0])[0] == observations[1]).all())
+
+# Stepping asynchronously gives the same episodes as stepping in lockstep
+steps = [1, 1]
+vec.send(actions[1])
+while min(steps) < len(actions):
+    env_ids, obs, rewards, dones = vec.recv()
+    assert(len(env_ids) >= 1 and obs.shape == (len(env_ids), 2, 40, 40, 11))
+    for i, env_id in enumerate(env_ids):
+        steps[env_id] += 1
+        assert((obs[i] == observations[steps[env_id]][env_id]).all())
+        assert(dones[i] == (steps[env_id] == horizon))
+    env_ids = [env_id for env_id in env_ids if steps[env_id] < len(actions)]
+    if env_ids:
+        vec.send([actions[steps[env_id]][env_id] for env_id in env_ids], env_ids)
+stats = vec.get_latency_stats()
+assert(stats["steps"].tolist() == [len(actions)] * 2)
+assert((stats["mean_step_time"] > 0).all())
+assert((stats["max_latency"] >= stats["max_step_time"]).all())
+vec.close()
+
+# Without obs_dtype, observations keep their natural type
+vec = VecFluidSim(1, state_args=state_args, sim_args=sim_args, obs_space=fluids.OBS_BIRDSEYE,
+                  obs_args={"obs_dim": 50}, seed=5)
+assert(vec.obs_shape == (1, 2, 50, 50, 3) and vec.reset().dtype == np.uint8)
+vec.close()
+vec = VecFluidSim(1, state_args=state_args, sim_args=sim_args, obs_space=fluids.OBS_QLIDAR, seed=5)
+assert(vec.reset().dtype == np.float64)
+vec.close()
+
+# Invalid arguments fail on their own, without close failing on the half built object
+errors = []
+sys.unraisablehook = errors.append
+try:
+    VecFluidSim(1, obs_space=fluids.OBS_NONE)
+    assert(False)
+except SystemExit:
+    pass
+gc.collect()
+sys.unraisablehook = sys.__unraisablehook__
+assert(not errors)
+
+# A worker that fails is reported, and its pool stops the workers
+try:
+    VecFluidSim(2, state_args=dict(state_args, controlled_cars=0), sim_args=sim_args, seed=5)
+    assert(False)
+except SystemExit:
+    pass
+assert(not multiprocessing.active_children())